@@ -1,32 +1,31 @@
+import aiohttp
 import asyncio
 import requests
 import os
-import subprocess
 import json
+import re
 import time
-from tools import file_handler, helper, async_ops, pipeline
+from collections.abc import AsyncIterator, Iterator
+from tools import file_handler, helper, async_ops, cache, datasets, pipeline
+from tools.record import AnnotationRecord
 TAXON_ID = os.getenv("TAXON_ID", "2759")
+EUKARYOTA_TAXON_ID = "2759"
 ENSEMBL_FTP_DIR = "https://ftp.ebi.ac.uk/pub/ensemblorganisms"
 SPECIES_URL = f"{ENSEMBL_FTP_DIR}/species.json"
-TMP_DIR = "tmp"
 OUTPUT_FILE = os.getenv("OUTPUT_FILE", "data/ensembl_annotations.tsv")
 FETCH_ATTEMPTS = 5
 DATASETS_ATTEMPTS = 3
+DOWNLOAD_CHUNK = 1 << 20
+# Ensembl publishes a new geneset under a new release date and URL.
+METADATA_FIELDS = ("assembly_name", "release_date", "pipeline_name")
+_WS = re.compile(r"\s*")
 
 
 def mirror_ensembl_annotations() -> None:
-    accessions_holder: list[str] = []
-
-    def load_universe() -> dict[str, dict]:
-        nonlocal accessions_holder
-        accessions_holder = fetch_eukaryotic_genomes()
-        species_path = fetch_ensembl_species()
-        return parse_annotations(species_path, accessions_holder)
-
-    def probe_md5(
-        tuples: list[tuple[str, str]], concurrency: int, parsed: dict[str, dict]
-    ) -> list[async_ops.ProbeResult]:
-        return asyncio.run(async_ops.stream_md5_checksum_many(tuples, concurrency))
+    async def probe_md5(
+        session: aiohttp.ClientSession, url: str, key: str, parsed: dict[str, dict]
+    ) -> async_ops.ProbeResult:
+        return await async_ops.probe_stream_md5(session, url, key)
 
     stats_path = os.getenv(
         "MIRROR_STATS_FILE",
@@ -40,14 +39,50 @@ def mirror_ensembl_annotations() -> None:
     pipeline.run_mirror(
         output_file=OUTPUT_FILE,
         key_column="access_url",
-        load_universe=load_universe,
+        stream_universe=stream_universe,
         probe_md5=probe_md5,
         source_label="ensembl",
         stats_path=stats_path,
         outcomes_path=outcomes_path,
+        validator_cache=cache.ValidatorCache(cache.cache_path("validators_ensembl.json")),
+        metadata_fields=METADATA_FIELDS,
     )
 
 
+async def stream_universe() -> AsyncIterator[dict[str, dict]]:
+    """
+    Universe loading as a small task graph. For eukaryotes, species.json comes
+    first, then its own accessions are checked in concurrent datasets batches
+    and each batch's annotations are yielded as soon as it resolves, so
+    probing starts early. Other taxa fetch species.json and the taxon listing
+    concurrently and yield once.
+    """
+    if TAXON_ID != EUKARYOTA_TAXON_ID:
+        by_accession, accessions = await asyncio.gather(
+            asyncio.to_thread(load_species_annotations),
+            asyncio.to_thread(fetch_eukaryotic_genomes),
+        )
+        yield parse_annotations(by_accession, accessions)
+        return
+
+    # Every Ensembl organism is a eukaryote: only check species.json's own accessions.
+    # An accession the lookup fails on must not count as missing (its rows
+    # would be dropped as gone), so such a failure aborts the run.
+    by_accession = await asyncio.to_thread(load_species_annotations)
+    found = 0
+    async for batch in datasets.iter_summary_batches(
+        list(by_accession), report="ids_only", skip_failed=False
+    ):
+        found += len(batch)
+        annotations: dict = {}
+        for acc in batch:
+            annotations.update(by_accession[acc])
+        yield annotations
+    print(f"[ensembl] {found} of {len(by_accession)} species.json accessions found in NCBI")
+    if not found:
+        raise RuntimeError("datasets resolved none of the species.json accessions")
+
+
 def fetch_eukaryotic_genomes() -> list[str]:
     cmd = [
         "datasets",
@@ -62,18 +97,12 @@ def fetch_eukaryotic_genomes() -> list[str]:
     last_err: Exception | None = None
     for attempt in range(DATASETS_ATTEMPTS):
         try:
-            proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-            if proc.returncode != 0:
-                raise RuntimeError(f"datasets exited {proc.returncode}: {proc.stderr[:500]}")
             accessions = []
-            for line in proc.stdout.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
+            for obj in datasets.iter_json_lines(cmd):
                 try:
-                    accessions.append(json.loads(line)["accession"])
+                    accessions.append(obj["accession"])
                 except Exception as e:
-                    print(f"Error parsing line: {line[:80]}... {e}")
+                    print(f"Error parsing line: {str(obj)[:80]}... {e}")
             if accessions:
                 return accessions
             raise RuntimeError("datasets returned zero accessions")
@@ -84,29 +113,96 @@ def fetch_eukaryotic_genomes() -> list[str]:
     raise RuntimeError(f"Failed to fetch eukaryotic genomes: {last_err}")
 
 
-def parse_annotations(species_path: str, accessions: list[str]) -> dict:
-    accessions_set = set(accessions)
+def parse_annotations(by_accession: dict[str, dict], accessions: list[str]) -> dict:
     parsed_annotations_dict: dict = {}
-    with open(species_path, "r") as f:
-        species_data = json.load(f).get("species", {})
-        for species_info in species_data.values():
-            species_annotations = _parse_species_annotations(species_info, accessions_set)
-            parsed_annotations_dict.update(species_annotations)
+    for accession in set(accessions) & by_accession.keys():
+        parsed_annotations_dict.update(by_accession[accession])
     return parsed_annotations_dict
 
 
-def _parse_species_annotations(species_info: dict, accessions: set[str]) -> dict:
-    annotations = {}
+def load_species_annotations() -> dict[str, dict]:
+    species_path = fetch_ensembl_species()
+    try:
+        return parse_species_file(species_path)
+    except (ValueError, RuntimeError):
+        # Drop the bad copy so the next run downloads it again instead of
+        # revalidating it with a 304.
+        os.remove(species_path)
+        raise
+
+
+def parse_species_file(species_path: str) -> dict[str, dict]:
+    """Annotations per assembly accession, walking species.json one species at a time."""
+    by_accession: dict[str, dict] = {}
+    species = 0
+    for _, species_info in iter_species(species_path):
+        species += 1
+        for accession, annotations in _parse_species_assemblies(species_info).items():
+            by_accession[accession] = {
+                url: AnnotationRecord(**row) for url, row in annotations.items()
+            }
+    if not species:
+        raise RuntimeError("species.json has no species")
+    return by_accession
+
+
+def iter_species(species_path: str) -> Iterator[tuple[str, dict]]:
+    """
+    (name, decoded value) for each member of the top-level "species" object.
+    Members are decoded one at a time, so the document is never built as a
+    whole. Raises ValueError on malformed input.
+    """
+    with open(species_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    try:
+        pos = _expect(text, 0, "{")
+        while _peek(text, pos) != "}":
+            key, pos = decoder.raw_decode(text, _skip_ws(text, pos))
+            pos = _skip_ws(text, _expect(text, pos, ":"))
+            if key == "species":
+                pos = _expect(text, pos, "{")
+                while _peek(text, pos) != "}":
+                    name, pos = decoder.raw_decode(text, _skip_ws(text, pos))
+                    value, pos = decoder.raw_decode(text, _skip_ws(text, _expect(text, pos, ":")))
+                    yield name, value
+                    pos = _next_member(text, pos)
+                pos = _skip_ws(text, pos) + 1
+            else:
+                _, pos = decoder.raw_decode(text, pos)
+            pos = _next_member(text, pos)
+    except IndexError:
+        raise ValueError("species.json ended unexpectedly") from None
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    return _WS.match(text, pos).end()
+
+
+def _peek(text: str, pos: int) -> str:
+    return text[_skip_ws(text, pos)]
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+    pos = _skip_ws(text, pos)
+    if text[pos] != char:
+        raise ValueError(f"species.json: expected {char!r} at offset {pos}")
+    return pos + 1
+
+
+def _next_member(text: str, pos: int) -> int:
+    """Position after a member's trailing comma, or at the closing brace."""
+    pos = _skip_ws(text, pos)
+    return pos + 1 if text[pos] == "," else pos
+
+
+def _parse_species_assemblies(species_info: dict) -> dict[str, dict]:
     taxon_id = species_info.get("taxid")
     organism_name = species_info.get("scientific_name")
-    assemblies = species_info.get("assemblies", {})
-    for assembly_accession, assembly_data in assemblies.items():
-        if assembly_accession in accessions:
-            assembly_annotations = _parse_assembly_annotations(
-                assembly_accession, assembly_data, taxon_id, organism_name
-            )
-            annotations.update(assembly_annotations)
-    return annotations
+    return {
+        accession: _parse_assembly_annotations(accession, assembly_data, taxon_id, organism_name)
+        for accession, assembly_data in species_info.get("assemblies", {}).items()
+    }
 
 
 def _parse_assembly_annotations(
@@ -175,7 +271,7 @@ def _create_annotation(
     assembly_name: str,
     taxon_id: str,
     organism_name: str,
-) -> dict | None:
+) -> AnnotationRecord | None:
     release_date = format_release_date(info.get("release"))
     sub_path = (
         info.get("paths", {})
@@ -187,20 +283,20 @@ def _create_annotation(
     if not sub_path:
         return None
     access_url = f"{ENSEMBL_FTP_DIR}/{sub_path}"
-    return {
-        "assembly_accession": assembly_accession,
-        "assembly_name": assembly_name,
-        "taxon_id": taxon_id,
-        "organism_name": organism_name,
-        "source_database": "Ensembl",
-        "annotation_provider": provider_name,
-        "access_url": access_url,
-        "file_format": "gff",
-        "release_date": release_date,
-        "pipeline_name": pipeline_name,
-        "pipeline_method": None,
-        "pipeline_version": None,
-    }
+    return AnnotationRecord(
+        assembly_accession=assembly_accession,
+        assembly_name=assembly_name,
+        taxon_id=taxon_id,
+        organism_name=organism_name,
+        source_database="Ensembl",
+        annotation_provider=provider_name,
+        access_url=access_url,
+        file_format="gff",
+        release_date=release_date,
+        pipeline_name=pipeline_name,
+        pipeline_method=None,
+        pipeline_version=None,
+    )
 
 
 def format_release_date(release_date: str) -> str:
@@ -209,18 +305,32 @@ def format_release_date(release_date: str) -> str:
 
 
 def fetch_ensembl_species() -> str:
+    """
+    Path to a current copy of species.json. The copy lives in the mirror cache
+    and is revalidated with If-None-Match / If-Modified-Since, so an unchanged
+    file is not downloaded again; a changed one is streamed straight to disk
+    and only parsed later, by parse_species_file.
+    """
+    path = cache.cache_path("species.json")
+    validators = cache.ValidatorCache(cache.cache_path("validators_species.json"))
     last_err: Exception | None = None
     for attempt in range(FETCH_ATTEMPTS):
         try:
-            response = requests.get(SPECIES_URL, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-            if not data.get("species"):
-                raise RuntimeError("species.json missing 'species' key")
-            os.makedirs(TMP_DIR, exist_ok=True)
-            path = os.path.join(TMP_DIR, "species.json")
-            with open(path, "w") as f:
-                json.dump(data, f)
+            stored = validators.get(SPECIES_URL) if os.path.isfile(path) else None
+            with requests.get(
+                SPECIES_URL, headers=cache.conditional_headers(stored), timeout=60, stream=True
+            ) as response:
+                if response.status_code == 304 and stored:
+                    print("[ensembl] species.json not modified, using cached copy")
+                    return path
+                response.raise_for_status()
+                tmp = f"{path}.tmp"
+                with open(tmp, "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK):
+                        f.write(chunk)
+                os.replace(tmp, path)
+                validators.record(SPECIES_URL, cache.validators_from_headers(response.headers))
+            validators.save()
             return path
         except Exception as e:
             last_err = e
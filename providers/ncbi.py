@@ -1,16 +1,35 @@
-import asyncio
 import aiohttp
-import json
+import asyncio
 import re
-import subprocess
 import os
 import argparse
 import time
-from tools import file_handler, async_ops, helper, pipeline
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from tools import file_handler, async_ops, cache, datasets, helper, pipeline
+from tools.record import AnnotationRecord
 TAXON_ID = os.getenv("TAXON_ID", "2759")
 GENBANK_OUTPUT_FILE = os.getenv("GENBANK_OUTPUT_FILE", "data/genbank_annotations.tsv")
 REFSEQ_OUTPUT_FILE = os.getenv("REFSEQ_OUTPUT_FILE", "data/refseq_annotations.tsv")
 DATASETS_ATTEMPTS = 3
+# Directory listings kept per run; resolved paths persist for RESOLVED_PATH_TTL_DAYS,
+# "not found" answers for MISSING_PATH_TTL_DAYS.
+LISTING_CACHE_SLOTS = 512
+RESOLVED_PATH_TTL_DAYS = 30
+MISSING_PATH_TTL_DAYS = 3
+# "combined": one annotated listing for the taxon, split by accession prefix
+# and shared by both mirrors as a snapshot; "per_source": one listing each.
+UNIVERSE_MODE = os.getenv("NCBI_UNIVERSE_MODE", "combined")
+SNAPSHOT_MAX_AGE_HOURS = float(os.getenv("NCBI_SNAPSHOT_MAX_AGE_HOURS", "24"))
+# Older snapshots are refreshed with assemblies released after their watermark
+# (minus WATERMARK_OVERLAP_DAYS); a full listing runs every RECONCILE_DAYS.
+RECONCILE_DAYS = float(os.getenv("NCBI_RECONCILE_DAYS", "28"))
+WATERMARK_OVERLAP_DAYS = 1
+SOURCE_BY_PREFIX = {"GCA": "GenBank", "GCF": "RefSeq"}
+# A new NCBI annotation release changes at least one of these.
+METADATA_FIELDS = ("assembly_name", "release_date", "pipeline_version")
 
 NCBI_MAPPER = {
     "genbank": {
@@ -31,13 +50,13 @@ def mirror_ncbi_annotations(db_source: str) -> None:
             f"{db_source} is not a valid database source, must be one of {NCBI_MAPPER.keys()}"
         )
 
-    def load_universe() -> dict[str, dict]:
-        return fetch_and_parse_ncbi_annotated_assemblies(TAXON_ID, db_map["db_name"])
+    # Keys whose metadata came from this run's datasets listing.
+    listed: set[str] = set()
 
-    def probe_md5(
-        tuples: list[tuple[str, str]], concurrency: int, parsed: dict[str, dict]
-    ) -> list[async_ops.ProbeResult]:
-        return asyncio.run(_probe_ncbi_md5_many(tuples, concurrency, parsed))
+    def load_universe() -> dict[str, dict]:
+        rows, current = load_ncbi_universe(TAXON_ID, db_map["db_name"])
+        listed.update(current)
+        return rows
 
     stats_path = os.getenv(
         "MIRROR_STATS_FILE",
@@ -47,19 +66,148 @@ def mirror_ncbi_annotations(db_source: str) -> None:
         "MIRROR_OUTCOMES_FILE",
         os.path.join(os.path.dirname(db_map["output_file"]), f".mirror_outcomes_{db_source}.json"),
     )
+    resolver = FtpPathResolver(
+        cache.ExpiringCache(
+            cache.cache_path(f"ftp_paths_{db_source}.json"),
+            ttl_days=RESOLVED_PATH_TTL_DAYS,
+            negative_ttl_days=MISSING_PATH_TTL_DAYS,
+        )
+    )
 
     pipeline.run_mirror(
         output_file=db_map["output_file"],
         key_column="assembly_accession",
         load_universe=load_universe,
-        probe_md5=probe_md5,
+        probe_md5=partial(_probe_ncbi_md5_one, resolver=resolver),
+        probe_last_modified=_probe_ncbi_checksums,
         source_label=db_source,
         stats_path=stats_path,
         outcomes_path=outcomes_path,
+        validator_cache=cache.ValidatorCache(
+            cache.cache_path(f"validators_{db_source}.json")
+        ),
+        metadata_fields=METADATA_FIELDS,
+        metadata_current=listed.__contains__,
+    )
+    resolver.save()
+
+
+def load_ncbi_universe(taxon_id: str, db_name: str) -> tuple[dict[str, dict], set[str]]:
+    """(rows of db_name, keys whose metadata the latest listing returned)."""
+    if UNIVERSE_MODE == "per_source":
+        rows = fetch_and_parse_ncbi_annotated_assemblies(taxon_id, db_name)
+        return rows, set(rows)
+    sources, listed = load_annotated_snapshot(taxon_id)
+    return sources.get(db_name, {}), listed.get(db_name, set())
+
+
+def load_annotated_snapshot(
+    taxon_id: str,
+    path: str | None = None,
+    max_age_hours: float = SNAPSHOT_MAX_AGE_HOURS,
+    reconcile_days: float = RECONCILE_DAYS,
+) -> tuple[dict[str, dict[str, dict]], dict[str, set[str]]]:
+    """
+    Annotated assemblies for taxon_id split by source database, from a single
+    datasets listing shared by the GenBank and RefSeq mirrors. The listing is
+    saved as a snapshot and reused while younger than max_age_hours. An older
+    snapshot is brought up to date with only the assemblies released since its
+    watermark; every reconcile_days a full listing replaces it, which is what
+    drops assemblies NCBI has withdrawn.
+    Returns (rows per source, keys per source that the latest listing
+    returned): every key after a full listing, only the delta's otherwise.
+    The metadata of the other rows is as old as the last reconcile.
+    """
+    path = path or cache.cache_path(f"ncbi_annotated_{taxon_id}.json")
+    now = datetime.now(timezone.utc)
+    snapshot = cache.read_json(path, None)
+    if not snapshot or snapshot.get("taxon_id") != taxon_id:
+        snapshot = None
+    age = _snapshot_age(snapshot, "created", now)
+    if age is not None and age < timedelta(hours=max_age_hours):
+        hours = age.total_seconds() / 3600
+        print(f"[ncbi] Reusing annotated snapshot from {hours:.1f}h ago")
+        listed = snapshot.get("listed") or {}
+        return _as_records(snapshot["sources"]), {s: set(keys) for s, keys in listed.items()}
+
+    sources = None
+    since_reconcile = _snapshot_age(snapshot, "reconciled", now)
+    if (
+        since_reconcile is not None
+        and since_reconcile < timedelta(days=reconcile_days)
+        and snapshot.get("watermark")
+    ):
+        try:
+            changed = fetch_annotated_snapshot(taxon_id, released_after=snapshot["watermark"])
+        except RuntimeError as e:
+            print(f"[ncbi] Delta listing failed, falling back to a full listing: {e}")
+        else:
+            sources = _as_records(snapshot["sources"])
+            for db_source, rows in changed.items():
+                sources.setdefault(db_source, {}).update(rows)
+            reconciled = snapshot["reconciled"]
+            print(
+                f"[ncbi] Merged {sum(map(len, changed.values()))} assemblies released "
+                f"after {snapshot['watermark']} into the annotated snapshot"
+            )
+    if sources is None:
+        changed = sources = fetch_annotated_snapshot(taxon_id)
+        reconciled = now.isoformat()
+
+    cache.write_json_atomic(
+        path,
+        {
+            "taxon_id": taxon_id,
+            "created": now.isoformat(),
+            "reconciled": reconciled,
+            "watermark": (now.date() - timedelta(days=WATERMARK_OVERLAP_DAYS)).isoformat(),
+            "listed": {db_source: list(rows) for db_source, rows in changed.items()},
+            "sources": sources,
+        },
+    )
+    return sources, {db_source: set(rows) for db_source, rows in changed.items()}
+
+
+def _as_records(sources: dict[str, dict[str, dict]]) -> dict[str, dict[str, AnnotationRecord]]:
+    return {
+        db_source: {key: AnnotationRecord(**row) for key, row in rows.items()}
+        for db_source, rows in sources.items()
+    }
+
+
+def _snapshot_age(snapshot: dict | None, field: str, now: datetime) -> timedelta | None:
+    if not snapshot:
+        return None
+    try:
+        return now - datetime.fromisoformat(snapshot[field])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def fetch_annotated_snapshot(
+    taxon_id: str, released_after: str | None = None
+) -> dict[str, dict[str, dict]]:
+    """One annotated listing for both sources; released_after (YYYY-MM-DD) asks for a delta."""
+    cmd = [
+        "datasets",
+        "summary",
+        "genome",
+        "taxon",
+        taxon_id,
+        "--annotated",
+        "--as-json-lines",
+    ]
+    if released_after:
+        cmd += ["--released-after", released_after]
+    return _collect_annotated(
+        cmd,
+        lambda obj: SOURCE_BY_PREFIX.get(obj.get("accession", "")[:3]),
+        allow_empty=released_after is not None,
     )
 
 
 def fetch_and_parse_ncbi_annotated_assemblies(taxon_id: str, db_source: str) -> dict[str, dict]:
+    """Annotated assemblies for taxon_id from one datasets listing."""
     cmd = [
         "datasets",
         "summary",
@@ -71,31 +219,33 @@ def fetch_and_parse_ncbi_annotated_assemblies(taxon_id: str, db_source: str) ->
         db_source,
         "--as-json-lines",
     ]
+    return _collect_annotated(cmd, lambda obj: db_source)[db_source]
+
+
+def _collect_annotated(
+    cmd: list[str], source_of: Callable[[dict], str | None], allow_empty: bool = False
+) -> dict[str, dict[str, dict]]:
+    """
+    Parsed rows per source database (source_of(record); None skips it). An
+    empty listing is treated as a failure unless allow_empty.
+    """
     last_err: Exception | None = None
     for attempt in range(DATASETS_ATTEMPTS):
         try:
-            proc = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if proc.returncode != 0:
-                raise RuntimeError(
-                    f"datasets exited {proc.returncode}: {proc.stderr[:500]}"
-                )
-            parsed: dict[str, dict] = {}
-            for line in proc.stdout.splitlines():
-                line = line.strip()
-                if not line:
+            sources: dict[str, dict[str, dict]] = {}
+            for obj in datasets.iter_json_lines(cmd):
+                db_source = source_of(obj)
+                if db_source is None:
                     continue
                 try:
-                    parsed_annotation = parse_json_line(json.loads(line), db_source)
-                    parsed[parsed_annotation["assembly_accession"]] = parsed_annotation
+                    parsed_annotation = parse_json_line(obj, db_source)
                 except Exception as e:
-                    print(f"Error parsing line: {line[:120]}... {e}")
-            if parsed:
-                return parsed
+                    print(f"Error parsing line: {str(obj)[:120]}... {e}")
+                    continue
+                rows = sources.setdefault(db_source, {})
+                rows[parsed_annotation["assembly_accession"]] = parsed_annotation
+            if sources or allow_empty:
+                return sources
             raise RuntimeError("datasets returned zero assemblies")
         except Exception as e:
             last_err = e
@@ -120,43 +270,63 @@ def get_minimal_ftp_path(ftp_path: str) -> str:
     return "/".join(parts[:9]) + "/"
 
 
-async def _scrape_ftp_directory_listing(session: aiohttp.ClientSession, url: str) -> list[str]:
-    result = await async_ops.request_with_retry(session, "GET", url)
-    if result is None:
-        return []
-    status, _ = result
-    if status >= 400:
-        return []
-    try:
-        async with session.get(url, allow_redirects=True) as resp:
-            content = await resp.text()
-    except Exception:
-        return []
-    dirs = re.findall(r'href="([^"]+/)"', content)
+def _parse_directory_listing(content: str) -> list[str]:
     out = []
-    for d in dirs:
+    for d in re.findall(r'href="([^"]+/)"', content):
         name = d.rstrip("/").split("/")[-1]
         if name and name not in (".", ".."):
             out.append(name)
     return out
 
 
-async def resolve_and_fetch_md5(
-    session: aiohttp.ClientSession, ftp_path: str, accession: str
-) -> tuple[str | None, str | None]:
-    minimal = get_minimal_ftp_path(ftp_path)
-    dirs = await _scrape_ftp_directory_listing(session, minimal)
-    if not dirs:
-        return None, None
-    candidates = [d for d in dirs if d == accession or d.startswith(accession + "_")]
-    if not candidates:
-        candidates = dirs
-    for dirname in candidates:
-        base = f"{minimal}{dirname}/"
-        checksums_url = f"{base}uncompressed_checksums.txt"
-        text_result = await async_ops.fetch_url_text(session, checksums_url, accession)
+class FtpPathResolver:
+    """
+    Finds the real assembly directory when the predicted FTP path 404s.
+    Resolved directories (and misses) persist across runs in an
+    ExpiringCache keyed by accession; directory listings are kept in an
+    in-run LRU keyed by minimal path, shared by concurrent lookups.
+    """
+
+    def __init__(
+        self,
+        resolved: cache.ExpiringCache | None = None,
+        listing_slots: int = LISTING_CACHE_SLOTS,
+    ) -> None:
+        self.resolved = resolved
+        self.listing_slots = listing_slots
+        self._listings: OrderedDict[str, asyncio.Future] = OrderedDict()
+
+    async def listing(self, session: aiohttp.ClientSession, minimal: str) -> list[str] | None:
+        """Subdirectory names under minimal; None on a transient failure."""
+        fut = self._listings.get(minimal)
+        if fut is not None:
+            self._listings.move_to_end(minimal)
+            return await asyncio.shield(fut)
+        fut = asyncio.ensure_future(self._fetch_listing(session, minimal))
+        self._listings[minimal] = fut
+        while len(self._listings) > self.listing_slots:
+            self._listings.popitem(last=False)
+        names = await asyncio.shield(fut)
+        if names is None and self._listings.get(minimal) is fut:
+            del self._listings[minimal]  # don't remember transient failures
+        return names
+
+    async def _fetch_listing(self, session: aiohttp.ClientSession, url: str) -> list[str] | None:
+        result = await async_ops.fetch_url_text(session, url, url)
+        if result.status == "not_found":
+            return []
+        if result.status != "ok" or result.value is None:
+            return None
+        return _parse_directory_listing(result.value)
+
+    async def _md5_in_dir(
+        self, session: aiohttp.ClientSession, base: str, accession: str
+    ) -> tuple[async_ops.ProbeResult, str | None, str | None]:
+        text_result = await async_ops.fetch_url_text(
+            session, f"{base}uncompressed_checksums.txt", accession
+        )
         if text_result.status != "ok" or not text_result.value:
-            continue
+            return text_result, None, None
         for line in text_result.value.split("\n"):
             if not line.strip():
                 continue
@@ -165,69 +335,157 @@ async def resolve_and_fetch_md5(
                 gff_name = parts[0].strip().lstrip("./")
                 if gff_name.endswith(".gff") and not gff_name.endswith(".gff.gz"):
                     gff_name += ".gz"
-                return parts[1].strip(), f"{base}{gff_name}"
-    return None, None
+                return text_result, parts[1].strip(), f"{base}{gff_name}"
+        return text_result, None, None
+
+    async def resolve_and_fetch_md5(
+        self, session: aiohttp.ClientSession, ftp_path: str, accession: str
+    ) -> tuple[str | None, str | None]:
+        minimal = get_minimal_ftp_path(ftp_path)
+        if self.resolved is not None:
+            hit, dirname = self.resolved.lookup(accession)
+            if hit and dirname is None:
+                return None, None
+            if hit:
+                _, md5, url = await self._md5_in_dir(session, f"{minimal}{dirname}/", accession)
+                if md5:
+                    return md5, url
+                self.resolved.discard(accession)
+
+        dirs = await self.listing(session, minimal)
+        if dirs is None:
+            return None, None
+        candidates = [d for d in dirs if d == accession or d.startswith(accession + "_")]
+        if not candidates:
+            candidates = dirs
+        transient = False
+        for dirname in candidates:
+            result, md5, url = await self._md5_in_dir(session, f"{minimal}{dirname}/", accession)
+            if md5:
+                if self.resolved is not None:
+                    self.resolved.put(accession, dirname)
+                return md5, url
+            transient = transient or result.status == "transient_error"
+        if self.resolved is not None and not transient:
+            self.resolved.put(accession, None)
+        return None, None
+
+    def save(self) -> None:
+        if self.resolved is not None:
+            self.resolved.save()
 
 
-def parse_json_line(line: dict, db_source: str) -> dict:
+def parse_json_line(line: dict, db_source: str) -> AnnotationRecord:
     organism_info = line.get("organism", {})
     annotation_info = line.get("annotation_info", {})
     assembly_info = line.get("assembly_info", {})
     access_url = create_ftp_path(line["accession"], assembly_info.get("assembly_name"))
-    return {
-        "assembly_accession": line["accession"],
-        "assembly_name": assembly_info.get("assembly_name"),
-        "taxon_id": organism_info.get("tax_id"),
-        "organism_name": organism_info.get("organism_name"),
-        "source_database": db_source,
-        "annotation_provider": annotation_info.get("provider"),
-        "access_url": access_url,
-        "file_format": "gff",
-        "release_date": annotation_info.get("release_date"),
-        "pipeline_name": annotation_info.get("pipeline"),
-        "pipeline_method": annotation_info.get("method"),
-        "pipeline_version": annotation_info.get("software_version"),
-    }
+    return AnnotationRecord(
+        assembly_accession=line["accession"],
+        assembly_name=assembly_info.get("assembly_name"),
+        taxon_id=organism_info.get("tax_id"),
+        organism_name=organism_info.get("organism_name"),
+        source_database=db_source,
+        annotation_provider=annotation_info.get("provider"),
+        access_url=access_url,
+        file_format="gff",
+        release_date=annotation_info.get("release_date"),
+        pipeline_name=annotation_info.get("pipeline"),
+        pipeline_method=annotation_info.get("method"),
+        pipeline_version=annotation_info.get("software_version"),
+    )
+
+
+def _checksums_url(ftp_path: str) -> str:
+    return f"{ftp_path.rsplit('/', 1)[0]}/uncompressed_checksums.txt"
+
+
+def _gff_md5_from_checksums(text: str) -> str | None:
+    for line in text.split("\n"):
+        if not line.strip():
+            continue
+        splitted = line.split("\t")
+        if "genomic.gff" in splitted[0] and len(splitted) >= 2:
+            return splitted[1].strip()
+    return None
+
+
+async def _probe_ncbi_checksums(
+    session: aiohttp.ClientSession, url: str, key: str, *, validators: dict | None = None
+) -> async_ops.ProbeResult:
+    """
+    Last-modified probe reading uncompressed_checksums.txt once: the date comes
+    from its Last-Modified header and the GFF MD5 from its body, so the MD5
+    stage needs no further request. Falls back to probing the GFF itself when
+    the checksums file is missing or unusable.
+    """
+    text_result = await async_ops.fetch_url_text(
+        session, _checksums_url(url), key, validators=validators
+    )
+    if text_result.status == "not_modified":
+        return text_result
+    if text_result.status == "ok" and text_result.value:
+        md5 = _gff_md5_from_checksums(text_result.value)
+        lm = async_ops.http_date_to_iso((text_result.validators or {}).get("last_modified"))
+        if md5 and lm:
+            return async_ops.ProbeResult(
+                key=key,
+                status="ok",
+                value=lm,
+                detail="checksums_file",
+                validators=text_result.validators,
+                md5=md5,
+            )
+    result = await async_ops.probe_last_modified(session, url, key)
+    # Validators of the GFF must not be replayed against the checksums file.
+    result.validators = None
+    return result
 
 
 async def _fetch_md5_from_checksums_file(
     session: aiohttp.ClientSession, ftp_path: str, key: str
 ) -> async_ops.ProbeResult:
-    base_path = ftp_path.rsplit("/", 1)[0]
-    url = f"{base_path}/uncompressed_checksums.txt"
-    text_result = await async_ops.fetch_url_text(session, url, key)
+    text_result = await async_ops.fetch_url_text(session, _checksums_url(ftp_path), key)
     if text_result.status == "not_found":
         return async_ops.ProbeResult(key=key, status="not_found", detail=text_result.detail)
     if text_result.status != "ok" or not text_result.value:
         return async_ops.ProbeResult(
             key=key, status="transient_error", detail=text_result.detail or "checksums_fetch_failed"
         )
-    for line in text_result.value.split("\n"):
-        if not line.strip():
-            continue
-        splitted = line.split("\t")
-        if "genomic.gff" in splitted[0] and len(splitted) >= 2:
-            return async_ops.ProbeResult(
-                key=key, status="ok", value=splitted[1].strip(), detail="checksums_file"
-            )
+    md5 = _gff_md5_from_checksums(text_result.value)
+    if md5:
+        return async_ops.ProbeResult(
+            key=key,
+            status="ok",
+            value=md5,
+            detail="checksums_file",
+            last_modified=async_ops.http_date_to_iso(
+                (text_result.validators or {}).get("last_modified")
+            ),
+        )
     return async_ops.ProbeResult(key=key, status="transient_error", detail="no_gff_in_checksums")
 
 
 async def _probe_ncbi_md5_one(
-    session: aiohttp.ClientSession, url: str, key: str, parsed_updates: dict
+    session: aiohttp.ClientSession,
+    url: str,
+    key: str,
+    parsed_updates: dict,
+    *,
+    resolver: FtpPathResolver,
 ) -> async_ops.ProbeResult:
     result = await _fetch_md5_from_checksums_file(session, url, key)
     if result.status == "ok":
         return result
     if result.status == "not_found":
-        md5, resolved_url = await resolve_and_fetch_md5(session, url, key)
+        md5, resolved_url = await resolver.resolve_and_fetch_md5(session, url, key)
         if md5:
             if key in parsed_updates and resolved_url:
                 parsed_updates[key]["access_url"] = resolved_url
             return async_ops.ProbeResult(key=key, status="ok", value=md5, detail="ftp_scraper")
         return async_ops.ProbeResult(key=key, status="not_found", detail="scraper_not_found")
     # transient — try scraper before giving up
-    md5, resolved_url = await resolve_and_fetch_md5(session, url, key)
+    md5, resolved_url = await resolver.resolve_and_fetch_md5(session, url, key)
     if md5:
         if key in parsed_updates and resolved_url:
             parsed_updates[key]["access_url"] = resolved_url
@@ -235,15 +493,6 @@ async def _probe_ncbi_md5_one(
     return result
 
 
-async def _probe_ncbi_md5_many(
-    tuples: list[tuple[str, str]], concurrency: int, parsed: dict[str, dict]
-) -> list[async_ops.ProbeResult]:
-    async def bound(session: aiohttp.ClientSession, url: str, key: str) -> async_ops.ProbeResult:
-        return await _probe_ncbi_md5_one(session, url, key, parsed)
-
-    return await async_ops.probe_many(tuples, bound, concurrency)
-
-
 def apply_parsed_updates(parsed: dict[str, dict], updates: dict[str, dict]) -> None:
     for k, v in updates.items():
         if k in parsed and "access_url" in v:
@@ -4,43 +4,53 @@ Mirror community annotations from annotrieve-registry project folders.
 
 from __future__ import annotations
 
-import asyncio
-import csv
-import json
+import hashlib
 import os
-import subprocess
-import tempfile
-import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import aiohttp
 import yaml
 
-from tools import async_ops, file_handler, pipeline
+from tools import async_ops, cache, datasets, file_handler, pipeline
+from tools.metadata_store import AssemblyMetadataStore
+from tools.record import AnnotationRecord, copy_row
 
 REGISTRY_ROOT = os.getenv("REGISTRY_ROOT", "../annotrieve-registry")
 OUTPUT_FILE = os.getenv("OUTPUT_FILE", "data/community_annotations.tsv")
 KEY_COLUMN = "access_url"
 EXCLUDED_PROJECTS = frozenset({"sample_project"})
 REQUIRED_TSV_HEADER = "assembly_accession\taccess_url"
-DATASETS_BATCH_SIZE = 2000
-DATASETS_ATTEMPTS = 3
-DATASETS_TIMEOUT = 300
+DATASETS_BATCH_SIZE = datasets.DATASETS_BATCH_SIZE
+METADATA_STORE = "assembly_metadata.sqlite"
+# Parsed projects reused while their files are unchanged; bump the version
+# when the cached manifest/rows format changes.
+SCAN_CACHE = "registry_scan.json"
+SCAN_CACHE_VERSION = 1
+SCAN_WORKERS = min(8, os.cpu_count() or 1)
+MANIFEST_FIELDS = ("provider_name", "pipeline_method", "pipeline_version")
 
 
 def mirror_registry_annotations() -> None:
     existing, _ = file_handler.load_annotations_ordered(OUTPUT_FILE, KEY_COLUMN)
 
     def load_universe() -> dict[str, dict]:
-        parsed = scan_registry(REGISTRY_ROOT)
+        with AssemblyMetadataStore(cache.cache_path(METADATA_STORE)) as store:
+            parsed = scan_registry(
+                REGISTRY_ROOT,
+                metadata_store=store,
+                scan_cache_path=cache.cache_path(SCAN_CACHE),
+            )
         for key, row in parsed.items():
             if key in existing and existing[key].get("release_date"):
                 row["release_date"] = existing[key]["release_date"]
         return parsed
 
-    def probe_md5(
-        tuples: list[tuple[str, str]], concurrency: int, parsed: dict[str, dict]
-    ) -> list[async_ops.ProbeResult]:
-        return asyncio.run(async_ops.stream_md5_checksum_many(tuples, concurrency))
+    async def probe_md5(
+        session: aiohttp.ClientSession, url: str, key: str, parsed: dict[str, dict]
+    ) -> async_ops.ProbeResult:
+        return await async_ops.probe_stream_md5(session, url, key)
 
     stats_path = os.getenv(
         "MIRROR_STATS_FILE",
@@ -59,6 +69,7 @@ def mirror_registry_annotations() -> None:
         source_label="community",
         stats_path=stats_path,
         outcomes_path=outcomes_path,
+        validator_cache=cache.ValidatorCache(cache.cache_path("validators_community.json")),
     )
     backfill_release_dates(OUTPUT_FILE)
 
@@ -92,107 +103,57 @@ def load_manifest(manifest_path: Path) -> dict:
 
 def parse_annotations_tsv(tsv_path: Path) -> list[tuple[str, str]]:
     rows: list[tuple[str, str]] = []
-    with open(tsv_path, encoding="utf-8") as f:
-        lines = f.read().splitlines()
-    if not lines:
-        return rows
-    if lines[0] != REQUIRED_TSV_HEADER:
-        raise ValueError(
-            f"Invalid TSV header in {tsv_path}: expected {REQUIRED_TSV_HEADER!r}"
-        )
-    for line_no, line in enumerate(lines[1:], start=2):
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
-        parts = line.split("\t")
-        if len(parts) != 2:
-            raise ValueError(f"{tsv_path}:{line_no}: expected 2 tab-separated columns")
-        accession, url = parts[0].strip(), parts[1].strip()
-        if not accession or not url:
-            raise ValueError(f"{tsv_path}:{line_no}: empty accession or URL")
-        rows.append((accession, url))
+    with open(tsv_path, encoding="utf-8", newline="") as f:
+        header = f.readline()
+        if not header:
+            return rows
+        if header.rstrip("\r\n") != REQUIRED_TSV_HEADER:
+            raise ValueError(
+                f"Invalid TSV header in {tsv_path}: expected {REQUIRED_TSV_HEADER!r}"
+            )
+        for line_no, line in enumerate(f, start=2):
+            line = line.rstrip("\r\n")
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            parts = line.split("\t")
+            if len(parts) != 2:
+                raise ValueError(f"{tsv_path}:{line_no}: expected 2 tab-separated columns")
+            accession, url = parts[0].strip(), parts[1].strip()
+            if not accession or not url:
+                raise ValueError(f"{tsv_path}:{line_no}: empty accession or URL")
+            rows.append((accession, url))
     return rows
 
 
-def fetch_assembly_metadata(accessions: list[str]) -> dict[str, dict]:
-    """Batch NCBI datasets lookup: assembly_name, taxon_id, organism_name per accession."""
-    unique = sorted(set(accessions))
-    if not unique:
-        return {}
-
-    metadata: dict[str, dict] = {}
-    for i in range(0, len(unique), DATASETS_BATCH_SIZE):
-        batch = unique[i : i + DATASETS_BATCH_SIZE]
-        batch_meta = _fetch_assembly_metadata_batch(batch)
-        metadata.update(batch_meta)
+def fetch_assembly_metadata(
+    accessions: list[str], store: AssemblyMetadataStore | None = None
+) -> dict[str, dict]:
+    """
+    NCBI datasets lookup: assembly_name, taxon_id, organism_name per accession.
+    With a store, only accessions it lacks go to datasets and the answers are
+    added to it. Batches run concurrently and are merged as they finish.
+    """
+    metadata = store.get_many(accessions) if store is not None else {}
+    misses = sorted(set(accessions) - metadata.keys())
+    if store is not None:
+        print(f"[community] Metadata cache: {len(metadata)} hits, {len(misses)} misses")
+    for batch in datasets.iter_summary_results(misses, batch_size=DATASETS_BATCH_SIZE):
+        fetched = {acc: _assembly_metadata(obj) for acc, obj in batch.items()}
+        if store is not None:
+            store.upsert_many(fetched)
+        metadata.update(fetched)
     return metadata
 
 
-def _fetch_assembly_metadata_batch(batch: list[str]) -> dict[str, dict]:
-    batch_set = set(batch)
-    last_err: Exception | None = None
-
-    for attempt in range(DATASETS_ATTEMPTS):
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".txt", prefix="gat_acc_", delete=False
-        ) as fh:
-            fh.writelines(acc + "\n" for acc in batch)
-            acc_file = fh.name
-
-        try:
-            proc = subprocess.run(
-                [
-                    "datasets",
-                    "summary",
-                    "genome",
-                    "accession",
-                    "--inputfile",
-                    acc_file,
-                    "--as-json-lines",
-                ],
-                capture_output=True,
-                text=True,
-                timeout=DATASETS_TIMEOUT,
-                check=False,
-            )
-        except subprocess.TimeoutExpired as e:
-            last_err = e
-            if attempt < DATASETS_ATTEMPTS - 1:
-                time.sleep(min(2**attempt, 30))
-            continue
-        finally:
-            Path(acc_file).unlink(missing_ok=True)
-
-        if proc.returncode != 0:
-            last_err = RuntimeError(
-                f"datasets exited {proc.returncode}: {(proc.stderr or proc.stdout)[:500]}"
-            )
-            if attempt < DATASETS_ATTEMPTS - 1:
-                time.sleep(min(2**attempt, 30))
-            continue
-
-        found: dict[str, dict] = {}
-        for line in proc.stdout.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            acc = obj.get("accession") or obj.get("assembly_accession", "")
-            if not acc or acc not in batch_set:
-                continue
-            organism = obj.get("organism", {})
-            assembly_info = obj.get("assembly_info", {})
-            found[acc] = {
-                "assembly_name": assembly_info.get("assembly_name"),
-                "taxon_id": organism.get("tax_id"),
-                "organism_name": organism.get("organism_name"),
-            }
-        return found
-
-    raise RuntimeError(f"Failed to fetch assembly metadata: {last_err}")
+def _assembly_metadata(obj: dict) -> dict:
+    organism = obj.get("organism", {})
+    assembly_info = obj.get("assembly_info", {})
+    return {
+        "assembly_name": assembly_info.get("assembly_name"),
+        "taxon_id": organism.get("tax_id"),
+        "organism_name": organism.get("organism_name"),
+    }
 
 
 def build_row(
@@ -202,51 +163,64 @@ def build_row(
     project_name: str,
     manifest: dict,
     assembly_meta: dict | None,
-) -> dict:
+) -> AnnotationRecord:
     meta = assembly_meta or {}
-    return {
-        "assembly_accession": assembly_accession,
-        "assembly_name": meta.get("assembly_name"),
-        "taxon_id": meta.get("taxon_id"),
-        "organism_name": meta.get("organism_name"),
-        "source_database": "CommunityRegistry",
-        "annotation_provider": manifest.get("provider_name"),
-        "access_url": access_url,
-        "file_format": "gff",
-        "release_date": None,
-        "pipeline_name": project_name,
-        "pipeline_method": manifest.get("pipeline_method"),
-        "pipeline_version": manifest.get("pipeline_version"),
-    }
+    return AnnotationRecord(
+        assembly_accession=assembly_accession,
+        assembly_name=meta.get("assembly_name"),
+        taxon_id=meta.get("taxon_id"),
+        organism_name=meta.get("organism_name"),
+        source_database="CommunityRegistry",
+        annotation_provider=manifest.get("provider_name"),
+        access_url=access_url,
+        file_format="gff",
+        release_date=None,
+        pipeline_name=project_name,
+        pipeline_method=manifest.get("pipeline_method"),
+        pipeline_version=manifest.get("pipeline_version"),
+    )
 
 
-def scan_registry(registry_root: str | Path) -> dict[str, dict]:
+def scan_registry(
+    registry_root: str | Path,
+    metadata_store: AssemblyMetadataStore | None = None,
+    scan_cache_path: str | None = None,
+) -> dict[str, dict]:
+    """
+    Rows for every registry project. With scan_cache_path, projects whose
+    files are unchanged (same size and mtime, or else same content hash)
+    reuse the rows parsed last run; changed projects are parsed in parallel.
+    Duplicate URLs are resolved across all projects in sorted project order.
+    """
     projects = discover_projects(registry_root)
     if not projects:
         print(f"[community] No registry projects found under {registry_root}")
         return {}
 
+    scanned = _scan_projects(projects, scan_cache_path)
+
     parsed: dict[str, dict] = {}
     all_accessions: list[str] = []
     pending_rows: list[tuple[str, str, str, dict]] = []
+    seen_urls: set[str] = set()
 
     for project_dir in projects:
         project_name = project_dir.name
-        manifest = load_manifest(project_dir / "manifest.yaml")
-        tsv_rows = parse_annotations_tsv(project_dir / "annotations.tsv")
+        manifest, tsv_rows = scanned[project_name]
         print(f"[community] Project {project_name}: {len(tsv_rows)} rows")
         for accession, url in tsv_rows:
-            if url in parsed:
+            if url in seen_urls:
                 print(
                     f"[community] Warning: duplicate access_url {url!r} "
                     f"(skipping {project_name}/{accession})"
                 )
                 continue
+            seen_urls.add(url)
             all_accessions.append(accession)
             pending_rows.append((accession, url, project_name, manifest))
 
     print(f"[community] Fetching NCBI metadata for {len(set(all_accessions))} assemblies...")
-    metadata = fetch_assembly_metadata(all_accessions)
+    metadata = fetch_assembly_metadata(all_accessions, metadata_store)
 
     for accession, url, project_name, manifest in pending_rows:
         parsed[url] = build_row(
@@ -260,29 +234,103 @@ def scan_registry(registry_root: str | Path) -> dict[str, dict]:
     return parsed
 
 
+def _project_files(project_dir: Path) -> tuple[Path, Path]:
+    return project_dir / "manifest.yaml", project_dir / "annotations.tsv"
+
+
+def _project_stat(project_dir: Path) -> list[list[int]]:
+    return [[p.stat().st_size, p.stat().st_mtime_ns] for p in _project_files(project_dir)]
+
+
+def _project_fingerprint(project_dir: Path) -> str:
+    digest = hashlib.sha256()
+    for path in _project_files(project_dir):
+        digest.update(path.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _parse_project(project_dir: Path) -> dict:
+    """Scan-cache entry for one project; runs in a worker process."""
+    stat = _project_stat(project_dir)
+    manifest_path, tsv_path = _project_files(project_dir)
+    manifest = load_manifest(manifest_path)
+    return {
+        "stat": stat,
+        "fingerprint": _project_fingerprint(project_dir),
+        # Only what build_row reads; YAML values such as dates aren't JSON.
+        "manifest": {k: manifest.get(k) for k in MANIFEST_FIELDS},
+        "rows": [list(r) for r in parse_annotations_tsv(tsv_path)],
+    }
+
+
+def _scan_projects(
+    projects: list[Path], scan_cache_path: str | None
+) -> dict[str, tuple[dict, list[tuple[str, str]]]]:
+    """(manifest, rows) per project name, reusing cached parses where possible."""
+    cached = cache.read_json(scan_cache_path, {})
+    if cached.get("version") != SCAN_CACHE_VERSION:
+        cached = {}
+    cached_projects = cached.get("projects", {})
+
+    entries: dict[str, dict] = {}
+    changed: list[Path] = []
+    for project_dir in projects:
+        entry = cached_projects.get(project_dir.name)
+        stat = _project_stat(project_dir)
+        if entry is not None and entry["stat"] != stat:
+            fingerprint = _project_fingerprint(project_dir)
+            entry = {**entry, "stat": stat} if entry["fingerprint"] == fingerprint else None
+        if entry is None:
+            changed.append(project_dir)
+        else:
+            entries[project_dir.name] = entry
+
+    workers = min(SCAN_WORKERS, len(changed))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parse_project, changed))
+    else:
+        results = [_parse_project(p) for p in changed]
+    for project_dir, entry in zip(changed, results):
+        entries[project_dir.name] = entry
+    print(
+        f"[community] Parsed {len(changed)} changed projects, "
+        f"reused {len(projects) - len(changed)} unchanged"
+    )
+
+    if scan_cache_path is not None:
+        fresh = {"version": SCAN_CACHE_VERSION, "projects": entries}
+        if fresh != cached:
+            cache.write_json_atomic(scan_cache_path, fresh)
+    return {
+        name: (entry["manifest"], [tuple(r) for r in entry["rows"]])
+        for name, entry in entries.items()
+    }
+
+
 def backfill_release_dates(output_file: str) -> None:
     """Set release_date from last_modified_date for rows missing release_date."""
-    rows_dict, key_order = file_handler.load_annotations_ordered(output_file, KEY_COLUMN)
+    rows_dict, key_order = file_handler.load_annotations_lazy(output_file, KEY_COLUMN)
     if not rows_dict:
         return
 
-    changed = False
-    ordered_rows: list[dict] = []
+    changed = 0
+    ordered_rows: list[Mapping] = []
     for key in key_order:
-        row = dict(rows_dict[key])
+        row = rows_dict[key]
         if not row.get("release_date") and row.get("last_modified_date"):
+            row = copy_row(row)
             row["release_date"] = row["last_modified_date"]
-            changed = True
+            changed += 1
         ordered_rows.append(row)
 
-    if not changed:
-        return
-
-    with open(output_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, ordered_rows[0].keys(), delimiter="\t")
-        writer.writeheader()
-        writer.writerows(ordered_rows)
-    print(f"[community] Backfilled release_date for {output_file}")
+    if changed:
+        # Unchanged rows are copied through as byte ranges.
+        file_handler.write_annotations(ordered_rows, output_file)
+        print(f"[community] Backfilled release_date for {changed} rows in {output_file}")
+    if isinstance(rows_dict, file_handler.LazyTable):
+        rows_dict.close()
 
 
 if __name__ == "__main__":
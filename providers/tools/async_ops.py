@@ -5,22 +5,29 @@ Async HTTP probes with retries and explicit ProbeResult outcomes.
 from __future__ import annotations
 
 import asyncio
-import hashlib
 import random
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Awaitable, Callable, Literal
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Literal
 
 import aiohttp
 
+from tools import host_limits
+from tools.cache import conditional_headers, validators_from_headers
+from tools.inflate import InflateError, InflatingMd5, get_executor, get_hash_executor
+
 _LAST_MODIFIED_FMT = "%a, %d %b %Y %H:%M:%S %Z"
 DEFAULT_ATTEMPTS = 5
+# Starting in-flight limit per host; the AIMD controller in host_limits moves
+# it between 1 and MAX_HOST_CONCURRENCY from 429/503/timeout feedback.
 DEFAULT_CONCURRENCY = 12
+MAX_HOST_CONCURRENCY = 32
 DL_CHUNK = 1 << 20
-READ_CHUNK = 1 << 20
+HASH_QUEUE_DEPTH = 4
 DEFAULT_RETRIES = 3
 
-ProbeStatus = Literal["ok", "not_found", "transient_error"]
+ProbeStatus = Literal["ok", "not_modified", "not_found", "transient_error"]
 
 
 @dataclass
@@ -29,10 +36,20 @@ class ProbeResult:
     status: ProbeStatus
     value: str | None = None
     detail: str | None = None
+    # ETag / Last-Modified / Content-Length seen by the probe (see tools.cache).
+    validators: dict | None = None
+    # MD5 read in the same response, when the probe target lists it.
+    md5: str | None = None
+    # On MD5 results: Last-Modified date (YYYY-MM-DD) of the response the MD5 came from.
+    last_modified: str | None = None
 
 
 def _date_from_last_modified_header(headers) -> str | None:
-    raw = headers.get("Last-Modified") or headers.get("last-modified")
+    return http_date_to_iso(headers.get("Last-Modified") or headers.get("last-modified"))
+
+
+def http_date_to_iso(raw: str | None) -> str | None:
+    """YYYY-MM-DD from an HTTP date such as a Last-Modified value."""
     if not raw:
         return None
     try:
@@ -42,17 +59,24 @@ def _date_from_last_modified_header(headers) -> str | None:
 
 
 def make_session(concurrency: int = DEFAULT_CONCURRENCY) -> aiohttp.ClientSession:
+    """
+    Session whose per-host in-flight limits start at `concurrency` and adapt;
+    the connector only enforces the hard ceiling.
+    """
+    ceiling = max(concurrency, MAX_HOST_CONCURRENCY)
     timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=120, total=180)
     connector = aiohttp.TCPConnector(
-        limit=concurrency,
-        limit_per_host=concurrency,
+        limit=ceiling,
+        limit_per_host=ceiling,
         ttl_dns_cache=300,
     )
-    return aiohttp.ClientSession(
+    session = aiohttp.ClientSession(
         timeout=timeout,
         connector=connector,
         headers={"User-Agent": "genome-annotation-tracker/1.0"},
     )
+    host_limits.attach(session, concurrency, ceiling)
+    return session
 
 
 def _is_not_found(status: int) -> bool:
@@ -63,217 +87,384 @@ def _is_transient_status(status: int) -> bool:
     return status >= 500 or status == 429
 
 
-async def request_with_retry(
+def _retry_delay(attempt: int, base_delay: float) -> float:
+    return min(base_delay * (2**attempt) + random.uniform(0, 0.5), 30)
+
+
+@asynccontextmanager
+async def open_with_retry(
     session: aiohttp.ClientSession,
     method: str,
     url: str,
     *,
     attempts: int = DEFAULT_ATTEMPTS,
     base_delay: float = 2.0,
-    range_first_byte: bool = False,
-) -> tuple[int, dict] | None:
+    headers: dict | None = None,
+) -> AsyncIterator[aiohttp.ClientResponse | None]:
     """
-    Perform an HTTP request with retries on transient failures.
-    Returns (status_code, headers_dict) or None if all attempts exhausted.
-    404/410 are returned immediately without retry.
+    Open an HTTP request with retries on transient failures and yield the live
+    response, body unread, so callers stream it from the same connection.
+    404/410 and other non-transient statuses are yielded immediately; the last
+    transient response is yielded once attempts run out. Yields None if the
+    final attempt failed at the transport level.
     """
-    headers = {"Range": "bytes=0-0"} if range_first_byte else None
-    last_status: int | None = None
-
+    limiter = host_limits.for_session(
+        session, DEFAULT_CONCURRENCY, MAX_HOST_CONCURRENCY
+    ).for_url(url)
+    loop = asyncio.get_running_loop()
+    resp: aiohttp.ClientResponse | None = None
+    holding = False
+    latency = 0.0
     for attempt in range(attempts):
+        retry_after = None
+        await limiter.acquire()
+        started = loop.time()
         try:
-            async with session.request(
+            resp = await session.request(
                 method,
                 url,
                 allow_redirects=True,
                 headers=headers,
-            ) as resp:
-                status = resp.status
-                hdrs = dict(resp.headers)
-                if _is_not_found(status):
-                    return status, hdrs
-                if status < 400:
-                    return status, hdrs
-                last_status = status
-                if not _is_transient_status(status):
-                    return status, hdrs
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            last_status = None
+            )
+        except asyncio.TimeoutError:
+            limiter.release(throttled=True)
+            resp = None
             if attempt == attempts - 1:
-                return None
+                break
+        except aiohttp.ClientError:
+            limiter.release()
+            resp = None
+            if attempt == attempts - 1:
+                break
+        except BaseException:
+            # Cancelled (e.g. iter_probe_results stopping its workers) or an
+            # unexpected error: hand the slot back before leaving.
+            limiter.release()
+            raise
+        else:
+            latency = loop.time() - started
+            throttled = resp.status in host_limits.THROTTLE_STATUSES
+            if throttled:
+                retry_after = host_limits.parse_retry_after(resp.headers.get("Retry-After"))
+                limiter.release(throttled=True, retry_after=retry_after)
+            if not _is_transient_status(resp.status) or attempt == attempts - 1:
+                # Keep the slot while the caller reads the body.
+                holding = not throttled
+                break
+            if not throttled:
+                limiter.release()
+            resp.release()
+            resp = None
+        if retry_after is None:
+            await asyncio.sleep(_retry_delay(attempt, base_delay))
+        # else: limiter.acquire() waits out Retry-After for every request to the host.
+
+    try:
+        yield resp
+    except asyncio.TimeoutError:
+        if holding:
+            holding = False
+            limiter.release(throttled=True)
+        raise
+    finally:
+        if holding:
+            healthy = resp is not None and resp.status < 500
+            limiter.release(latency=latency if healthy else None)
+        if resp is not None:
+            resp.release()
 
-        if attempt < attempts - 1:
-            delay = min(base_delay * (2**attempt) + random.uniform(0, 0.5), 30)
-            await asyncio.sleep(delay)
 
-    if last_status is not None:
-        return last_status, {}
+async def request_with_retry(
+    session: aiohttp.ClientSession,
+    method: str,
+    url: str,
+    *,
+    attempts: int = DEFAULT_ATTEMPTS,
+    base_delay: float = 2.0,
+    range_first_byte: bool = False,
+    headers: dict | None = None,
+) -> tuple[int, dict] | None:
+    """
+    Perform an HTTP request with retries on transient failures.
+    Returns (status_code, headers_dict) or None if all attempts exhausted.
+    404/410 are returned immediately without retry. The body is discarded;
+    use open_with_retry when the payload is needed.
+    """
+    if range_first_byte:
+        headers = {**(headers or {}), "Range": "bytes=0-0"}
+    async with open_with_retry(
+        session, method, url, attempts=attempts, base_delay=base_delay, headers=headers
+    ) as resp:
+        if resp is None:
+            return None
+        return resp.status, dict(resp.headers)
+
+
+def _status_failure(key: str, status: int) -> ProbeResult | None:
+    """ProbeResult for a failed status, or None when the response is usable."""
+    if _is_not_found(status):
+        return ProbeResult(key=key, status="not_found", detail=f"status_{status}")
+    if status >= 400:
+        return ProbeResult(key=key, status="transient_error", detail=f"status_{status}")
     return None
 
 
+async def iter_probe_results(
+    tuples: Iterable[tuple[str, str]] | AsyncIterable[tuple[str, str]],
+    probe_fn: Callable[[aiohttp.ClientSession, str, str], Awaitable[ProbeResult]],
+    session: aiohttp.ClientSession,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> AsyncIterator[tuple[int, ProbeResult]]:
+    """
+    Run probe_fn over (url, key) tuples with a fixed pool of `concurrency`
+    workers and yield (input_index, result) as each probe finishes.
+
+    The input (sync or async iterable) is consumed lazily through a bounded
+    queue, so memory and scheduler load track concurrency rather than the
+    number of keys, and probing starts while an async input still loads. A
+    failing probe re-raises here; leaving the iteration early (break, error
+    or cancellation) cancels the feeder and workers before returning, so
+    wrap the generator in contextlib.aclosing when not exhausting it.
+    """
+    todo: asyncio.Queue = asyncio.Queue(concurrency * 2)
+    done: asyncio.Queue = asyncio.Queue(concurrency * 2)
+
+    async def feed() -> None:
+        # Workers are released with sentinels even if the input iterator
+        # fails; on cancellation the workers are cancelled too.
+        error: Exception | None = None
+        try:
+            if isinstance(tuples, AsyncIterable):
+                idx = 0
+                async for pair in tuples:
+                    await todo.put((idx, pair))
+                    idx += 1
+            else:
+                for item in enumerate(tuples):
+                    await todo.put(item)
+        except Exception as e:
+            error = e
+        for _ in range(concurrency):
+            await todo.put(None)
+        if error is not None:
+            raise error
+
+    async def worker() -> None:
+        while (item := await todo.get()) is not None:
+            idx, (url, key) = item
+            try:
+                result = await probe_fn(session, url, key)
+            except Exception as e:
+                await done.put(e)
+                return
+            await done.put((idx, result))
+        await done.put(None)
+
+    feeder = asyncio.create_task(feed())
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        running = concurrency
+        while running:
+            item = await done.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+        await feeder
+    finally:
+        for task in (feeder, *workers):
+            task.cancel()
+        await asyncio.gather(feeder, *workers, return_exceptions=True)
+
+
 async def probe_many(
     tuples: list[tuple[str, str]],
     probe_fn: Callable[[aiohttp.ClientSession, str, str], Awaitable[ProbeResult]],
     concurrency: int = DEFAULT_CONCURRENCY,
+    *,
+    session: aiohttp.ClientSession | None = None,
 ) -> list[ProbeResult]:
-    """Run probe_fn for every (url, key); always returns one ProbeResult per input."""
-    sem = asyncio.Semaphore(concurrency)
+    """
+    Run probe_fn for every (url, key); always returns one ProbeResult per input,
+    in input order. Pass session to share one connection pool across several
+    probe stages.
+    """
     results: list[ProbeResult | None] = [None] * len(tuples)
 
-    async with make_session(concurrency) as session:
-
-        async def bound(idx: int, url: str, key: str) -> None:
-            async with sem:
-                results[idx] = await probe_fn(session, url, key)
+    async def run(session: aiohttp.ClientSession) -> None:
+        async for idx, result in iter_probe_results(tuples, probe_fn, session, concurrency):
+            results[idx] = result
 
-        await asyncio.gather(*(bound(i, url, key) for i, (url, key) in enumerate(tuples)))
+    if session is not None:
+        await run(session)
+    else:
+        async with make_session(concurrency) as own_session:
+            await run(own_session)
 
     return [r if r is not None else ProbeResult(key=tuples[i][1], status="transient_error", detail="no_result") for i, r in enumerate(results)]
 
 
 async def probe_last_modified(
-    session: aiohttp.ClientSession, url: str, key: str
+    session: aiohttp.ClientSession,
+    url: str,
+    key: str,
+    *,
+    validators: dict | None = None,
 ) -> ProbeResult:
-    """HEAD then ranged GET; classify 404/410 vs transient vs ok."""
-    head = await request_with_retry(session, "HEAD", url)
+    """
+    HEAD then ranged GET; classify 404/410 vs transient vs ok.
+    With stored validators both requests are conditional, and a 304 yields
+    status "not_modified" without a Last-Modified round trip.
+    """
+    cond = conditional_headers(validators)
+    head = await request_with_retry(session, "HEAD", url, headers=cond or None)
     if head is not None:
         status, hdrs = head
+        if status == 304:
+            return ProbeResult(key=key, status="not_modified", detail="head_304", validators=validators)
         if _is_not_found(status):
             return ProbeResult(key=key, status="not_found", detail=f"status_{status}")
         if status < 400:
             lm = _date_from_last_modified_header(hdrs)
             if lm:
-                return ProbeResult(key=key, status="ok", value=lm, detail=f"head_{status}")
-
-    getr = await request_with_retry(session, "GET", url, range_first_byte=True)
+                return ProbeResult(
+                    key=key,
+                    status="ok",
+                    value=lm,
+                    detail=f"head_{status}",
+                    validators=validators_from_headers(hdrs),
+                )
+
+    getr = await request_with_retry(
+        session, "GET", url, range_first_byte=True, headers=cond or None
+    )
     if getr is None:
         return ProbeResult(key=key, status="transient_error", detail="request_exhausted")
     status, hdrs = getr
+    if status == 304:
+        return ProbeResult(key=key, status="not_modified", detail="get_304", validators=validators)
     if _is_not_found(status):
         return ProbeResult(key=key, status="not_found", detail=f"status_{status}")
     if status < 400:
         lm = _date_from_last_modified_header(hdrs)
         if lm:
-            return ProbeResult(key=key, status="ok", value=lm, detail=f"get_{status}")
-    if _is_transient_status(status):
-        return ProbeResult(key=key, status="transient_error", detail=f"status_{status}")
+            found = validators_from_headers(hdrs)
+            if found:
+                found.pop("content_length", None)  # length of the range, not the file
+            return ProbeResult(
+                key=key, status="ok", value=lm, detail=f"get_{status}", validators=found
+            )
     return ProbeResult(key=key, status="transient_error", detail=f"status_{status}")
 
 
-async def check_last_modified_date_many(
-    tuples: list[tuple[str, str]], concurrency: int = DEFAULT_CONCURRENCY
-) -> list[ProbeResult]:
-    return await probe_many(tuples, probe_last_modified, concurrency)
-
-
 async def fetch_url_text(
-    session: aiohttp.ClientSession, url: str, key: str
+    session: aiohttp.ClientSession,
+    url: str,
+    key: str,
+    *,
+    validators: dict | None = None,
 ) -> ProbeResult:
-    """Fetch URL body as text (e.g. uncompressed_checksums.txt)."""
-    getr = await request_with_retry(session, "GET", url)
-    if getr is None:
-        return ProbeResult(key=key, status="transient_error", detail="request_exhausted")
-    status, _ = getr
-    if _is_not_found(status):
-        return ProbeResult(key=key, status="not_found", detail=f"status_{status}")
-    if status >= 400:
-        detail = f"status_{status}"
-        if _is_transient_status(status):
-            return ProbeResult(key=key, status="transient_error", detail=detail)
-        return ProbeResult(key=key, status="transient_error", detail=detail)
+    """
+    Fetch URL body as text (e.g. uncompressed_checksums.txt) in one request.
+    With stored validators the GET is conditional and a 304 is "not_modified".
+    """
+    cond = conditional_headers(validators)
     try:
-        async with session.get(url, allow_redirects=True) as resp:
+        async with open_with_retry(session, "GET", url, headers=cond or None) as resp:
+            if resp is None:
+                return ProbeResult(key=key, status="transient_error", detail="request_exhausted")
+            if resp.status == 304 and cond:
+                return ProbeResult(
+                    key=key, status="not_modified", detail="get_304", validators=validators
+                )
+            failure = _status_failure(key, resp.status)
+            if failure is not None:
+                return failure
             text = await resp.text()
-            return ProbeResult(key=key, status="ok", value=text, detail=f"status_{resp.status}")
+            return ProbeResult(
+                key=key,
+                status="ok",
+                value=text,
+                detail=f"status_{resp.status}",
+                validators=validators_from_headers(resp.headers),
+            )
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         return ProbeResult(key=key, status="transient_error", detail=type(e).__name__)
 
 
-async def run_decompressor(cmd: list[str]) -> asyncio.subprocess.Process:
-    return await asyncio.create_subprocess_exec(
-        *cmd,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
+def _discard_queued(queue: asyncio.Queue) -> None:
+    while not queue.empty():
+        queue.get_nowait()
 
 
-async def stream_hash_md5(
-    session: aiohttp.ClientSession, url: str, decomp_cmd: list[str]
-) -> ProbeResult:
-    """Stream URL through decompressor and return uncompressed MD5."""
+async def _download_and_hash(resp: aiohttp.ClientResponse) -> str:
+    """
+    Two-stage pipeline for one body: this coroutine only services the socket
+    and pushes chunks into a bounded queue, while a consumer hands them to
+    the hashing pool. A full queue stalls the download (the hashing pool is
+    saturated); an empty one parks the consumer until the network catches up.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(HASH_QUEUE_DEPTH)
+    hasher = InflatingMd5(get_executor())
+    hash_pool = get_hash_executor()
+
+    async def consume() -> str:
+        try:
+            while (chunk := await queue.get()) is not None:
+                await loop.run_in_executor(hash_pool, hasher.update, chunk)
+            return await loop.run_in_executor(hash_pool, hasher.hexdigest)
+        except BaseException:
+            # Unblock a producer waiting on a full queue; it stops on done().
+            _discard_queued(queue)
+            raise
+
+    consumer = asyncio.create_task(consume())
+    try:
+        async for chunk in resp.content.iter_chunked(DL_CHUNK):
+            if consumer.done():
+                break
+            await queue.put(chunk)
+        if not consumer.done():
+            await queue.put(None)
+        return await consumer
+    finally:
+        if not consumer.done():
+            consumer.cancel()
+
+
+async def stream_hash_md5(session: aiohttp.ClientSession, url: str) -> ProbeResult:
+    """Stream URL through an in-process inflater and return uncompressed MD5."""
     for attempt in range(1, DEFAULT_RETRIES + 1):
-        proc = None
         try:
-            getr = await request_with_retry(session, "GET", url, attempts=3)
-            if getr is None:
-                if attempt == DEFAULT_RETRIES:
-                    return ProbeResult(key=url, status="transient_error", detail="request_exhausted")
-                await asyncio.sleep(min(2 * attempt, 10))
-                continue
-            status, _ = getr
-            if _is_not_found(status):
-                return ProbeResult(key=url, status="not_found", detail=f"status_{status}")
-            if status >= 400:
-                if attempt == DEFAULT_RETRIES:
-                    st: ProbeStatus = "transient_error" if _is_transient_status(status) else "transient_error"
-                    return ProbeResult(key=url, status=st, detail=f"status_{status}")
-                await asyncio.sleep(min(2 * attempt, 10))
-                continue
-
-            h = hashlib.md5()
-            async with session.get(url, allow_redirects=True) as resp:
-                resp.raise_for_status()
-                proc = await run_decompressor(decomp_cmd)
-
-                async def writer():
-                    try:
-                        async for chunk in resp.content.iter_chunked(DL_CHUNK):
-                            if not chunk:
-                                continue
-                            proc.stdin.write(chunk)
-                            await proc.stdin.drain()
-                    finally:
-                        if proc.stdin and not proc.stdin.is_closing():
-                            proc.stdin.close()
-
-                async def reader():
-                    while True:
-                        chunk = await proc.stdout.read(READ_CHUNK)
-                        if not chunk:
-                            break
-                        h.update(chunk)
-
-                await asyncio.gather(writer(), reader())
-                try:
-                    await asyncio.wait_for(proc.stderr.read(), timeout=1.0)
-                except asyncio.TimeoutError:
-                    pass
-                ret = await proc.wait()
-                if ret != 0:
-                    if attempt == DEFAULT_RETRIES:
-                        return ProbeResult(key=url, status="transient_error", detail=f"decompress_exit_{ret}")
-                    await asyncio.sleep(min(2 * attempt, 10))
-                    continue
-                return ProbeResult(key=url, status="ok", value=h.hexdigest(), detail="stream_hash")
+            async with open_with_retry(session, "GET", url, attempts=3) as resp:
+                if resp is None:
+                    failure = ProbeResult(key=url, status="transient_error", detail="request_exhausted")
+                elif _is_not_found(resp.status):
+                    return ProbeResult(key=url, status="not_found", detail=f"status_{resp.status}")
+                elif resp.status >= 400:
+                    failure = ProbeResult(key=url, status="transient_error", detail=f"status_{resp.status}")
+                else:
+                    digest = await _download_and_hash(resp)
+                    return ProbeResult(
+                        key=url,
+                        status="ok",
+                        value=digest,
+                        detail="stream_hash",
+                        last_modified=_date_from_last_modified_header(resp.headers),
+                    )
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            if proc and proc.returncode is None:
-                try:
-                    proc.kill()
-                except ProcessLookupError:
-                    pass
-            if attempt == DEFAULT_RETRIES:
-                return ProbeResult(key=url, status="transient_error", detail=type(e).__name__)
-            await asyncio.sleep(min(2 * attempt, 10))
+            failure = ProbeResult(key=url, status="transient_error", detail=type(e).__name__)
+        except InflateError:
+            failure = ProbeResult(key=url, status="transient_error", detail="decompress_error")
         except Exception as e:
-            if proc and proc.returncode is None:
-                try:
-                    proc.kill()
-                except ProcessLookupError:
-                    pass
-            if attempt == DEFAULT_RETRIES:
-                return ProbeResult(key=url, status="transient_error", detail=type(e).__name__)
-            await asyncio.sleep(min(2 * attempt, 10))
+            # Anything unexpected fails this key only, never the whole run.
+            failure = ProbeResult(key=url, status="transient_error", detail=type(e).__name__)
+        if attempt == DEFAULT_RETRIES:
+            return failure
+        await asyncio.sleep(min(2 * attempt, 10))
 
     return ProbeResult(key=url, status="transient_error", detail="stream_hash_exhausted")
 
@@ -281,18 +472,12 @@ async def stream_hash_md5(
 async def probe_stream_md5(
     session: aiohttp.ClientSession, url: str, key: str
 ) -> ProbeResult:
-    """Ensembl-style: stream bgzip-decompressed content MD5."""
-    result = await stream_hash_md5(session, url, ["bgzip", "-dc"])
+    """Ensembl-style: MD5 of the gzip/BGZF-decompressed content."""
+    result = await stream_hash_md5(session, url)
     result.key = key
     return result
 
 
-async def stream_md5_checksum_many(
-    input_tuples: list[tuple[str, str]], concurrency: int = DEFAULT_CONCURRENCY
-) -> list[ProbeResult]:
-    return await probe_many(input_tuples, probe_stream_md5, concurrency)
-
-
 # Backward-compatible alias used by ncbi.py before refactor
 async def get_last_modified_date(session: aiohttp.ClientSession, ftp_path: str) -> str | None:
     r = await probe_last_modified(session, ftp_path, ftp_path)
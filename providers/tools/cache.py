@@ -0,0 +1,164 @@
+"""
+Persistent local caches shared by the mirrors (kept between CI runs).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Mapping
+from datetime import date
+
+CACHE_DIR = os.getenv("MIRROR_CACHE_DIR", ".cache")
+
+_VALIDATOR_FIELDS = {
+    "etag": "ETag",
+    "last_modified": "Last-Modified",
+    "content_length": "Content-Length",
+}
+
+
+def cache_path(name: str) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, name)
+
+
+def _jsonable(obj):
+    # Row types such as AnnotationRecord are stored as plain objects.
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def write_json_atomic(path: str, data) -> None:
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, sort_keys=True, default=_jsonable)
+    os.replace(tmp, path)
+
+
+def read_json(path: str | None, default):
+    if not path or not os.path.isfile(path):
+        return default
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def validators_from_headers(headers) -> dict[str, str] | None:
+    """ETag / Last-Modified / Content-Length from a response, None if no validator."""
+    by_name = {name.lower(): value for name, value in headers.items()}
+    out = {}
+    for field, header in _VALIDATOR_FIELDS.items():
+        value = by_name.get(header.lower())
+        if value:
+            out[field] = value
+    if "etag" not in out and "last_modified" not in out:
+        return None
+    return out
+
+
+def conditional_headers(validators: dict | None) -> dict[str, str]:
+    """If-None-Match / If-Modified-Since for a stored validator entry."""
+    if not validators:
+        return {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+class ValidatorCache:
+    """
+    HTTP validators per URL, persisted as JSON. An entry is only recorded once
+    the TSV row (or cached file) it vouches for has been written, so a 304
+    always means "what we stored is still current".
+    """
+
+    def __init__(self, path: str | None) -> None:
+        self.path = path
+        self._entries: dict[str, dict] = read_json(path, {})
+        self._dirty = False
+
+    def get(self, url: str) -> dict | None:
+        return self._entries.get(url)
+
+    def record(self, url: str, validators: dict | None) -> None:
+        if not validators:
+            return
+        if self._entries.get(url) != validators:
+            self._entries[url] = validators
+            self._dirty = True
+
+    def discard(self, url: str) -> None:
+        if self._entries.pop(url, None) is not None:
+            self._dirty = True
+
+    def retain(self, urls: set[str]) -> None:
+        """Drop entries for URLs no longer tracked."""
+        stale = [u for u in self._entries if u not in urls]
+        for url in stale:
+            del self._entries[url]
+        self._dirty = self._dirty or bool(stale)
+
+    def save(self) -> None:
+        if self.path and self._dirty:
+            write_json_atomic(self.path, self._entries)
+            self._dirty = False
+
+
+class ExpiringCache:
+    """
+    JSON-backed key -> value map whose entries expire after ttl_days. A None
+    value is a negative entry ("looked, found nothing") and expires after the
+    shorter negative_ttl_days.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        ttl_days: int,
+        negative_ttl_days: int,
+        today: date | None = None,
+    ) -> None:
+        self.path = path
+        self.today = today or date.today()
+        self._entries: dict[str, dict] = {}
+        self._dirty = False
+        for key, entry in read_json(path, {}).items():
+            try:
+                checked = date.fromisoformat(entry["checked"])
+            except (KeyError, TypeError, ValueError):
+                self._dirty = True
+                continue
+            ttl = ttl_days if entry.get("value") is not None else negative_ttl_days
+            if (self.today - checked).days < ttl:
+                self._entries[key] = entry
+            else:
+                self._dirty = True
+
+    def lookup(self, key: str) -> tuple[bool, object]:
+        """(hit, value); value is None for a negative entry."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        return True, entry.get("value")
+
+    def put(self, key: str, value) -> None:
+        self._entries[key] = {"value": value, "checked": self.today.isoformat()}
+        self._dirty = True
+
+    def discard(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def save(self) -> None:
+        if self.path and self._dirty:
+            write_json_atomic(self.path, self._entries)
+            self._dirty = False
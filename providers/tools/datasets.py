@@ -0,0 +1,249 @@
+"""
+NCBI datasets CLI helpers: streamed JSON-lines output and batched lookups.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+DATASETS_BATCH_SIZE = 2000
+DATASETS_ATTEMPTS = 3
+DATASETS_TIMEOUT = 300
+# datasets is network-bound; a few processes in flight hide per-call latency
+# without hammering the NCBI API.
+DATASETS_WORKERS = 4
+# Attempts for each half of a batch that failed all its DATASETS_ATTEMPTS.
+SPLIT_ATTEMPTS = 1
+
+
+def _decode(line: bytes | str) -> dict | None:
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing line: {line[:80]!r}... {e}")
+        return None
+
+
+def _exit_error(cmd: list[str], returncode: int, stderr: bytes) -> RuntimeError:
+    return RuntimeError(
+        f"{cmd[0]} exited {returncode}: {stderr.decode(errors='replace')[:500]}"
+    )
+
+
+def iter_json_lines(cmd: list[str], *, timeout: float | None = None) -> Iterator[dict]:
+    """
+    Run cmd and yield each JSON line of its stdout as it arrives, so parsing
+    overlaps with the CLI's network time and memory stays flat. Undecodable
+    lines are reported and skipped. A non-zero exit raises RuntimeError once
+    the output is drained; exceeding timeout kills the process and raises
+    subprocess.TimeoutExpired. Closing the generator early kills the process.
+    """
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        timed_out = threading.Event()
+
+        def expire() -> None:
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, expire) if timeout else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            for line in proc.stdout:
+                obj = _decode(line)
+                if obj is not None:
+                    yield obj
+            returncode = proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if returncode != 0:
+            err.seek(0)
+            raise _exit_error(cmd, returncode, err.read())
+
+
+class _BatchScheduler:
+    """
+    Submits summary batches to a pool and settles them as they finish. A
+    batch that still fails after its retries is split in two; a lone
+    accession left by splitting that fails is dropped with a warning, or
+    raises unless skip_failed. When both halves of a split fail the problem is
+    not a single bad accession, so it raises.
+    """
+
+    def __init__(
+        self, pool: ThreadPoolExecutor, report: str | None, skip_failed: bool = True
+    ) -> None:
+        self.pool = pool
+        self.report = report
+        self.skip_failed = skip_failed
+        self.pending: dict[Future, tuple[list[str], int | None]] = {}
+        self.dropped: list[str] = []
+        self._split_failures: dict[int, int] = {}
+        self._next_split = 0
+
+    def submit(self, batch: list[str], attempts: int, split: int | None = None) -> None:
+        fut = self.pool.submit(summary_batch, batch, report=self.report, attempts=attempts)
+        self.pending[fut] = (batch, split)
+
+    def settle(self, fut: Future) -> dict[str, dict]:
+        batch, split = self.pending.pop(fut)
+        try:
+            return fut.result()
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            if split is None and len(batch) == 1:
+                raise
+            if split is not None:
+                self._split_failures[split] = self._split_failures.get(split, 0) + 1
+                if self._split_failures[split] == 2:
+                    raise RuntimeError(f"datasets summary keeps failing: {e}") from e
+            if len(batch) == 1:
+                if not self.skip_failed:
+                    raise RuntimeError(f"datasets summary failed for {batch[0]}: {e}") from e
+                print(f"Warning: datasets summary failed for {batch[0]}, skipping: {e}")
+                self.dropped.append(batch[0])
+                return {}
+            mid = len(batch) // 2
+            split_id, self._next_split = self._next_split, self._next_split + 1
+            self.submit(batch[:mid], SPLIT_ATTEMPTS, split_id)
+            self.submit(batch[mid:], SPLIT_ATTEMPTS, split_id)
+            return {}
+
+    def cancel(self) -> None:
+        for fut in self.pending:
+            fut.cancel()
+
+
+def _batches(accessions: list[str], batch_size: int) -> list[list[str]]:
+    unique = sorted(set(accessions))
+    return [unique[i : i + batch_size] for i in range(0, len(unique), batch_size)]
+
+
+def iter_summary_results(
+    accessions: list[str],
+    *,
+    report: str | None = None,
+    batch_size: int = DATASETS_BATCH_SIZE,
+    workers: int = DATASETS_WORKERS,
+    skip_failed: bool = True,
+) -> Iterator[dict[str, dict]]:
+    """
+    `datasets summary genome accession --inputfile` records, one dict per
+    finished batch, with batches running concurrently on a bounded pool.
+    skip_failed=False raises instead of dropping an accession that keeps
+    failing on its own (see _BatchScheduler), for callers where a missing
+    answer would read as "not in NCBI".
+    """
+    batches = _batches(accessions, batch_size)
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as pool:
+        scheduler = _BatchScheduler(pool, report, skip_failed)
+        for batch in batches:
+            scheduler.submit(batch, DATASETS_ATTEMPTS)
+        try:
+            while scheduler.pending:
+                done, _ = wait(scheduler.pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield scheduler.settle(fut)
+        finally:
+            scheduler.cancel()
+
+
+async def iter_summary_batches(
+    accessions: list[str],
+    *,
+    report: str | None = None,
+    batch_size: int = DATASETS_BATCH_SIZE,
+    workers: int = DATASETS_WORKERS,
+    skip_failed: bool = True,
+) -> AsyncIterator[dict[str, dict]]:
+    """Asyncio counterpart of iter_summary_results."""
+    batches = _batches(accessions, batch_size)
+    if not batches:
+        return
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches))))
+    scheduler = _BatchScheduler(pool, report, skip_failed)
+    for batch in batches:
+        scheduler.submit(batch, DATASETS_ATTEMPTS)
+    waiting: dict[asyncio.Future, Future] = {}
+    try:
+        while scheduler.pending:
+            for fut in scheduler.pending:
+                if fut not in waiting.values():
+                    waiting[asyncio.wrap_future(fut)] = fut
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            for aw in done:
+                aw.exception()  # settle reads the outcome from the pool future
+                yield scheduler.settle(waiting.pop(aw))
+    finally:
+        scheduler.cancel()
+        for aw in waiting:
+            # Batches still in flight (or failed but unsettled) after an early exit.
+            if aw.done() and not aw.cancelled():
+                aw.exception()
+            else:
+                aw.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def summary_batch(
+    batch: list[str], *, report: str | None = None, attempts: int = DATASETS_ATTEMPTS
+) -> dict[str, dict]:
+    batch_set = set(batch)
+    report_args = ["--report", report] if report else []
+    last_err: Exception | None = None
+
+    for attempt in range(attempts):
+        with tempfile.NamedTemporaryFile(
+            mode="w", suffix=".txt", prefix="gat_acc_", delete=False
+        ) as fh:
+            fh.writelines(acc + "\n" for acc in batch)
+            acc_file = fh.name
+
+        try:
+            found: dict[str, dict] = {}
+            for obj in iter_json_lines(
+                [
+                    "datasets",
+                    "summary",
+                    "genome",
+                    "accession",
+                    "--inputfile",
+                    acc_file,
+                    "--as-json-lines",
+                    *report_args,
+                ],
+                timeout=DATASETS_TIMEOUT,
+            ):
+                acc = obj.get("accession") or obj.get("assembly_accession", "")
+                if acc in batch_set:
+                    found[acc] = obj
+            return found
+        except (subprocess.TimeoutExpired, RuntimeError) as e:
+            last_err = e
+            if attempt < attempts - 1:
+                time.sleep(min(2**attempt, 30))
+        finally:
+            Path(acc_file).unlink(missing_ok=True)
+
+    raise RuntimeError(f"Failed to fetch datasets summary: {last_err}")
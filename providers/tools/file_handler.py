@@ -1,5 +1,11 @@
 import csv
+import io
+import mmap
 import os
+import tempfile
+from collections.abc import Mapping
+
+CSV_LINE_END = "\r\n"
 
 
 def load_annotations(file_path, key_column: str = "access_url") -> dict[str, dict]:
@@ -36,16 +42,218 @@ def load_annotations_ordered(
     return annotations_dict, key_order
 
 
-def write_annotations(annotations: list[dict], file_path: str):
+class LazyRow(Mapping):
+    """
+    One row of a LazyTable. Holds only its byte span; fields are split out of
+    the mapped file when read, and an untouched row is written back as-is.
+    """
+
+    __slots__ = ("_table", "_start", "_end")
+
+    def __init__(self, table: "LazyTable", start: int, end: int) -> None:
+        self._table = table
+        self._start = start
+        self._end = end
+
+    def __getitem__(self, column: str):
+        fields = self._table._fields(self._start, self._end)
+        return fields[self._table.column_index[column]]
+
+    def __iter__(self):
+        return iter(self._table.header)
+
+    def __len__(self) -> int:
+        return len(self._table.header)
+
+    def __contains__(self, column) -> bool:
+        return column in self._table.column_index
+
+    @property
+    def table(self) -> "LazyTable":
+        return self._table
+
+
+class _NotLazy(Exception):
+    """The file uses CSV features the byte-offset index does not handle."""
+
+
+class LazyTable(Mapping):
+    """
+    key -> LazyRow over a memory-mapped TSV, indexed in one pass over the
+    bytes. write_annotations replaces files rather than rewriting them, so
+    the mapping stays valid after its file is written.
+    """
+
+    def __init__(self, file_path: str, key_column: str) -> None:
+        self._file = open(file_path, "rb")
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Last split row, so reading several fields of one row splits it once.
+        self._last: tuple[int, list] = (-1, [])
+        self.rows: dict[str, LazyRow] = {}
+        self.key_order: list[str] = []
+        try:
+            self._index(key_column)
+        except Exception:
+            self.close()
+            raise
+
+    def _index(self, key_column: str) -> None:
+        buf = self._buf
+        end = buf.find(b"\n")
+        if end == -1:
+            raise _NotLazy("no header line")
+        self.header = _split_line(buf[:end].rstrip(b"\r"))
+        self.column_index = {c: i for i, c in enumerate(self.header)}
+        if key_column not in self.column_index:
+            raise _NotLazy(f"no {key_column} column")
+        key_idx = self.column_index[key_column]
+        tabs = len(self.header) - 1
+        size = len(buf)
+        pos = end + 1
+        while pos < size:
+            end = buf.find(b"\n", pos)
+            if end == -1:
+                end = size
+            line_end = end - 1 if end > pos and buf[end - 1] == 0x0D else end
+            line = buf[pos:line_end]
+            start, pos = pos, end + 1
+            if not line:
+                continue
+            if b'"' in line:
+                if line.count(b'"') % 2:
+                    raise _NotLazy("quoted field spans lines")
+                fields = _split_line(line)
+                if len(fields) != len(self.header):
+                    raise _NotLazy("row width differs from header")
+                key = fields[key_idx]
+            elif line.count(b"\t") == tabs:
+                key = line.split(b"\t", key_idx + 1)[key_idx].decode("utf-8")
+            else:
+                raise _NotLazy("row width differs from header")
+            if not key:
+                continue
+            if key not in self.rows:
+                self.key_order.append(key)
+            self.rows[key] = LazyRow(self, start, line_end)
+
+    def _fields(self, start: int, end: int) -> list:
+        if self._last[0] != start:
+            self._last = (start, _split_line(self._buf[start:end]))
+        return self._last[1]
+
+    def __getitem__(self, key: str) -> LazyRow:
+        return self.rows[key]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, key) -> bool:
+        return key in self.rows
+
+    def close(self) -> None:
+        self._buf.close()
+        self._file.close()
+
+
+def _split_line(line: bytes) -> list[str]:
+    text = line.decode("utf-8")
+    if '"' in text:
+        return next(csv.reader([text], delimiter="\t"))
+    return text.split("\t")
+
+
+def load_annotations_lazy(
+    file_path: str, key_column: str = "access_url"
+) -> tuple[Mapping[str, Mapping], list[str]]:
+    """
+    Like load_annotations_ordered, but rows are LazyRows over a memory-mapped
+    file rather than dicts. Falls back to load_annotations_ordered for files
+    the index cannot handle (multi-line quoted fields, ragged rows).
+    """
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) == 0:
+        return {}, []
+    try:
+        table = LazyTable(file_path, key_column)
+    except _NotLazy:
+        return load_annotations_ordered(file_path, key_column)
+    return table, table.key_order
+
+
+def write_annotations(annotations: list[Mapping], file_path: str):
     """
     Write annotations to a file.
     Row order is exactly the order of the input list (callers should pass
     git-friendly ordering: prior keys in file order, then new keys).
+    The file is written to a temporary sibling and renamed over file_path,
+    so a crash never leaves a truncated TSV. Runs of LazyRows with the same
+    columns are copied as byte ranges from their file; only other rows go
+    through csv. When the file already exists with the same columns, its
+    column order is kept whatever the order of the first row's keys.
     """
     if not annotations:
         raise ValueError("Cannot write empty annotations list")
-    with open(file_path, "w") as f:
-        writer = csv.DictWriter(f, annotations[0].keys(), delimiter="\t")
-        writer.writeheader()
-        writer.writerows(annotations)
-        
\ No newline at end of file
+    fieldnames = list(annotations[0].keys())
+    header = _existing_header(file_path)
+    if header is not None and sorted(header) == sorted(fieldnames):
+        fieldnames = header
+    parent = os.path.dirname(os.path.abspath(file_path))
+    mode = os.stat(file_path).st_mode & 0o777 if os.path.exists(file_path) else 0o644
+    fd, tmp = tempfile.mkstemp(dir=parent, prefix=".", suffix=".tsv.tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            _write_rows(out, annotations, fieldnames)
+        os.chmod(tmp, mode)
+        os.replace(tmp, file_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _existing_header(file_path: str) -> list[str] | None:
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f, delimiter="\t"), None)
+
+
+def _write_rows(out, annotations: list[Mapping], fieldnames: list[str]) -> None:
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames, delimiter="\t")
+    writer.writeheader()
+    line_end = CSV_LINE_END.encode()
+    # Pending raw range: (table, start, end) of consecutive unchanged lines.
+    run: tuple[LazyTable, int, int] | None = None
+
+    def flush() -> None:
+        nonlocal run
+        if text.tell():
+            out.write(text.getvalue().encode("utf-8"))
+            text.seek(0)
+            text.truncate()
+        if run is not None:
+            table, start, end = run
+            with memoryview(table._buf) as view:
+                out.write(view[start:end])
+            out.write(line_end)
+            run = None
+
+    for row in annotations:
+        if isinstance(row, LazyRow) and row.table.header == fieldnames:
+            table, start, end = row.table, row._start, row._end
+            if (
+                run is not None
+                and run[0] is table
+                and table._buf[run[2] : start] == line_end
+            ):
+                run = (table, run[1], end)
+                continue
+            flush()
+            run = (table, start, end)
+        else:
+            if run is not None:
+                flush()
+            writer.writerow(row)
+    flush()
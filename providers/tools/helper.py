@@ -6,35 +6,83 @@ from __future__ import annotations
 
 import json
 import os
-from datetime import datetime, timedelta
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from itertools import chain
 from typing import Literal
 
 from tools.async_ops import ProbeResult
+from tools.record import copy_row
 
 LmOutcome = Literal["reuse_existing", "refresh_md5", "gone", "transient"]
 FinalOutcome = Literal["emit_existing", "emit_new", "gone", "skip_new"]
 
 RECENT_RETRIEVAL_DAYS = 14
+# A row whose universe metadata is unchanged is trusted without a request for
+# this long after its last network verification.
+METADATA_VERIFIED_DAYS = 60
+
+
+def recent_retrieval_cutoff() -> date:
+    return datetime.now().date() - timedelta(days=RECENT_RETRIEVAL_DAYS)
+
+
+def retrieved_recently(existing_annotation: dict | None, cutoff: date) -> bool:
+    """True when the stored row's retrieval_date is newer than cutoff."""
+    if not existing_annotation:
+        return False
+    try:
+        existing_date = datetime.strptime(
+            existing_annotation.get("retrieval_date", ""), "%Y-%m-%d"
+        ).date()
+    except ValueError:
+        return False
+    return existing_date > cutoff
 
 
 def keep_recent_annotations(
     existing_annotations_dict: dict, parsed_annotations_dict: dict
 ) -> list[str]:
     """Keys recently retrieved (<14d) that still appear in the source listing — skip re-probe."""
-    annotations_to_keep: list[str] = []
-    cutoff = datetime.now().date() - timedelta(days=RECENT_RETRIEVAL_DAYS)
-    for unique_identifier, existing_annotation in existing_annotations_dict.items():
-        if unique_identifier not in parsed_annotations_dict:
-            continue
-        try:
-            existing_date = datetime.strptime(
-                existing_annotation.get("retrieval_date", ""), "%Y-%m-%d"
-            ).date()
-        except ValueError:
-            continue
-        if existing_date > cutoff:
-            annotations_to_keep.append(unique_identifier)
-    return annotations_to_keep
+    cutoff = recent_retrieval_cutoff()
+    return [
+        unique_identifier
+        for unique_identifier, existing_annotation in existing_annotations_dict.items()
+        if unique_identifier in parsed_annotations_dict
+        and retrieved_recently(existing_annotation, cutoff)
+    ]
+
+
+def metadata_verified_cutoff() -> date:
+    return datetime.now().date() - timedelta(days=METADATA_VERIFIED_DAYS)
+
+
+def infer_from_metadata(
+    existing_annotation: dict | None,
+    row: dict,
+    fields: tuple[str, ...],
+    verified_cutoff: date | None,
+) -> LmOutcome | None:
+    """
+    Outcome implied by comparing the universe row's metadata fields with the
+    stored row, or None when a probe is still needed. Changed metadata means a
+    new annotation release (refresh_md5); identical metadata on a row verified
+    after verified_cutoff is reused as is. verified_cutoff None means the row's
+    metadata may be stale, so it is only trusted when it changed. Rows stored
+    without one of the fields (an older TSV layout) are probed.
+    """
+    if not existing_annotation or not fields:
+        return None
+    if any(field not in existing_annotation for field in fields):
+        return None
+    for field in fields:
+        stored, current = existing_annotation.get(field), row.get(field)
+        if ("" if stored is None else str(stored)) != ("" if current is None else str(current)):
+            return "refresh_md5"
+    if verified_cutoff is not None and retrieved_recently(existing_annotation, verified_cutoff):
+        return "reuse_existing"
+    return None
 
 
 def get_tuples_to_check(
@@ -48,15 +96,51 @@ def get_tuples_to_check(
     ]
 
 
+def classify_last_modified(
+    key: str, existing: dict[str, dict], row: dict, result: ProbeResult | None
+) -> LmOutcome:
+    """
+    Outcome of one key's last-modified probe. On a changed date the new value
+    is stored on the parsed row, ready for the MD5 stage. When the probe also
+    read the MD5, that comparison decides instead of the date.
+    """
+    if result is None:
+        return "transient" if key in existing else "refresh_md5"
+    if result.status == "not_modified":
+        # 304 against validators recorded for the stored row.
+        return "reuse_existing" if key in existing else "refresh_md5"
+    if result.status == "not_found":
+        return "gone"
+    if result.status == "transient_error":
+        return "transient"
+    if result.status == "ok":
+        if result.md5 is not None and key in existing:
+            if existing[key].get("md5_checksum") == result.md5:
+                return "reuse_existing"
+            row["last_modified_date"] = result.value
+            return "refresh_md5"
+        existing_lm = (existing.get(key) or {}).get("last_modified_date")
+        if key in existing and result.value == existing_lm:
+            return "reuse_existing"
+        row["last_modified_date"] = result.value
+        return "refresh_md5"
+    return "transient"
+
+
 def decide_last_modified_outcomes(
     existing: dict[str, dict],
     parsed: dict[str, dict],
     lm_results: list[ProbeResult],
     skip_keys: set[str],
+    inferred: dict[str, LmOutcome] | None = None,
 ) -> dict[str, LmOutcome]:
-    """Classify last-modified probe results per key."""
+    """
+    Classify last-modified probe results per key. Keys in inferred were
+    decided from metadata (see infer_from_metadata) and were not probed.
+    """
     outcomes: dict[str, LmOutcome] = {}
     by_key = {r.key: r for r in lm_results}
+    inferred = inferred or {}
 
     for key in skip_keys:
         if key in existing:
@@ -65,23 +149,10 @@ def decide_last_modified_outcomes(
     for key, row in parsed.items():
         if key in skip_keys:
             continue
-        result = by_key.get(key)
-        if result is None:
-            outcomes[key] = "transient" if key in existing else "refresh_md5"
+        if key in inferred:
+            outcomes[key] = inferred[key]
             continue
-        if result.status == "not_found":
-            outcomes[key] = "gone"
-        elif result.status == "transient_error":
-            outcomes[key] = "transient"
-        elif result.status == "ok":
-            existing_lm = (existing.get(key) or {}).get("last_modified_date")
-            if key in existing and result.value == existing_lm:
-                outcomes[key] = "reuse_existing"
-            else:
-                row["last_modified_date"] = result.value
-                outcomes[key] = "refresh_md5"
-        else:
-            outcomes[key] = "transient"
+        outcomes[key] = classify_last_modified(key, existing, row, by_key.get(key))
 
     return outcomes
 
@@ -101,42 +172,7 @@ def decide_md5_outcomes(
     by_key = {r.key: r for r in md5_results}
 
     for key, lm in lm_outcomes.items():
-        if lm == "reuse_existing":
-            final[key] = "emit_existing"
-            continue
-        if lm == "gone":
-            if key in existing and key not in source_keys:
-                final[key] = "gone"
-            elif key in existing:
-                final[key] = "emit_existing"
-            else:
-                final[key] = "gone"
-            continue
-        if lm == "transient":
-            if key in existing:
-                final[key] = "emit_existing"
-            else:
-                final[key] = "skip_new"
-            continue
-        # refresh_md5
-        result = by_key.get(key)
-        if result is None:
-            final[key] = "emit_existing" if key in existing else "skip_new"
-            continue
-        if result.status == "not_found":
-            if key in existing and key not in source_keys:
-                final[key] = "gone"
-            elif key in existing:
-                final[key] = "emit_existing"
-            else:
-                final[key] = "gone"
-        elif result.status == "transient_error":
-            final[key] = "emit_existing" if key in existing else "skip_new"
-        elif result.status == "ok" and result.value:
-            parsed[key]["md5_checksum"] = result.value
-            final[key] = "emit_new"
-        else:
-            final[key] = "emit_existing" if key in existing else "skip_new"
+        final[key] = classify_md5(key, lm, existing, parsed, source_keys, by_key.get(key))
 
     # Existing rows absent from source listing and not in lm_outcomes → gone
     for key in existing:
@@ -148,6 +184,40 @@ def decide_md5_outcomes(
     return final
 
 
+def classify_md5(
+    key: str,
+    lm: LmOutcome,
+    existing: dict[str, dict],
+    parsed: dict[str, dict],
+    source_keys,
+    result: ProbeResult | None,
+) -> FinalOutcome:
+    """Final outcome of one key given its last-modified outcome and MD5 probe result."""
+    if lm == "reuse_existing":
+        return "emit_existing"
+    if lm == "gone":
+        if key in existing and key not in source_keys:
+            return "gone"
+        return "emit_existing" if key in existing else "gone"
+    if lm == "transient":
+        return "emit_existing" if key in existing else "skip_new"
+    # refresh_md5
+    if result is None:
+        return "emit_existing" if key in existing else "skip_new"
+    if result.status == "not_found":
+        if key in existing and key not in source_keys:
+            return "gone"
+        return "emit_existing" if key in existing else "gone"
+    if result.status == "ok" and result.value:
+        parsed[key]["md5_checksum"] = result.value
+        if result.last_modified and not parsed[key].get("last_modified_date"):
+            # Not probed for last-modified (decided from metadata): date it by
+            # the response the MD5 came from.
+            parsed[key]["last_modified_date"] = result.last_modified
+        return "emit_new"
+    return "emit_existing" if key in existing else "skip_new"
+
+
 def _should_refresh_retrieval_date(
     key: str,
     outcome: FinalOutcome,
@@ -176,44 +246,58 @@ def build_merged_rows(
     """
     rows: list[dict] = []
     log: dict[str, str] = {}
-    seen: set[str] = set()
 
     for key, outcome in final_outcomes.items():
-        log[key] = outcome
-        if outcome == "gone" or outcome == "skip_new":
-            continue
-        if outcome == "emit_existing":
-            if key in existing:
-                row = dict(existing[key])
-                if _should_refresh_retrieval_date(
-                    key, outcome, lm_probed_keys, md5_probed_keys
-                ):
-                    row["retrieval_date"] = run_date
-                rows.append(row)
-                seen.add(key)
-        elif outcome == "emit_new":
-            if key not in parsed:
-                continue
-            prow = dict(parsed[key])
-            eff_lm = (
-                prow.get("last_modified_date")
-                or (existing.get(key) or {}).get("last_modified_date")
-                or prow.get("release_date")
-            )
-            if not eff_lm or not prow.get("md5_checksum"):
-                if key in existing:
-                    rows.append(dict(existing[key]))
-                    seen.add(key)
-                    log[key] = "emit_existing_fallback"
-                continue
-            prow["last_modified_date"] = eff_lm
-            prow["retrieval_date"] = run_date
-            rows.append(prow)
-            seen.add(key)
+        row, log[key] = merged_row(
+            key,
+            outcome,
+            existing,
+            parsed,
+            run_date=run_date,
+            refresh=_should_refresh_retrieval_date(key, outcome, lm_probed_keys, md5_probed_keys),
+        )
+        if row is not None:
+            rows.append(row)
 
     return rows, log
 
 
+def merged_row(
+    key: str,
+    outcome: FinalOutcome,
+    existing: dict[str, dict],
+    parsed: dict[str, dict],
+    *,
+    run_date: str,
+    refresh: bool,
+) -> tuple[dict | None, str]:
+    """(row to write or None, outcome label) for one key's final outcome."""
+    if outcome == "emit_existing":
+        if key not in existing:
+            return None, outcome
+        # Unchanged rows are passed through (LazyRows stay raw lines).
+        row = existing[key]
+        if refresh:
+            row = copy_row(row)
+            row["retrieval_date"] = run_date
+        return row, outcome
+    if outcome != "emit_new" or key not in parsed:
+        return None, outcome
+    prow = copy_row(parsed[key])
+    eff_lm = (
+        prow.get("last_modified_date")
+        or (existing.get(key) or {}).get("last_modified_date")
+        or prow.get("release_date")
+    )
+    if not eff_lm or not prow.get("md5_checksum"):
+        if key in existing:
+            return existing[key], "emit_existing_fallback"
+        return None, outcome
+    prow["last_modified_date"] = eff_lm
+    prow["retrieval_date"] = run_date
+    return prow, outcome
+
+
 def merge_annotations(
     existing_annotations_dict: dict,
     parsed_annotations_dict: dict,
@@ -237,7 +321,7 @@ def merge_annotations(
         )
         if not effective_last_modified:
             continue
-        row = dict(parsed_annotation)
+        row = copy_row(parsed_annotation)
         row["last_modified_date"] = effective_last_modified
         merged.append(row)
     return merged
@@ -285,11 +369,113 @@ def count_annotation_diffs(
     updated = sum(
         1
         for k in merged_keys & existing_keys
-        if _row_fingerprint(existing[k]) != _row_fingerprint(by_key[k])
+        if existing[k] is not by_key[k]
+        and _row_fingerprint(existing[k]) != _row_fingerprint(by_key[k])
     )
     return {"added": added, "updated": updated, "deleted": deleted}
 
 
+def _same_content(old: Mapping, new: Mapping) -> bool:
+    """_row_fingerprint(old) == _row_fingerprint(new), without sorting."""
+    keys = old.keys() - {"retrieval_date"}
+    if keys != new.keys() - {"retrieval_date"}:
+        return False
+    return all(old.get(k) == new.get(k) for k in keys)
+
+
+@dataclass
+class MergeResult:
+    rows: list[Mapping] = field(default_factory=list)
+    outcome_log: dict[str, str] = field(default_factory=dict)
+    stats: dict[str, int] = field(
+        default_factory=lambda: {"added": 0, "updated": 0, "deleted": 0}
+    )
+    lm_outcomes: dict[str, LmOutcome] = field(default_factory=dict)
+    final_outcomes: dict[str, FinalOutcome] = field(default_factory=dict)
+
+
+def merge_mirror(
+    existing: Mapping[str, Mapping],
+    existing_key_order: list[str],
+    parsed: dict[str, dict],
+    lm_results: list[ProbeResult],
+    md5_results: list[ProbeResult],
+    *,
+    key_column: str,
+    run_date: str,
+    skip_keys: set[str],
+    lm_probed_keys: set[str],
+    md5_probed_keys: set[str],
+    inferred: dict[str, LmOutcome] | None = None,
+) -> MergeResult:
+    """
+    One-pass equivalent of decide_last_modified_outcomes, decide_md5_outcomes,
+    build_merged_rows, order_merged_annotations_for_git and
+    count_annotation_diffs. Each key goes through the outcome state machine
+    once — existing keys in file order, then new ones — so rows come out in
+    git order with the diff stats counted alongside. Rows are assumed to be
+    keyed by their key_column value, as the loaders and providers key them.
+    """
+    lm_by_key = {r.key: r for r in lm_results}
+    md5_by_key = {r.key: r for r in md5_results}
+    inferred = inferred or {}
+    merged = MergeResult()
+    stats = merged.stats
+    seen: set[str] = set()
+    kept_existing = 0
+
+    def settle(key: str) -> Mapping | None:
+        nonlocal kept_existing
+        seen.add(key)
+        if key in skip_keys:
+            lm = "reuse_existing" if key in existing else None
+        elif key in inferred and key in parsed:
+            lm = inferred[key]
+        elif key in parsed:
+            lm = classify_last_modified(key, existing, parsed[key], lm_by_key.get(key))
+        else:
+            lm = None
+        if lm is not None:
+            merged.lm_outcomes[key] = lm
+            final = classify_md5(key, lm, existing, parsed, parsed, md5_by_key.get(key))
+        elif key in existing:
+            final = "emit_existing" if key in parsed else "gone"
+        else:
+            return None
+        merged.final_outcomes[key] = final
+        row, merged.outcome_log[key] = merged_row(
+            key,
+            final,
+            existing,
+            parsed,
+            run_date=run_date,
+            refresh=_should_refresh_retrieval_date(key, final, lm_probed_keys, md5_probed_keys),
+        )
+        if row is None:
+            return None
+        if key in existing:
+            kept_existing += 1
+            # emit_existing only ever refreshes retrieval_date.
+            if final == "emit_new" and not _same_content(existing[key], row):
+                stats["updated"] += 1
+        else:
+            stats["added"] += 1
+        return row
+
+    for key in existing_key_order:
+        if key not in seen and (row := settle(key)) is not None:
+            merged.rows.append(row)
+    new_rows = [
+        row
+        for key in chain(existing, parsed)
+        if key not in seen and (row := settle(key)) is not None
+    ]
+    new_rows.sort(key=lambda row: (row.get("assembly_accession") or "", row.get(key_column)))
+    merged.rows.extend(new_rows)
+    stats["deleted"] = len(existing) - kept_existing
+    return merged
+
+
 def write_mirror_stats(stats: dict[str, int], path: str) -> None:
     parent = os.path.dirname(os.path.abspath(path))
     if parent:
@@ -0,0 +1,148 @@
+"""
+Adaptive per-host concurrency (AIMD) driven by 429/503/timeout feedback.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+THROTTLE_STATUSES = frozenset({429, 503})
+DECREASE_FACTOR = 0.5
+# Latency EWMA above this multiple of the best observed latency stops growth.
+LATENCY_TOLERANCE = 2.0
+LATENCY_ALPHA = 0.2
+MAX_RETRY_AFTER = 300.0
+
+_limits_by_session: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class HostLimiter:
+    """
+    In-flight request limit for one host. Healthy responses raise the limit
+    by about one per round trip (limit += 1/limit) while latency stays near
+    its best; 429/503/timeouts halve it, and Retry-After pauses new requests
+    to the host until it expires.
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1) -> None:
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.best_latency: float | None = None
+        self.latency: float | None = None
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self.blocked_until - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if self._has_capacity():
+                self.in_flight += 1
+                return
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    self._wake()  # pass the wake-up on
+                raise
+
+    def release(
+        self,
+        *,
+        throttled: bool = False,
+        latency: float | None = None,
+        retry_after: float | None = None,
+    ) -> None:
+        """Return a slot; latency is given for healthy responses only."""
+        self.in_flight -= 1
+        if throttled:
+            self.limit = max(float(self.minimum), self.limit * DECREASE_FACTOR)
+            if retry_after:
+                until = asyncio.get_running_loop().time() + retry_after
+                self.blocked_until = max(self.blocked_until, until)
+        elif latency is not None:
+            self._observe_latency(latency)
+            if self.latency <= LATENCY_TOLERANCE * self.best_latency:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _observe_latency(self, latency: float) -> None:
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = max(latency, 1e-3)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_ALPHA * (latency - self.latency)
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class HostLimits:
+    """HostLimiter per hostname, created on first use."""
+
+    def __init__(self, initial: int, maximum: int) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self._hosts: dict[str, HostLimiter] = {}
+
+    def for_url(self, url: str) -> HostLimiter:
+        host = urlsplit(str(url)).hostname or ""
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = self._hosts[host] = HostLimiter(self.initial, self.maximum)
+        return limiter
+
+
+def attach(session, initial: int, maximum: int) -> HostLimits:
+    limits = HostLimits(initial, maximum)
+    _limits_by_session[session] = limits
+    return limits
+
+
+def for_session(session, initial: int, maximum: int) -> HostLimits:
+    """Limits attached to session (by make_session), or fresh ones."""
+    limits = _limits_by_session.get(session)
+    if limits is None:
+        limits = attach(session, initial, maximum)
+    return limits
@@ -0,0 +1,227 @@
+"""
+In-process gzip/BGZF inflation feeding MD5 (replaces piping through bgzip -dc).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+GZIP_MAGIC = b"\x1f\x8b"
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_BGZF_HEADER_LEN = 18  # fixed gzip header + XLEN + the 6-byte BC subfield
+BGZF_MAX_BLOCK = 1 << 16
+BGZF_BATCH_BLOCKS = 32
+# Batches in flight per stream. Constant (not per-core) so memory across
+# concurrent streams stays bounded: ~window x (1 MiB in + 2 MiB out) each.
+BGZF_WINDOW = 4
+INFLATE_WORKERS = os.cpu_count() or 1
+HASH_WORKERS = os.cpu_count() or 1
+
+_executor: ThreadPoolExecutor | None = None
+_hash_executor: ThreadPoolExecutor | None = None
+
+
+class InflateError(ValueError):
+    """Compressed stream is corrupt or truncated."""
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for BGZF block inflation (zlib releases the GIL)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=INFLATE_WORKERS, thread_name_prefix="bgzf"
+        )
+    return _executor
+
+
+def get_hash_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool running InflatingMd5.update for whole streams. Kept apart
+    from the block pool because its tasks wait on block inflation.
+    """
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(
+            max_workers=HASH_WORKERS, thread_name_prefix="md5"
+        )
+    return _hash_executor
+
+
+def bgzf_block_size(buf, pos: int = 0) -> int | None:
+    """
+    Total size of the BGZF block starting at buf[pos], or None if the header
+    is not fully buffered yet. Raises InflateError if it is not a BGZF block.
+    """
+    if len(buf) - pos < 12:
+        return None
+    if buf[pos] != 0x1F or buf[pos + 1] != 0x8B or buf[pos + 2] != 8 or not buf[pos + 3] & 4:
+        raise InflateError("not a BGZF block")
+    (xlen,) = struct.unpack_from("<H", buf, pos + 10)
+    if len(buf) - pos < 12 + xlen:
+        return None
+    off = pos + 12
+    end = off + xlen
+    while off + 4 <= end:
+        si1, si2, slen = buf[off], buf[off + 1], struct.unpack_from("<H", buf, off + 2)[0]
+        if off + 4 + slen > end:
+            raise InflateError("gzip extra subfield overruns XLEN")
+        if si1 == 66 and si2 == 67 and slen == 2:
+            return struct.unpack_from("<H", buf, off + 4)[0] + 1
+        off += 4 + slen
+    raise InflateError("gzip member without BGZF BC subfield")
+
+
+def inflate_bgzf_blocks(data: bytes | memoryview) -> bytes:
+    """Inflate a run of complete BGZF blocks, verifying CRC32 and ISIZE."""
+    view = memoryview(data)
+    out: list[bytes] = []
+    pos = 0
+    while pos < len(view):
+        size = bgzf_block_size(view, pos)
+        if size is None or pos + size > len(view):
+            raise InflateError("truncated BGZF block")
+        (xlen,) = struct.unpack_from("<H", view, pos + 10)
+        if size < 12 + xlen + 8:
+            raise InflateError("BGZF block smaller than its header")
+        crc, isize = struct.unpack_from("<II", view, pos + size - 8)
+        try:
+            block = zlib.decompress(view[pos + 12 + xlen : pos + size - 8], -zlib.MAX_WBITS, BGZF_MAX_BLOCK)
+        except zlib.error as e:
+            raise InflateError(str(e)) from e
+        if len(block) != isize or zlib.crc32(block) != crc:
+            raise InflateError("BGZF block checksum mismatch")
+        out.append(block)
+        pos += size
+    return b"".join(out)
+
+
+class InflatingMd5:
+    """
+    Incremental MD5 of the uncompressed content of a gzip stream.
+
+    Handles multi-member gzip and, like bgzip -dc, hashes input without the
+    gzip magic as-is. Chunks are fed to zlib through memoryviews so the
+    download buffers are never copied.
+
+    With an executor, BGZF input is split on block boundaries and batches of
+    blocks are inflated in parallel; results are hashed in stream order and
+    at most `window` batches are in flight, so update() blocks (and should be
+    called off the event loop) while the oldest batch is still inflating.
+    """
+
+    def __init__(self, executor: Executor | None = None, *, window: int | None = None) -> None:
+        self._md5 = hashlib.md5()
+        self._executor = executor
+        self._window = window or BGZF_WINDOW
+        self._mode: str | None = None  # "plain" | "gzip" | "bgzf"
+        self._head = b""
+        self._inflater = None
+        self._finished = False
+        self._buf = bytearray()
+        self._scan_pos = 0
+        self._scan_blocks = 0
+        self._pending: deque[Future] = deque()
+
+    def update(self, chunk: bytes | bytearray | memoryview) -> None:
+        if self._finished:
+            raise ValueError("update() after hexdigest()")
+        if self._mode is None:
+            self._head += chunk
+            if len(self._head) < _BGZF_HEADER_LEN:
+                return
+            chunk, self._head = self._head, b""
+            self._mode = self._sniff(chunk)
+        if self._mode == "bgzf":
+            self._split_blocks(chunk)
+        elif self._mode == "gzip":
+            self._inflate(memoryview(chunk))
+        else:
+            self._md5.update(chunk)
+
+    def _sniff(self, head: bytes) -> str:
+        if not head.startswith(GZIP_MAGIC):
+            return "plain"
+        if self._executor is None:
+            return "gzip"
+        try:
+            bgzf_block_size(head)
+        except InflateError:
+            return "gzip"
+        return "bgzf"
+
+    def _inflate(self, data: memoryview) -> None:
+        try:
+            while data:
+                if self._inflater is None:
+                    self._inflater = zlib.decompressobj(_GZIP_WBITS)
+                self._md5.update(self._inflater.decompress(data))
+                if not self._inflater.eof:
+                    return
+                # Member finished; anything left over starts the next one.
+                data = memoryview(self._inflater.unused_data)
+                self._inflater = None
+        except zlib.error as e:
+            raise InflateError(str(e)) from e
+
+    def _split_blocks(self, chunk) -> None:
+        self._buf += chunk
+        while True:
+            try:
+                size = bgzf_block_size(self._buf, self._scan_pos)
+            except InflateError:
+                # Plain gzip member after BGZF blocks: finish serially.
+                self._submit()
+                self._drain(0)
+                self._mode = "gzip"
+                rest, self._buf = bytes(self._buf), bytearray()
+                self._inflate(memoryview(rest))
+                return
+            if size is None or self._scan_pos + size > len(self._buf):
+                return
+            self._scan_pos += size
+            self._scan_blocks += 1
+            if self._scan_blocks >= BGZF_BATCH_BLOCKS:
+                self._submit()
+
+    def _submit(self) -> None:
+        if not self._scan_pos:
+            return
+        # Hand the buffer itself to the worker; only the partial trailing
+        # block (< 64 KiB) is copied into a fresh buffer.
+        batch = memoryview(self._buf)[: self._scan_pos]
+        self._buf = bytearray(batch.obj[self._scan_pos :])
+        self._scan_pos = 0
+        self._scan_blocks = 0
+        self._pending.append(self._executor.submit(inflate_bgzf_blocks, batch))
+        self._drain(self._window)
+
+    def _drain(self, keep: int) -> None:
+        while len(self._pending) > keep:
+            self._md5.update(self._pending.popleft().result())
+
+    def hexdigest(self) -> str:
+        if not self._finished:
+            self._finished = True
+            if self._mode is None:
+                head, self._head = self._head, b""
+                self._mode = "gzip" if head.startswith(GZIP_MAGIC) else "plain"
+                if self._mode == "gzip":
+                    self._inflate(memoryview(head))
+                else:
+                    self._md5.update(head)
+            if self._mode == "bgzf":
+                if self._buf:
+                    if self._scan_pos != len(self._buf):
+                        self._drain(0)
+                        raise InflateError("truncated BGZF stream")
+                    self._submit()
+                self._drain(0)
+            if self._inflater is not None:
+                raise InflateError("truncated gzip stream")
+        return self._md5.hexdigest()
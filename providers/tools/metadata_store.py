@@ -0,0 +1,74 @@
+"""
+SQLite-backed cache of assembly metadata keyed by versioned accession.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from datetime import date
+
+METADATA_FIELDS = ("assembly_name", "taxon_id", "organism_name")
+# Stay well under SQLite's bound-parameter limit in bulk lookups.
+LOOKUP_CHUNK = 500
+
+
+class AssemblyMetadataStore:
+    """
+    assembly_name / taxon_id / organism_name per versioned accession. These
+    never change for a given version, so entries do not expire.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS assembly_metadata (
+                accession TEXT PRIMARY KEY,
+                assembly_name TEXT,
+                taxon_id INTEGER,
+                organism_name TEXT,
+                updated TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, accessions) -> dict[str, dict]:
+        """Stored metadata for each of accessions that is present."""
+        unique = sorted(set(accessions))
+        found: dict[str, dict] = {}
+        for i in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[i : i + LOOKUP_CHUNK]
+            rows = self._conn.execute(
+                f"SELECT accession, {', '.join(METADATA_FIELDS)} FROM assembly_metadata "
+                f"WHERE accession IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for accession, *values in rows:
+                found[accession] = dict(zip(METADATA_FIELDS, values))
+        return found
+
+    def upsert_many(self, metadata: dict[str, dict]) -> None:
+        today = date.today().isoformat()
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO assembly_metadata (accession, {', '.join(METADATA_FIELDS)}, updated) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(accession) DO UPDATE SET "
+                + ", ".join(f"{f} = excluded.{f}" for f in METADATA_FIELDS)
+                + ", updated = excluded.updated",
+                (
+                    (acc, *(meta.get(f) for f in METADATA_FIELDS), today)
+                    for acc, meta in metadata.items()
+                ),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> AssemblyMetadataStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
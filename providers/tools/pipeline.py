@@ -6,73 +6,313 @@ from __future__ import annotations
 
 import asyncio
 import os
-from collections.abc import Callable
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Container,
+    Iterable,
+)
 from datetime import datetime
 
-from tools import file_handler, helper
-from tools.async_ops import DEFAULT_CONCURRENCY, ProbeResult, check_last_modified_date_many
+import aiohttp
+
+from tools import async_ops, helper
+from tools.async_ops import DEFAULT_CONCURRENCY, ProbeResult
+from tools.cache import ValidatorCache
+from tools.state_store import TsvStateStore, open_state_store
+
+# (session, access_url, key, parsed) -> ProbeResult; may rewrite parsed[key]["access_url"].
+Md5Probe = Callable[
+    [aiohttp.ClientSession, str, str, dict[str, dict]], Awaitable[ProbeResult]
+]
+# (session, access_url, key, *, validators) -> ProbeResult; see async_ops.probe_last_modified.
+LastModifiedProbe = Callable[..., Awaitable[ProbeResult]]
+# Yields the universe in chunks of parsed rows so probing can start early.
+UniverseStream = Callable[[], AsyncIterator[dict[str, dict]]]
+
+
+async def probe_changes(
+    lm_tuples: Iterable[tuple[str, str]] | AsyncIterable[tuple[str, str]],
+    existing: dict[str, dict],
+    parsed: dict[str, dict],
+    probe_md5: Md5Probe,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    validator_cache: ValidatorCache | None = None,
+    probe_last_modified: LastModifiedProbe | None = None,
+    md5_only: Container[str] = (),
+) -> tuple[list[ProbeResult], list[ProbeResult]]:
+    """
+    Probe last-modified for every tuple and, as soon as a key's result says
+    refresh_md5, run its MD5 probe on the same session — no barrier between
+    the two stages. lm_tuples is consumed lazily by the worker pool.
+    Existing keys with cached validators get conditional requests, and an
+    MD5 already carried by the last-modified result is used without a second
+    probe. Keys in md5_only are already known to need refresh_md5 and skip
+    the last-modified probe. Returns (lm_results, md5_results) in completion
+    order.
+    """
+    lm_results: list[ProbeResult] = []
+    md5_results: list[ProbeResult] = []
+    probe_lm = probe_last_modified or async_ops.probe_last_modified
+
+    async def probe_key(
+        session: aiohttp.ClientSession, url: str, key: str
+    ) -> ProbeResult | None:
+        if key in md5_only:
+            md5_results.append(await probe_md5(session, parsed[key]["access_url"], key, parsed))
+            return None
+        validators = None
+        if validator_cache is not None and key in existing:
+            validators = validator_cache.get(url)
+        lm = await probe_lm(session, url, key, validators=validators)
+        if helper.classify_last_modified(key, existing, parsed[key], lm) != "refresh_md5":
+            return lm
+        if lm.md5 is not None:
+            md5_results.append(ProbeResult(key=key, status="ok", value=lm.md5, detail=lm.detail))
+        else:
+            md5_results.append(await probe_md5(session, parsed[key]["access_url"], key, parsed))
+        return lm
+
+    async with async_ops.make_session(concurrency) as session:
+        # Enough workers for the per-host limits to grow to their ceiling.
+        workers = max(concurrency, async_ops.MAX_HOST_CONCURRENCY)
+        async for _, lm in async_ops.iter_probe_results(
+            lm_tuples, probe_key, session, workers
+        ):
+            if lm is not None:
+                lm_results.append(lm)
+    return lm_results, md5_results
+
+
+async def _single_chunk(parsed: dict[str, dict]) -> AsyncIterator[dict[str, dict]]:
+    yield parsed
+
+
+async def load_and_probe(
+    universe: AsyncIterator[dict[str, dict]],
+    existing: dict[str, dict],
+    probe_md5: Md5Probe,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    validator_cache: ValidatorCache | None = None,
+    probe_last_modified: LastModifiedProbe | None = None,
+    metadata_fields: tuple[str, ...] = (),
+    metadata_current: Callable[[str], bool] | None = None,
+) -> tuple[
+    dict[str, dict],
+    dict[str, str],
+    list[ProbeResult],
+    list[ProbeResult],
+    dict[str, helper.LmOutcome],
+]:
+    """
+    Probe keys as universe chunks arrive rather than after the whole universe
+    is loaded. Recently retrieved keys are not probed, and neither are keys
+    whose outcome follows from their metadata_fields (helper.infer_from_metadata);
+    of those, only the ones needing refresh_md5 get an MD5 probe. When
+    metadata_current is given, unchanged metadata is trusted only for keys it
+    accepts (the rest may carry stale metadata and are probed).
+    Returns (parsed, probed_urls, lm_results, md5_results, inferred).
+    """
+    parsed: dict[str, dict] = {}
+    probed_urls: dict[str, str] = {}
+    inferred: dict[str, helper.LmOutcome] = {}
+    md5_only: set[str] = set()
+    cutoff = helper.recent_retrieval_cutoff()
+    verified_cutoff = helper.metadata_verified_cutoff()
+
+    async def lm_tuples() -> AsyncIterator[tuple[str, str]]:
+        async for chunk in universe:
+            parsed.update(chunk)
+            for key, row in chunk.items():
+                if key in probed_urls or key in inferred:
+                    continue
+                stored = existing.get(key)
+                if helper.retrieved_recently(stored, cutoff):
+                    continue
+                current = metadata_current is None or metadata_current(key)
+                outcome = helper.infer_from_metadata(
+                    stored, row, metadata_fields, verified_cutoff if current else None
+                )
+                if outcome is not None:
+                    inferred[key] = outcome
+                    if outcome == "refresh_md5":
+                        md5_only.add(key)
+                        yield row["access_url"], key
+                    continue
+                probed_urls[key] = row["access_url"]
+                yield row["access_url"], key
+
+    lm_results, md5_results = await probe_changes(
+        lm_tuples(),
+        existing,
+        parsed,
+        probe_md5,
+        concurrency,
+        validator_cache,
+        probe_last_modified,
+        md5_only,
+    )
+    return parsed, probed_urls, lm_results, md5_results, inferred
+
+
+def record_validators(
+    validator_cache: ValidatorCache,
+    lm_results: list[ProbeResult],
+    lm_outcomes: dict[str, helper.LmOutcome],
+    final_outcomes: dict[str, helper.FinalOutcome],
+    merged_rows: list[dict],
+    probed_urls: dict[str, str],
+) -> None:
+    """
+    Remember validators only where the written row matches what was probed:
+    unchanged rows (reuse_existing) and freshly emitted ones (emit_new).
+    """
+    rows_by_url = {row.get("access_url"): row for row in merged_rows}
+    for result in lm_results:
+        url = probed_urls.get(result.key)
+        if url is None or url not in rows_by_url:
+            continue
+        confirmed = lm_outcomes.get(result.key) == "reuse_existing" or (
+            final_outcomes.get(result.key) == "emit_new"
+        )
+        if confirmed:
+            validator_cache.record(url, result.validators)
+        elif lm_outcomes.get(result.key) == "refresh_md5":
+            validator_cache.discard(url)
+    validator_cache.retain(set(rows_by_url))
 
 
 def run_mirror(
     *,
     output_file: str,
     key_column: str,
-    load_universe: Callable[[], dict[str, dict]],
-    probe_md5: Callable[[list[tuple[str, str]], int, dict[str, dict]], list[ProbeResult]],
+    load_universe: Callable[[], dict[str, dict]] | None = None,
+    probe_md5: Md5Probe,
     source_label: str,
     stats_path: str | None = None,
     outcomes_path: str | None = None,
     concurrency: int = DEFAULT_CONCURRENCY,
+    validator_cache: ValidatorCache | None = None,
+    probe_last_modified: LastModifiedProbe | None = None,
+    stream_universe: UniverseStream | None = None,
+    metadata_fields: tuple[str, ...] = (),
+    metadata_current: Callable[[str], bool] | None = None,
+    state_store: TsvStateStore | None = None,
 ) -> None:
-    existing, existing_key_order = file_handler.load_annotations_ordered(
-        output_file, key_column
-    )
+    """
+    Mirror one provider into output_file. Rows are loaded from and committed
+    to state_store (default: open_state_store, i.e. MIRROR_STATE_BACKEND).
+    """
+    store = state_store or open_state_store(output_file, key_column, source_label)
+    try:
+        _run_mirror(
+            store,
+            output_file=output_file,
+            key_column=key_column,
+            load_universe=load_universe,
+            probe_md5=probe_md5,
+            source_label=source_label,
+            stats_path=stats_path,
+            outcomes_path=outcomes_path,
+            concurrency=concurrency,
+            validator_cache=validator_cache,
+            probe_last_modified=probe_last_modified,
+            stream_universe=stream_universe,
+            metadata_fields=metadata_fields,
+            metadata_current=metadata_current,
+        )
+    finally:
+        if state_store is None:
+            store.close()
+
+
+def _run_mirror(
+    store: TsvStateStore,
+    *,
+    output_file: str,
+    key_column: str,
+    load_universe: Callable[[], dict[str, dict]] | None,
+    probe_md5: Md5Probe,
+    source_label: str,
+    stats_path: str | None,
+    outcomes_path: str | None,
+    concurrency: int,
+    validator_cache: ValidatorCache | None,
+    probe_last_modified: LastModifiedProbe | None,
+    stream_universe: UniverseStream | None,
+    metadata_fields: tuple[str, ...],
+    metadata_current: Callable[[str], bool] | None,
+) -> None:
+    existing, existing_key_order = store.load()
     print(f"[{source_label}] Found {len(existing)} existing annotations")
 
-    parsed = load_universe()
+    if stream_universe is None:
+        parsed = load_universe()
+        if not parsed:
+            raise RuntimeError(
+                f"[{source_label}] Source listing is empty — aborting to avoid wiping TSV"
+            )
+        print(f"[{source_label}] Found {len(parsed)} annotations in source listing")
+        universe = _single_chunk(parsed)
+    else:
+        print(f"[{source_label}] Probing while the source listing loads...")
+        universe = stream_universe()
+
+    parsed, probed_urls, lm_results, md5_results, inferred = asyncio.run(
+        load_and_probe(
+            universe,
+            existing,
+            probe_md5,
+            concurrency,
+            validator_cache,
+            probe_last_modified,
+            metadata_fields,
+            metadata_current,
+        )
+    )
     if not parsed:
         raise RuntimeError(f"[{source_label}] Source listing is empty — aborting to avoid wiping TSV")
-    print(f"[{source_label}] Found {len(parsed)} annotations in source listing")
+    if stream_universe is not None:
+        print(f"[{source_label}] Found {len(parsed)} annotations in source listing")
 
-    source_keys = set(parsed.keys())
     run_date = datetime.now().date().isoformat()
     skip_keys = set(helper.keep_recent_annotations(existing, parsed))
+    lm_probed_keys = set(probed_urls)
     print(
-        f"[{source_label}] Skipping re-probe for {len(skip_keys)} rows "
-        f"retrieved within {helper.RECENT_RETRIEVAL_DAYS} days"
+        f"[{source_label}] Skipped re-probe for {len(skip_keys)} rows "
+        f"retrieved within {helper.RECENT_RETRIEVAL_DAYS} days; "
+        f"probed last-modified for {len(lm_probed_keys)} rows"
     )
-
-    lm_tuples = helper.get_tuples_to_check(skip_keys, parsed)
-    lm_probed_keys = {key for _, key in lm_tuples}
-    print(f"[{source_label}] Probing last-modified for {len(lm_tuples)} rows...")
-    lm_results = asyncio.run(check_last_modified_date_many(lm_tuples, concurrency))
-    lm_outcomes = helper.decide_last_modified_outcomes(existing, parsed, lm_results, skip_keys)
-
-    md5_keys = {k for k, o in lm_outcomes.items() if o == "refresh_md5"}
-    md5_tuples = [(parsed[k]["access_url"], k) for k in md5_keys if k in parsed]
-    md5_probed_keys = {key for _, key in md5_tuples}
-    print(f"[{source_label}] Fetching MD5 for {len(md5_tuples)} rows...")
-    md5_results: list[ProbeResult] = []
-    if md5_tuples:
-        md5_results = probe_md5(md5_tuples, concurrency, parsed)
-
-    final_outcomes = helper.decide_md5_outcomes(
-        existing, parsed, md5_results, lm_outcomes, source_keys
+    if metadata_fields:
+        changed = sum(1 for o in inferred.values() if o == "refresh_md5")
+        print(
+            f"[{source_label}] Metadata decided {len(inferred)} rows without a "
+            f"last-modified probe ({len(inferred) - changed} unchanged, {changed} changed)"
+        )
+    md5_probed_keys = {r.key for r in md5_results}
+    not_modified = sum(1 for r in lm_results if r.status == "not_modified")
+    print(
+        f"[{source_label}] Fetched MD5 for {len(md5_probed_keys)} rows "
+        f"({not_modified} answered 304 Not Modified)"
     )
-    merged_rows, outcome_log = helper.build_merged_rows(
+
+    merged = helper.merge_mirror(
         existing,
+        existing_key_order,
         parsed,
-        final_outcomes,
+        lm_results,
+        md5_results,
+        key_column=key_column,
         run_date=run_date,
+        skip_keys=skip_keys,
         lm_probed_keys=lm_probed_keys,
         md5_probed_keys=md5_probed_keys,
+        inferred=inferred,
     )
-    print(f"[{source_label}] Merged {len(merged_rows)} annotations")
-
-    merged_ordered = helper.order_merged_annotations_for_git(
-        merged_rows, existing_key_order, key_column
-    )
-    stats = helper.count_annotation_diffs(existing, merged_ordered, key_column)
+    merged_ordered, outcome_log, stats = merged.rows, merged.outcome_log, merged.stats
+    print(f"[{source_label}] Merged {len(merged_ordered)} annotations")
 
     if stats_path is None:
         stats_path = os.path.join(
@@ -90,5 +330,16 @@ def run_mirror(
         f"deleted={stats['deleted']} (stats→{stats_path}, outcomes→{outcomes_path})"
     )
 
-    file_handler.write_annotations(merged_ordered, output_file)
+    store.commit(merged_ordered, outcome_log)
     print(f"[{source_label}] Written {len(merged_ordered)} rows to {output_file}")
+
+    if validator_cache is not None:
+        record_validators(
+            validator_cache,
+            lm_results,
+            merged.lm_outcomes,
+            merged.final_outcomes,
+            merged_ordered,
+            probed_urls,
+        )
+        validator_cache.save()
@@ -0,0 +1,106 @@
+"""
+Compact row type for annotation records (fields of annotation-schema.json).
+"""
+
+from __future__ import annotations
+
+import sys
+from collections.abc import Mapping, MutableMapping
+
+# Column order of a freshly written TSV.
+ANNOTATION_FIELDS = (
+    "assembly_accession",
+    "assembly_name",
+    "taxon_id",
+    "organism_name",
+    "source_database",
+    "annotation_provider",
+    "access_url",
+    "file_format",
+    "release_date",
+    "pipeline_name",
+    "pipeline_method",
+    "pipeline_version",
+    "last_modified_date",
+    "md5_checksum",
+    "retrieval_date",
+)
+_FIELD_SET = frozenset(ANNOTATION_FIELDS)
+# Values repeated across many rows; interned so rows share one string.
+INTERNED_FIELDS = frozenset(
+    {
+        "organism_name",
+        "source_database",
+        "annotation_provider",
+        "file_format",
+        "pipeline_name",
+        "pipeline_method",
+        "pipeline_version",
+    }
+)
+
+
+class AnnotationRecord(MutableMapping):
+    """
+    One annotation row with a slot per schema field instead of a per-row
+    dict. It is a mutable mapping over the fields that have been set (None is
+    a value, not "unset"), so code written for dict rows works unchanged.
+    """
+
+    __slots__ = ANNOTATION_FIELDS
+
+    def __init__(self, **fields) -> None:
+        for name, value in fields.items():
+            self[name] = value
+
+    def __getitem__(self, name: str):
+        if name in _FIELD_SET:
+            try:
+                return getattr(self, name)
+            except AttributeError:
+                pass
+        raise KeyError(name)
+
+    def __setitem__(self, name: str, value) -> None:
+        if name not in _FIELD_SET:
+            raise KeyError(f"{name!r} is not an annotation field")
+        if name in INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        setattr(self, name, value)
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        delattr(self, name)
+
+    def __iter__(self):
+        return (name for name in ANNOTATION_FIELDS if hasattr(self, name))
+
+    def __len__(self) -> int:
+        return sum(1 for name in ANNOTATION_FIELDS if hasattr(self, name))
+
+    def __contains__(self, name) -> bool:
+        return name in _FIELD_SET and hasattr(self, name)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default) if name in _FIELD_SET else default
+
+    def copy(self) -> AnnotationRecord:
+        new = AnnotationRecord.__new__(AnnotationRecord)
+        for name in ANNOTATION_FIELDS:
+            if hasattr(self, name):
+                setattr(new, name, getattr(self, name))
+        return new
+
+    def __repr__(self) -> str:
+        return f"AnnotationRecord({dict(self)!r})"
+
+
+def copy_row(row: Mapping) -> MutableMapping:
+    """
+    A mutable copy of row. Records stay records; any other row (a dict or a
+    TSV LazyRow) becomes a dict so its columns keep the file's order.
+    """
+    if isinstance(row, AnnotationRecord):
+        return row.copy()
+    return dict(row)
@@ -0,0 +1,197 @@
+"""
+Where a mirror keeps its rows between runs. The git-ordered TSV in data/ is
+always the published copy; SqliteStateStore also keeps the rows in an
+indexed database so each run only writes the rows that changed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections.abc import Mapping
+
+from tools import cache, file_handler
+
+# "tsv" (rows live only in the TSV) or "sqlite". The sqlite store still
+# decodes every row on load and re-exports the whole TSV on change, and it
+# rebuilds whenever something else (e.g. registry's release-date backfill)
+# rewrites the TSV, so the workflows keep the default.
+STATE_BACKEND = os.getenv("MIRROR_STATE_BACKEND", "tsv")
+DIGEST_CHUNK = 1 << 20
+
+
+def file_digest(path: str) -> str | None:
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(DIGEST_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TsvStateStore:
+    """Rows read from and rewritten to the TSV itself."""
+
+    def __init__(self, tsv_path: str, key_column: str) -> None:
+        self.tsv_path = tsv_path
+        self.key_column = key_column
+        self._table: Mapping[str, Mapping] | None = None
+
+    def load(self) -> tuple[Mapping[str, Mapping], list[str]]:
+        """
+        (rows by key, keys in file order), as file_handler.load_annotations_ordered
+        but with rows read lazily from the mapped TSV.
+        """
+        self._table, order = file_handler.load_annotations_lazy(self.tsv_path, self.key_column)
+        return self._table, order
+
+    def commit(self, rows: list[dict], outcomes: dict[str, str]) -> None:
+        """Store rows (in git order) with the run's outcome per key."""
+        file_handler.write_annotations(rows, self.tsv_path)
+
+    def close(self) -> None:
+        if isinstance(self._table, file_handler.LazyTable):
+            self._table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class SqliteStateStore(TsvStateStore):
+    """
+    Rows and their last outcome in SQLite, with the TSV exported from it. The
+    database remembers the digest of the TSV it last exported; when the TSV
+    differs (edited in git, or the database is new) it is rebuilt from the
+    TSV, so the TSV stays the source of truth.
+    """
+
+    def __init__(self, tsv_path: str, key_column: str, db_path: str) -> None:
+        super().__init__(tsv_path, key_column)
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rows (
+                key TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                outcome TEXT
+            );
+            CREATE INDEX IF NOT EXISTS rows_position ON rows (position);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        # key -> (data, outcome) as stored, to find what a commit changes.
+        self._stored: dict[str, tuple[str, str | None]] = {}
+        self._next_position = 0
+
+    def _meta(self, name: str) -> str | None:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name: str, value: str | None) -> None:
+        self._conn.execute(
+            "INSERT INTO meta (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value),
+        )
+
+    def load(self) -> tuple[dict[str, dict], list[str]]:
+        digest = file_digest(self.tsv_path)
+        if digest != self._meta("tsv_digest") or self._meta("key_column") != self.key_column:
+            return self._rebuild(digest)
+        rows: dict[str, dict] = {}
+        order: list[str] = []
+        self._stored = {}
+        for key, position, data, outcome in self._conn.execute(
+            "SELECT key, position, data, outcome FROM rows ORDER BY position"
+        ):
+            rows[key] = json.loads(data)
+            order.append(key)
+            self._stored[key] = (data, outcome)
+            self._next_position = position + 1
+        return rows, order
+
+    def _rebuild(self, digest: str | None) -> tuple[dict[str, dict], list[str]]:
+        rows, order = file_handler.load_annotations_ordered(self.tsv_path, self.key_column)
+        self._stored = {key: (json.dumps(rows[key]), None) for key in order}
+        self._next_position = len(order)
+        with self._conn:
+            self._conn.execute("DELETE FROM rows")
+            self._conn.executemany(
+                "INSERT INTO rows (key, position, data, outcome) VALUES (?, ?, ?, NULL)",
+                ((key, i, self._stored[key][0]) for i, key in enumerate(order)),
+            )
+            self._set_meta("tsv_digest", digest)
+            self._set_meta("key_column", self.key_column)
+        return rows, order
+
+    def commit(self, rows: list[dict], outcomes: dict[str, str]) -> None:
+        """
+        Upsert changed rows, delete dropped ones and re-export the TSV only if
+        anything changed. Rows already stored keep their position; new rows
+        are appended in the order given.
+        """
+        if not rows:
+            raise ValueError("Cannot write empty annotations list")
+        fields = list(rows[0])
+        inserts: list[tuple[str, int, str, str | None]] = []
+        updates: list[tuple[str, str | None, str]] = []
+        keep: set[str] = set()
+        for row in rows:
+            key = row[self.key_column]
+            keep.add(key)
+            # Stored exactly as the TSV export renders it, so both backends load alike.
+            as_written = {f: "" if row.get(f) is None else str(row[f]) for f in fields}
+            data, outcome = json.dumps(as_written), outcomes.get(key)
+            if key not in self._stored:
+                inserts.append((key, self._next_position, data, outcome))
+                self._next_position += 1
+            elif self._stored[key] != (data, outcome):
+                updates.append((data, outcome, key))
+        dropped = [key for key in self._stored if key not in keep]
+        if (
+            not inserts
+            and not updates
+            and not dropped
+            and file_digest(self.tsv_path) == self._meta("tsv_digest")
+        ):
+            return
+
+        file_handler.write_annotations(rows, self.tsv_path)
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO rows (key, position, data, outcome) VALUES (?, ?, ?, ?)", inserts
+            )
+            self._conn.executemany("UPDATE rows SET data = ?, outcome = ? WHERE key = ?", updates)
+            self._conn.executemany("DELETE FROM rows WHERE key = ?", ((k,) for k in dropped))
+            self._set_meta("tsv_digest", file_digest(self.tsv_path))
+        for key, _, data, outcome in inserts:
+            self._stored[key] = (data, outcome)
+        for data, outcome, key in updates:
+            self._stored[key] = (data, outcome)
+        for key in dropped:
+            del self._stored[key]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_state_store(
+    tsv_path: str, key_column: str, source_label: str, backend: str | None = None
+) -> TsvStateStore:
+    """State store for one mirror, chosen by backend (default MIRROR_STATE_BACKEND)."""
+    backend = backend or STATE_BACKEND
+    if backend == "tsv":
+        return TsvStateStore(tsv_path, key_column)
+    if backend == "sqlite":
+        return SqliteStateStore(
+            tsv_path, key_column, cache.cache_path(f"state_{source_label}.sqlite")
+        )
+    raise ValueError(f"Unknown state backend {backend!r}, must be 'tsv' or 'sqlite'")
@@ -0,0 +1,199 @@
+"""Unit tests for HTTP retry and probe scheduling in providers/tools/async_ops.py."""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import unittest
+from contextlib import aclosing
+from unittest.mock import patch
+
+sys.path.insert(0, "providers")
+
+from tools import async_ops, host_limits  # noqa: E402
+from tools.async_ops import ProbeResult  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: str = "", headers: dict | None = None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+        self.released = False
+
+    async def text(self) -> str:
+        return self.body
+
+    def release(self) -> None:
+        self.released = True
+
+
+class FakeSession:
+    """Stands in for aiohttp.ClientSession; hands out scripted responses."""
+
+    def __init__(self, *responses: FakeResponse):
+        self.responses = list(responses)
+        self.requests: list[tuple[str, str]] = []
+        self.headers: list[dict] = []
+
+    async def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        self.headers.append(kwargs.get("headers") or {})
+        return self.responses.pop(0)
+
+
+@patch("tools.async_ops._retry_delay", return_value=0)
+class TestOpenWithRetry(unittest.IsolatedAsyncioTestCase):
+    async def test_transient_status_is_released_and_retried(self, _delay):
+        busy, ok = FakeResponse(503), FakeResponse(200, "body")
+        session = FakeSession(busy, ok)
+        async with async_ops.open_with_retry(session, "GET", "u", attempts=3) as resp:
+            self.assertIs(resp, ok)
+            self.assertEqual(await resp.text(), "body")
+        self.assertTrue(busy.released)
+        self.assertTrue(ok.released)
+        self.assertEqual(len(session.requests), 2)
+
+    async def test_not_found_returns_without_retry(self, _delay):
+        session = FakeSession(FakeResponse(404), FakeResponse(200))
+        async with async_ops.open_with_retry(session, "GET", "u", attempts=3) as resp:
+            self.assertEqual(resp.status, 404)
+        self.assertEqual(len(session.requests), 1)
+
+    async def test_last_transient_response_yielded_when_exhausted(self, _delay):
+        last = FakeResponse(503)
+        session = FakeSession(FakeResponse(503), last)
+        async with async_ops.open_with_retry(session, "GET", "u", attempts=2) as resp:
+            self.assertIs(resp, last)
+        self.assertEqual(len(session.requests), 2)
+
+    async def test_retry_after_pauses_host_and_cuts_limit(self, delay):
+        session = FakeSession(FakeResponse(429, headers={"Retry-After": "0.05"}), FakeResponse(200))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with async_ops.open_with_retry(session, "GET", "https://h/x", attempts=3) as resp:
+            self.assertEqual(resp.status, 200)
+        self.assertGreaterEqual(loop.time() - started, 0.04)
+        delay.assert_not_called()
+        limiter = host_limits.for_session(session, 12, 32).for_url("https://h/x")
+        self.assertLess(limiter.limit, 12)
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_cancelled_request_releases_host_slot(self, _delay):
+        class HangingSession(FakeSession):
+            async def request(self, method, url, **kwargs):
+                await asyncio.Event().wait()
+
+        session = HangingSession()
+
+        async def fetch():
+            async with async_ops.open_with_retry(session, "GET", "https://h/x"):
+                pass
+
+        task = asyncio.create_task(fetch())
+        await asyncio.sleep(0)
+        limiter = host_limits.for_session(session, 12, 32).for_url("https://h/x")
+        self.assertEqual(limiter.in_flight, 1)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_fetch_url_text_reads_body_from_single_request(self, _delay):
+        session = FakeSession(FakeResponse(200, "a\tb\n"))
+        result = await async_ops.fetch_url_text(session, "u", "k")
+        self.assertEqual((result.status, result.value), ("ok", "a\tb\n"))
+        self.assertEqual(session.requests, [("GET", "u")])
+
+    async def test_conditional_head_304_is_not_modified(self, _delay):
+        session = FakeSession(FakeResponse(304))
+        validators = {"etag": '"abc"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+        result = await async_ops.probe_last_modified(session, "u", "k", validators=validators)
+        self.assertEqual((result.status, result.detail), ("not_modified", "head_304"))
+        self.assertEqual(session.headers[0]["If-None-Match"], '"abc"')
+        self.assertIn("If-Modified-Since", session.headers[0])
+
+    async def test_last_modified_result_carries_validators(self, _delay):
+        headers = {"Last-Modified": "Tue, 02 Jan 2024 10:00:00 GMT", "ETag": '"v2"'}
+        session = FakeSession(FakeResponse(200, headers=headers))
+        result = await async_ops.probe_last_modified(session, "u", "k")
+        self.assertEqual(result.status, "ok")
+        self.assertEqual(result.validators["etag"], '"v2"')
+        self.assertEqual(session.headers, [{}])
+
+    async def test_conditional_fetch_url_text(self, _delay):
+        session = FakeSession(FakeResponse(304), FakeResponse(200, "x", headers={"ETag": '"e"'}))
+        stale = await async_ops.fetch_url_text(session, "u", "k", validators={"etag": '"e"'})
+        self.assertEqual(stale.status, "not_modified")
+        self.assertEqual(session.headers[0], {"If-None-Match": '"e"'})
+        fresh = await async_ops.fetch_url_text(session, "u", "k")
+        self.assertEqual((fresh.value, fresh.validators), ("x", {"etag": '"e"'}))
+
+
+class TestIterProbeResults(unittest.IsolatedAsyncioTestCase):
+    async def test_bounded_workers_and_one_result_per_input(self):
+        active = 0
+        peak = 0
+
+        async def probe(session, url, key):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.001 * (int(key) % 3))
+            active -= 1
+            return ProbeResult(key=key, status="ok", value=url)
+
+        tuples = ((f"u{i}", str(i)) for i in range(200))
+        seen = {}
+        async for idx, result in async_ops.iter_probe_results(tuples, probe, None, 5):
+            seen[idx] = result
+        self.assertEqual(sorted(seen), list(range(200)))
+        self.assertEqual(seen[42].value, "u42")
+        self.assertLessEqual(peak, 5)
+
+    async def test_probe_many_preserves_input_order(self):
+        async def probe(session, url, key):
+            await asyncio.sleep(0.001 * (5 - int(key)))
+            return ProbeResult(key=key, status="ok")
+
+        tuples = [("u", str(i)) for i in range(5)]
+        results = await async_ops.probe_many(tuples, probe, 3, session=object())
+        self.assertEqual([r.key for r in results], ["0", "1", "2", "3", "4"])
+
+    async def test_probe_error_propagates_and_cancels_workers(self):
+        cancelled = 0
+
+        async def probe(session, url, key):
+            nonlocal cancelled
+            if key == "3":
+                raise RuntimeError("boom")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled += 1
+                raise
+            return ProbeResult(key=key, status="ok")
+
+        tuples = [("u", str(i)) for i in range(10)]
+        with self.assertRaises(RuntimeError):
+            async for _ in async_ops.iter_probe_results(tuples, probe, None, 4):
+                pass
+        self.assertEqual(cancelled, 3)
+
+    async def test_early_exit_stops_workers(self):
+        calls = 0
+
+        async def probe(session, url, key):
+            nonlocal calls
+            calls += 1
+            return ProbeResult(key=key, status="ok")
+
+        tuples = ((f"u{i}", str(i)) for i in range(10_000))
+        async with aclosing(async_ops.iter_probe_results(tuples, probe, None, 2)) as results:
+            async for _ in results:
+                break
+        self.assertLess(calls, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Unit tests for the persistent caches in providers/tools/cache.py."""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date
+
+sys.path.insert(0, "providers")
+
+from tools import cache  # noqa: E402
+from tools.cache import ExpiringCache, ValidatorCache  # noqa: E402
+
+
+class TestValidators(unittest.TestCase):
+    def test_header_names_are_case_insensitive(self):
+        got = cache.validators_from_headers(
+            {"Etag": '"v1"', "last-modified": "Mon, 01 Jan 2024 00:00:00 GMT", "Content-Length": "9"}
+        )
+        self.assertEqual(
+            got,
+            {"etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT", "content_length": "9"},
+        )
+        self.assertIsNone(cache.validators_from_headers({"Content-Length": "9"}))
+
+    def test_conditional_headers(self):
+        self.assertEqual(cache.conditional_headers(None), {})
+        self.assertEqual(
+            cache.conditional_headers({"etag": '"v1"', "content_length": "9"}),
+            {"If-None-Match": '"v1"'},
+        )
+
+
+class TestValidatorCache(unittest.TestCase):
+    def test_round_trip_and_retain(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "validators.json")
+            store = ValidatorCache(path)
+            store.record("https://x/a", {"etag": '"a"'})
+            store.record("https://x/b", {"etag": '"b"'})
+            store.record("https://x/c", None)
+            store.save()
+
+            reloaded = ValidatorCache(path)
+            self.assertEqual(reloaded.get("https://x/a"), {"etag": '"a"'})
+            self.assertIsNone(reloaded.get("https://x/c"))
+            reloaded.retain({"https://x/b"})
+            reloaded.save()
+            self.assertIsNone(ValidatorCache(path).get("https://x/a"))
+
+    def test_corrupt_file_starts_empty(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "validators.json")
+            with open(path, "w") as f:
+                f.write("{not json")
+            self.assertIsNone(ValidatorCache(path).get("https://x/a"))
+
+
+class TestExpiringCache(unittest.TestCase):
+    def test_positive_and_negative_entries_expire_separately(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "paths.json")
+            store = ExpiringCache(path, ttl_days=30, negative_ttl_days=3, today=date(2024, 1, 1))
+            store.put("GCA_1", "GCA_1_asm")
+            store.put("GCA_2", None)
+            store.save()
+
+            later = ExpiringCache(path, ttl_days=30, negative_ttl_days=3, today=date(2024, 1, 2))
+            self.assertEqual(later.lookup("GCA_1"), (True, "GCA_1_asm"))
+            self.assertEqual(later.lookup("GCA_2"), (True, None))
+            self.assertEqual(later.lookup("GCA_3"), (False, None))
+
+            expired = ExpiringCache(path, ttl_days=30, negative_ttl_days=3, today=date(2024, 1, 10))
+            self.assertEqual(expired.lookup("GCA_1"), (True, "GCA_1_asm"))
+            self.assertEqual(expired.lookup("GCA_2"), (False, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
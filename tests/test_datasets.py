@@ -0,0 +1,132 @@
+"""Unit tests for the batched datasets lookups in providers/tools/datasets.py."""
+
+from __future__ import annotations
+
+import asyncio
+import subprocess
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, "providers")
+
+from tools import datasets  # noqa: E402
+
+
+PY = sys.executable
+
+
+def _script(body: str) -> list[str]:
+    return [PY, "-c", body]
+
+
+class FakeDatasets:
+    """Stands in for iter_json_lines; answers for accessions not ending in 9.1."""
+
+    def __init__(self):
+        self.calls: list[list[str]] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, cmd, **kwargs):
+        with open(cmd[cmd.index("--inputfile") + 1]) as f:
+            batch = f.read().split()
+        with self.lock:
+            self.calls.append(cmd)
+        return iter([{"accession": acc} for acc in batch if not acc.endswith("9.1")])
+
+
+class TestIterJsonLines(unittest.TestCase):
+    def test_streams_objects_and_skips_bad_lines(self):
+        cmd = _script(
+            "import json\n"
+            "for i in range(3): print(json.dumps({'n': i}), flush=True)\n"
+            "print('not json')\nprint()"
+        )
+        self.assertEqual(list(datasets.iter_json_lines(cmd)), [{"n": 0}, {"n": 1}, {"n": 2}])
+
+    def test_nonzero_exit_raises_with_stderr(self):
+        cmd = _script("import sys; print('{}'); sys.stderr.write('bad taxon'); sys.exit(3)")
+        with self.assertRaisesRegex(RuntimeError, "exited 3: bad taxon"):
+            list(datasets.iter_json_lines(cmd))
+
+    def test_timeout_kills_process(self):
+        cmd = _script("import time; print('{}', flush=True); time.sleep(30)")
+        with self.assertRaises(subprocess.TimeoutExpired):
+            list(datasets.iter_json_lines(cmd, timeout=0.5))
+
+
+def _summary(accessions, **kwargs) -> dict[str, dict]:
+    found: dict[str, dict] = {}
+    for batch in datasets.iter_summary_results(accessions, **kwargs):
+        found.update(batch)
+    return found
+
+
+class TestSummaryResults(unittest.TestCase):
+    def test_batches_cover_every_accession_once(self):
+        fake = FakeDatasets()
+        accessions = [f"GCA_{i:09d}.1" for i in range(25)] * 2
+        with patch("tools.datasets.iter_json_lines", fake):
+            found = _summary(accessions, report="ids_only", batch_size=10)
+        self.assertEqual(len(fake.calls), 3)
+        self.assertTrue(all(c[-2:] == ["--report", "ids_only"] for c in fake.calls))
+        self.assertEqual(sorted(found), sorted(a for a in set(accessions) if not a.endswith("9.1")))
+
+    def test_async_batches_yield_as_they_finish(self):
+        fake = FakeDatasets()
+
+        async def collect():
+            return [b async for b in datasets.iter_summary_batches(
+                [f"GCA_{i:09d}.1" for i in range(25)], batch_size=10
+            )]
+
+        with patch("tools.datasets.iter_json_lines", fake):
+            batches = asyncio.run(collect())
+        self.assertEqual(sorted(len(b) for b in batches), [5, 9, 9])
+
+    def test_bad_accession_is_isolated_by_splitting(self):
+        fake = FakeDatasets()
+
+        def picky(cmd, **kwargs):
+            with open(cmd[cmd.index("--inputfile") + 1]) as f:
+                if "GCA_000000013.1" in f.read().split():
+                    raise RuntimeError("datasets exited 1: bad accession")
+            return fake(cmd, **kwargs)
+
+        accessions = [f"GCA_{i:09d}.1" for i in range(20)]
+        with patch("tools.datasets.iter_json_lines", picky), patch("tools.datasets.time.sleep"):
+            found = _summary(accessions, batch_size=10)
+        expected = {a for a in accessions if not a.endswith("9.1")} - {"GCA_000000013.1"}
+        self.assertEqual(set(found), expected)
+
+    def test_bad_accession_raises_unless_skipped(self):
+        def picky(cmd, **kwargs):
+            with open(cmd[cmd.index("--inputfile") + 1]) as f:
+                if "GCA_000000013.1" in f.read().split():
+                    raise RuntimeError("datasets exited 1: bad accession")
+            return FakeDatasets()(cmd, **kwargs)
+
+        async def collect():
+            return [b async for b in datasets.iter_summary_batches(
+                [f"GCA_{i:09d}.1" for i in range(20)], batch_size=10, skip_failed=False
+            )]
+
+        with patch("tools.datasets.iter_json_lines", picky), patch("tools.datasets.time.sleep"):
+            with self.assertRaisesRegex(RuntimeError, "failed for GCA_000000013.1"):
+                asyncio.run(collect())
+
+    def test_failing_batch_raises_after_retries(self):
+        def fail(cmd, **kwargs):
+            raise RuntimeError("datasets exited 1: boom")
+
+        accessions = [f"GCA_{i:09d}.1" for i in range(8)]
+        with patch("tools.datasets.iter_json_lines", fail), patch("tools.datasets.time.sleep"):
+            with self.assertRaises(RuntimeError):
+                _summary(["GCA_000000001.1"])
+            with self.assertRaisesRegex(RuntimeError, "keeps failing"):
+                _summary(accessions)
+
+
+if __name__ == "__main__":
+    unittest.main()
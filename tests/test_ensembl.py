@@ -0,0 +1,84 @@
+"""Unit tests for incremental species.json parsing in providers/ensembl.py."""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "providers")
+
+import ensembl  # noqa: E402
+
+
+def _species(accession: str, release: str = "2024_05") -> dict:
+    return {
+        "taxid": "9606",
+        "scientific_name": f"Species {accession}",
+        "assemblies": {
+            accession: {
+                "name": "asm",
+                "genebuild_providers": {
+                    "ensembl": {
+                        "gb1": {
+                            "release": release,
+                            "paths": {
+                                "genebuild": {
+                                    "files": {"annotations": {"genes.gff3.gz": f"{accession}/genes.gff3.gz"}}
+                                }
+                            },
+                        }
+                    },
+                    "refseq": {"gb2": {"release": release}},
+                },
+            }
+        },
+    }
+
+
+class TestSpeciesParsing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "species.json")
+
+    def _write(self, doc: dict, indent: int | None = None) -> None:
+        with open(self.path, "w") as f:
+            json.dump(doc, f, indent=indent)
+
+    def test_iter_species_matches_full_parse(self):
+        doc = {"version": 3, "species": {"a": _species("GCA_1"), "b": _species("GCA_2")}, "x": []}
+        self._write(doc, indent=2)
+        self.assertEqual(dict(ensembl.iter_species(self.path)), doc["species"])
+
+    def test_parse_species_file_builds_rows_per_accession(self):
+        self._write({"species": {"a": _species("GCA_1"), "b": _species("GCA_2", "2025_01")}})
+        by_accession = ensembl.parse_species_file(self.path)
+        self.assertEqual(
+            list(by_accession["GCA_1"]), [f"{ensembl.ENSEMBL_FTP_DIR}/GCA_1/genes.gff3.gz"]
+        )
+        row = next(iter(by_accession["GCA_2"].values()))
+        self.assertEqual(row["release_date"], "2025-01-01")
+
+    def test_empty_species_object_raises(self):
+        self._write({"species": {}})
+        with self.assertRaises(RuntimeError):
+            ensembl.parse_species_file(self.path)
+
+    def test_malformed_document_raises_value_error(self):
+        with open(self.path, "w") as f:
+            f.write('{"species": {"a": {"taxid": 1}, "b": ')
+        with self.assertRaises(ValueError):
+            ensembl.parse_species_file(self.path)
+
+    def test_parse_annotations_filters_by_accession(self):
+        self._write({"species": {"a": _species("GCA_1"), "b": _species("GCA_2")}})
+        by_accession = ensembl.parse_species_file(self.path)
+        parsed = ensembl.parse_annotations(by_accession, ["GCA_2", "GCA_9"])
+        self.assertEqual([r["assembly_accession"] for r in parsed.values()], ["GCA_2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
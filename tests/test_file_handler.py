@@ -0,0 +1,115 @@
+"""Unit tests for the lazy TSV reader and writer in providers/tools/file_handler.py."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "providers")
+
+from tools import file_handler, helper  # noqa: E402
+from tools.record import AnnotationRecord  # noqa: E402
+
+DATA_FILES = {
+    "data/genbank_annotations.tsv": "assembly_accession",
+    "data/ensembl_annotations.tsv": "access_url",
+}
+
+
+class TestLazyTable(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def _copy(self, path: str) -> str:
+        dest = os.path.join(self.dir, os.path.basename(path))
+        shutil.copy(path, dest)
+        return dest
+
+    def test_matches_eager_load(self):
+        for path, key in DATA_FILES.items():
+            eager, eager_order = file_handler.load_annotations_ordered(path, key)
+            lazy, lazy_order = file_handler.load_annotations_lazy(path, key)
+            self.assertIsInstance(lazy, file_handler.LazyTable)
+            self.assertEqual(lazy_order, eager_order)
+            self.assertEqual({k: dict(row) for k, row in lazy.items()}, eager)
+            lazy.close()
+
+    def test_unchanged_rows_are_written_back_verbatim_in_place(self):
+        path = self._copy("data/genbank_annotations.tsv")
+        with open(path, "rb") as f:
+            before = f.read()
+        rows, order = file_handler.load_annotations_lazy(path, "assembly_accession")
+        merged = [rows[k] for k in order]
+        file_handler.write_annotations(merged, path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), before)
+        # Rows stay readable after their file was rewritten.
+        self.assertEqual(merged[0]["assembly_accession"], order[0])
+        rows.close()
+
+    def test_changed_rows_are_rendered_by_csv(self):
+        path = self._copy("data/genbank_annotations.tsv")
+        with open(path, "rb") as f:
+            before = f.read().split(b"\r\n")
+        rows, order = file_handler.load_annotations_lazy(path, "assembly_accession")
+        changed = dict(rows[order[5]], retrieval_date="2030-01-01")
+        merged = [rows[k] for k in order]
+        merged[5] = changed
+        file_handler.write_annotations(merged, path)
+        rows.close()
+        with open(path, "rb") as f:
+            after = f.read().split(b"\r\n")
+        self.assertEqual(after[:6] + after[7:], before[:6] + before[7:])
+        again, _ = file_handler.load_annotations_ordered(path, "assembly_accession")
+        self.assertEqual(again[order[5]]["retrieval_date"], "2030-01-01")
+
+    def test_refreshed_first_row_keeps_genbank_column_order(self):
+        path = self._copy("data/genbank_annotations.tsv")
+        with open(path, "rb") as f:
+            before = f.read().split(b"\r\n")
+        rows, order = file_handler.load_annotations_lazy(path, "assembly_accession")
+        first, _ = helper.merged_row(
+            order[0], "emit_existing", rows, {}, run_date="2030-01-01", refresh=True
+        )
+        # A record (schema order) leading the rows must not reorder the file either.
+        for lead in (first, AnnotationRecord(**first)):
+            file_handler.write_annotations([lead] + [rows[k] for k in order[1:]], path)
+            with open(path, "rb") as f:
+                after = f.read().split(b"\r\n")
+            self.assertEqual(after[0], before[0])
+            self.assertEqual(after[2:], before[2:])
+            self.assertIn(b"2030-01-01", after[1])
+        rows.close()
+
+    def test_failed_write_leaves_previous_file(self):
+        path = self._copy("data/genbank_annotations.tsv")
+        with open(path, "rb") as f:
+            before = f.read()
+
+        class Broken(dict):
+            def keys(self):
+                raise RuntimeError("boom")
+
+        rows, order = file_handler.load_annotations_lazy(path, "assembly_accession")
+        with self.assertRaises(RuntimeError):
+            file_handler.write_annotations([rows[order[0]], Broken()], path)
+        rows.close()
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual(os.listdir(self.dir), [os.path.basename(path)])
+
+    def test_multiline_quoted_field_falls_back_to_eager(self):
+        path = os.path.join(self.dir, "odd.tsv")
+        file_handler.write_annotations([{"k": "a", "note": "two\nlines"}, {"k": "b", "note": ""}], path)
+        rows, order = file_handler.load_annotations_lazy(path, "k")
+        self.assertIsInstance(rows, dict)
+        self.assertEqual((order, rows["a"]["note"]), (["a", "b"], "two\nlines"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import copy
+import random
 import sys
 import unittest
 from datetime import datetime, timedelta
@@ -134,5 +136,118 @@ class TestRecentRetrievalConstant(unittest.TestCase):
         self.assertEqual(kept, ["edge"])
 
 
+def _scenario(seed: int) -> dict:
+    """Random existing/parsed rows and probe results covering every outcome branch."""
+    rng = random.Random(seed)
+    keys = [f"GCA_{i:09d}.1" for i in range(40)]
+    dates = [None, "", "2024-01-01", "2025-02-02"]
+
+    def row(key: str) -> dict:
+        return {
+            "assembly_accession": key,
+            "release_date": rng.choice(dates),
+            "last_modified_date": rng.choice(dates),
+            "md5_checksum": rng.choice(["a", "b"]),
+            "retrieval_date": rng.choice(["2024-01-01", "2024-02-02"]),
+        }
+
+    existing = {k: row(k) for k in rng.sample(keys, 25)}
+    parsed = {}
+    for k in rng.sample(keys, 25):
+        parsed[k] = {"assembly_accession": k, "release_date": rng.choice(dates)}
+    lm_results = [
+        ProbeResult(
+            key=k,
+            status=rng.choice(["ok", "ok", "not_modified", "not_found", "transient_error"]),
+            value=rng.choice(dates),
+            md5=rng.choice([None, None, "a", "c"]),
+        )
+        for k in rng.sample(sorted(parsed), 18)
+    ]
+    md5_results = [
+        ProbeResult(
+            key=k,
+            status=rng.choice(["ok", "ok", "not_found", "transient_error"]),
+            value=rng.choice(["a", "c", ""]),
+        )
+        for k in rng.sample(sorted(parsed), 15)
+    ]
+    both = sorted(existing.keys() & parsed.keys())
+    skip_keys = set(rng.sample(both, len(both) // 4))
+    inferred = {
+        k: rng.choice(["reuse_existing", "refresh_md5"])
+        for k in rng.sample(sorted(parsed.keys() - skip_keys), 5)
+    }
+    order = list(existing)
+    if seed % 3 == 0:
+        rng.shuffle(order)
+    return {
+        "existing": existing,
+        "existing_key_order": order,
+        "parsed": parsed,
+        "lm_results": lm_results,
+        "md5_results": md5_results,
+        "skip_keys": skip_keys,
+        "inferred": inferred,
+        "lm_probed_keys": {r.key for r in lm_results},
+        "md5_probed_keys": {r.key for r in md5_results},
+    }
+
+
+class TestMergeMirrorEquivalence(unittest.TestCase):
+    RUN_DATE = "2026-05-17"
+
+    def _multi_pass(self, sc: dict):
+        existing, parsed = sc["existing"], sc["parsed"]
+        lm = helper.decide_last_modified_outcomes(
+            existing, parsed, sc["lm_results"], sc["skip_keys"], sc["inferred"]
+        )
+        final = helper.decide_md5_outcomes(existing, parsed, sc["md5_results"], lm, set(parsed))
+        rows, log = helper.build_merged_rows(
+            existing,
+            parsed,
+            final,
+            run_date=self.RUN_DATE,
+            lm_probed_keys=sc["lm_probed_keys"],
+            md5_probed_keys=sc["md5_probed_keys"],
+        )
+        ordered = helper.order_merged_annotations_for_git(
+            rows, sc["existing_key_order"], "assembly_accession"
+        )
+        stats = helper.count_annotation_diffs(existing, ordered, "assembly_accession")
+        return [dict(r) for r in ordered], log, stats, lm, final, parsed
+
+    def _fused(self, sc: dict):
+        merged = helper.merge_mirror(
+            sc["existing"],
+            sc["existing_key_order"],
+            sc["parsed"],
+            sc["lm_results"],
+            sc["md5_results"],
+            key_column="assembly_accession",
+            run_date=self.RUN_DATE,
+            skip_keys=sc["skip_keys"],
+            lm_probed_keys=sc["lm_probed_keys"],
+            md5_probed_keys=sc["md5_probed_keys"],
+            inferred=sc["inferred"],
+        )
+        return (
+            [dict(r) for r in merged.rows],
+            merged.outcome_log,
+            merged.stats,
+            merged.lm_outcomes,
+            merged.final_outcomes,
+            sc["parsed"],
+        )
+
+    def test_matches_multi_pass_helpers(self):
+        for seed in range(300):
+            sc = _scenario(seed)
+            with self.subTest(seed=seed):
+                expected = self._multi_pass(copy.deepcopy(sc))
+                self.assertEqual(self._fused(copy.deepcopy(sc)), expected)
+                self.assertGreater(len(expected[0]), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
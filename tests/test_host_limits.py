@@ -0,0 +1,80 @@
+"""Unit tests for the adaptive per-host limiter in providers/tools/host_limits.py."""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import unittest
+
+sys.path.insert(0, "providers")
+
+from tools import host_limits  # noqa: E402
+from tools.host_limits import HostLimiter, HostLimits, parse_retry_after  # noqa: E402
+
+
+class TestParseRetryAfter(unittest.TestCase):
+    def test_seconds_and_dates(self):
+        self.assertEqual(parse_retry_after("5"), 5.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertEqual(parse_retry_after("100000"), host_limits.MAX_RETRY_AFTER)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class TestHostLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_additive_increase_while_latency_is_healthy(self):
+        limiter = HostLimiter(initial=2, maximum=4)
+        for _ in range(20):
+            await limiter.acquire()
+            limiter.release(latency=0.05)
+        self.assertEqual(limiter.limit, 4.0)
+
+    async def test_no_increase_when_latency_degrades(self):
+        limiter = HostLimiter(initial=2, maximum=10)
+        await limiter.acquire()
+        limiter.release(latency=0.01)
+        start = limiter.limit
+        for _ in range(10):
+            await limiter.acquire()
+            limiter.release(latency=1.0)
+        self.assertLess(limiter.limit, start + 1.0)
+
+    async def test_throttle_halves_limit_and_honors_retry_after(self):
+        limiter = HostLimiter(initial=8, maximum=8)
+        await limiter.acquire()
+        limiter.release(throttled=True, retry_after=0.05)
+        self.assertEqual(limiter.limit, 4.0)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await limiter.acquire()
+        self.assertGreaterEqual(loop.time() - started, 0.04)
+        limiter.release(throttled=True)
+        for _ in range(5):
+            await limiter.acquire()
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 1.0)
+
+    async def test_in_flight_never_exceeds_limit(self):
+        limiter = HostLimiter(initial=3, maximum=3)
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            await limiter.acquire()
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.001)
+            limiter.release()
+
+        await asyncio.gather(*(job() for _ in range(30)))
+        self.assertEqual(peak, 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_limiters_are_per_host(self):
+        limits = HostLimits(initial=4, maximum=8)
+        a = limits.for_url("https://ftp.ncbi.nlm.nih.gov/genomes/x")
+        self.assertIs(a, limits.for_url("https://ftp.ncbi.nlm.nih.gov/other"))
+        self.assertIsNot(a, limits.for_url("https://ftp.ebi.ac.uk/pub/x"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Unit tests for in-process gzip/BGZF hashing in providers/tools/inflate.py."""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import struct
+import sys
+import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, "providers")
+
+from tools.inflate import InflateError, InflatingMd5, bgzf_block_size  # noqa: E402
+
+PAYLOAD = b"".join(
+    f"chr{i % 7}\tsrc\tgene\t{i}\t{i + 100}\t.\t+\t.\tID=gene{i}\n".encode()
+    for i in range(20000)
+)
+
+
+def _bgzf(data: bytes, block_size: int = 4096) -> bytes:
+    """Minimal BGZF writer (same block layout as bgzip), ending with the EOF block."""
+    out = bytearray()
+    for i in range(0, len(data), block_size):
+        block = data[i : i + block_size]
+        comp = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = comp.compress(block) + comp.flush()
+        out += b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff\x06\x00BC\x02\x00"
+        out += struct.pack("<H", 18 + len(cdata) + 8 - 1) + cdata
+        out += struct.pack("<II", zlib.crc32(block), len(block))
+    out += bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+    return bytes(out)
+
+
+def _md5_of_chunks(data: bytes, chunk_size: int, executor=None) -> str:
+    hasher = InflatingMd5(executor, window=3)
+    for i in range(0, len(data), chunk_size):
+        hasher.update(data[i : i + chunk_size])
+    return hasher.hexdigest()
+
+
+class TestInflatingMd5(unittest.TestCase):
+    expected = hashlib.md5(PAYLOAD).hexdigest()
+
+    def test_single_member_gzip(self):
+        data = gzip.compress(PAYLOAD)
+        for chunk_size in (1, 7, 4096, len(data)):
+            self.assertEqual(_md5_of_chunks(data, chunk_size), self.expected)
+
+    def test_multi_member_gzip(self):
+        half = len(PAYLOAD) // 2
+        data = gzip.compress(PAYLOAD[:half]) + gzip.compress(PAYLOAD[half:]) + gzip.compress(b"")
+        self.assertEqual(_md5_of_chunks(data, 1000), self.expected)
+
+    def test_plain_input_is_hashed_as_is(self):
+        self.assertEqual(_md5_of_chunks(PAYLOAD, 333), self.expected)
+        self.assertEqual(_md5_of_chunks(b"x", 1), hashlib.md5(b"x").hexdigest())
+
+    def test_truncated_stream_raises(self):
+        data = gzip.compress(PAYLOAD)
+        with self.assertRaises(InflateError):
+            _md5_of_chunks(data[: len(data) // 2], 4096)
+
+
+class TestParallelBgzf(unittest.TestCase):
+    expected = hashlib.md5(PAYLOAD).hexdigest()
+
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_block_size_from_header(self):
+        data = _bgzf(PAYLOAD)
+        size = bgzf_block_size(data)
+        self.assertIsNotNone(size)
+        self.assertEqual(bgzf_block_size(data[:10]), None)
+        with self.assertRaises(InflateError):
+            bgzf_block_size(gzip.compress(PAYLOAD))
+
+    def test_parallel_matches_serial(self):
+        data = _bgzf(PAYLOAD)
+        for chunk_size in (5, 1000, 65536, len(data)):
+            self.assertEqual(_md5_of_chunks(data, chunk_size, self.pool), self.expected)
+        self.assertEqual(_md5_of_chunks(data, 1000), self.expected)
+
+    def test_plain_gzip_member_after_bgzf_blocks(self):
+        half = len(PAYLOAD) // 2
+        data = _bgzf(PAYLOAD[:half])[:-28] + gzip.compress(PAYLOAD[half:])
+        self.assertEqual(_md5_of_chunks(data, 777, self.pool), self.expected)
+
+    def test_subfield_overrunning_xlen_raises_inflate_error(self):
+        eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+        # XLEN=4 but the BC subfield declares 2 more payload bytes.
+        bad = b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff\x04\x00BC\x02\x00" + b"\x00" * 40
+        with self.assertRaises(InflateError):
+            bgzf_block_size(bad)
+        with self.assertRaises(InflateError):
+            _md5_of_chunks(_bgzf(PAYLOAD)[:-28] + eof + bad, 4096, self.pool)
+
+    def test_truncated_bgzf_raises(self):
+        data = _bgzf(PAYLOAD)
+        with self.assertRaises(InflateError):
+            _md5_of_chunks(data[:-100], 4096, self.pool)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Unit tests for the SQLite assembly-metadata store."""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, "providers")
+
+import registry  # noqa: E402
+from tools.metadata_store import AssemblyMetadataStore  # noqa: E402
+
+
+def _meta(i: int) -> dict:
+    return {"assembly_name": f"asm{i}", "taxon_id": 9600 + i, "organism_name": f"Org {i}"}
+
+
+class TestAssemblyMetadataStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "meta.sqlite")
+
+    def test_bulk_upsert_and_lookup_persist(self):
+        accessions = [f"GCA_{i:09d}.1" for i in range(1200)]
+        with AssemblyMetadataStore(self.path) as store:
+            store.upsert_many({acc: _meta(i) for i, acc in enumerate(accessions)})
+            store.upsert_many({accessions[0]: {**_meta(0), "assembly_name": "renamed"}})
+        with AssemblyMetadataStore(self.path) as store:
+            found = store.get_many(accessions + ["GCA_999999999.1"])
+        self.assertEqual(len(found), 1200)
+        self.assertEqual(found[accessions[0]]["assembly_name"], "renamed")
+        self.assertEqual(found[accessions[5]], _meta(5))
+
+    def test_registry_only_fetches_misses(self):
+        requested: list[list[str]] = []
+
+        def fake_results(accessions, **kwargs):
+            requested.append(sorted(accessions))
+            yield {
+                acc: {
+                    "assembly_info": {"assembly_name": "fresh"},
+                    "organism": {"tax_id": 1, "organism_name": "New"},
+                }
+                for acc in accessions
+            }
+
+        with AssemblyMetadataStore(self.path) as store:
+            store.upsert_many({"GCA_1.1": _meta(1)})
+            with patch("tools.datasets.iter_summary_results", fake_results):
+                got = registry.fetch_assembly_metadata(["GCA_1.1", "GCA_2.1", "GCA_2.1"], store)
+            self.assertEqual(requested, [["GCA_2.1"]])
+            self.assertEqual(got["GCA_1.1"], _meta(1))
+            self.assertEqual(got["GCA_2.1"]["assembly_name"], "fresh")
+            self.assertIn("GCA_2.1", store.get_many(["GCA_2.1"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
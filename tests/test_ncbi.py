@@ -0,0 +1,145 @@
+"""Unit tests for the NCBI universe snapshot and FTP path resolver in providers/ncbi.py."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, "providers")
+
+import ncbi  # noqa: E402
+from tools.async_ops import ProbeResult  # noqa: E402
+from tools.cache import ExpiringCache  # noqa: E402
+
+MINIMAL = "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/001/405/"
+PREDICTED = f"{MINIMAL}GCA_000001405.1_old/GCA_000001405.1_old_genomic.gff.gz"
+LISTING = '<a href="GCA_000001405.1_new/">x</a> <a href="../">up</a>'
+CHECKSUMS = "./GCA_000001405.1_new_genomic.gff.gz\tabc123\n"
+
+
+class FakeFetch:
+    """Stands in for async_ops.fetch_url_text, recording requested URLs."""
+
+    def __init__(self, pages: dict[str, str]):
+        self.pages = pages
+        self.urls: list[str] = []
+
+    async def __call__(self, session, url, key, **kwargs):
+        self.urls.append(url)
+        await asyncio.sleep(0)
+        if url in self.pages:
+            return ProbeResult(key=key, status="ok", value=self.pages[url])
+        return ProbeResult(key=key, status="not_found", detail="status_404")
+
+
+class TestFtpPathResolver(unittest.IsolatedAsyncioTestCase):
+    def _resolver(self) -> ncbi.FtpPathResolver:
+        paths = ExpiringCache(None, ttl_days=30, negative_ttl_days=3, today=date(2024, 1, 1))
+        return ncbi.FtpPathResolver(paths)
+
+    async def test_resolved_directory_is_reused_without_listing(self):
+        fetch = FakeFetch(
+            {MINIMAL: LISTING, f"{MINIMAL}GCA_000001405.1_new/uncompressed_checksums.txt": CHECKSUMS}
+        )
+        resolver = self._resolver()
+        with patch("tools.async_ops.fetch_url_text", fetch):
+            first = await resolver.resolve_and_fetch_md5(None, PREDICTED, "GCA_000001405.1")
+            fetch.urls.clear()
+            second = await ncbi.FtpPathResolver(resolver.resolved).resolve_and_fetch_md5(
+                None, PREDICTED, "GCA_000001405.1"
+            )
+        expected = ("abc123", f"{MINIMAL}GCA_000001405.1_new/GCA_000001405.1_new_genomic.gff.gz")
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected)
+        self.assertEqual(fetch.urls, [f"{MINIMAL}GCA_000001405.1_new/uncompressed_checksums.txt"])
+
+    async def test_missing_assembly_is_negatively_cached(self):
+        fetch = FakeFetch({MINIMAL: LISTING})
+        resolver = self._resolver()
+        with patch("tools.async_ops.fetch_url_text", fetch):
+            self.assertEqual(
+                await resolver.resolve_and_fetch_md5(None, PREDICTED, "GCA_000001405.1"),
+                (None, None),
+            )
+            fetch.urls.clear()
+            await resolver.resolve_and_fetch_md5(None, PREDICTED, "GCA_000001405.1")
+        self.assertEqual(fetch.urls, [])
+
+    async def test_concurrent_lookups_share_one_listing_fetch(self):
+        fetch = FakeFetch({MINIMAL: LISTING})
+        resolver = ncbi.FtpPathResolver()
+        with patch("tools.async_ops.fetch_url_text", fetch):
+            results = await asyncio.gather(*(resolver.listing(None, MINIMAL) for _ in range(5)))
+        self.assertEqual(results, [["GCA_000001405.1_new"]] * 5)
+        self.assertEqual(fetch.urls, [MINIMAL])
+
+
+def _record(accession: str) -> dict:
+    return {
+        "accession": accession,
+        "organism": {"tax_id": 9606, "organism_name": "Homo sapiens"},
+        "assembly_info": {"assembly_name": "GRCh38"},
+        "annotation_info": {"provider": "NCBI", "release_date": "2024-01-01"},
+    }
+
+
+class TestAnnotatedSnapshot(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "snapshot.json")
+        self.cmds: list[list[str]] = []
+        self.records = [_record("GCA_000001405.29"), _record("GCF_000001405.40"), {"accession": "X"}]
+
+    def _listing(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+        self.assertNotIn("--assembly-source", cmd)
+        return iter(self.records)
+
+    def _load(self, **kwargs):
+        with patch("tools.datasets.iter_json_lines", self._listing):
+            return ncbi.load_annotated_snapshot("2759", path=self.path, **kwargs)
+
+    def test_one_listing_feeds_both_sources_within_window(self):
+        first, listed = self._load()
+        again = self._load()
+        self.assertEqual(len(self.cmds), 1)
+        self.assertEqual(list(first["GenBank"]), ["GCA_000001405.29"])
+        self.assertEqual(first["RefSeq"]["GCF_000001405.40"]["source_database"], "RefSeq")
+        self.assertEqual(listed, {"GenBank": {"GCA_000001405.29"}, "RefSeq": {"GCF_000001405.40"}})
+        self.assertEqual(again, (first, listed))
+
+    def test_stale_snapshot_merges_delta_since_watermark(self):
+        self._load()
+        self.records = [_record("GCA_000002035.4")]
+        merged, listed = self._load(max_age_hours=0)
+        self.assertIn("--released-after", self.cmds[1])
+        self.assertEqual(sorted(merged["GenBank"]), ["GCA_000001405.29", "GCA_000002035.4"])
+        self.assertIn("GCF_000001405.40", merged["RefSeq"])
+        # Only the delta's rows carry current metadata.
+        self.assertEqual(listed, {"GenBank": {"GCA_000002035.4"}})
+        self.assertEqual(self._load()[1], listed)
+
+    def test_empty_delta_keeps_snapshot(self):
+        self._load()
+        self.records = []
+        merged, listed = self._load(max_age_hours=0)
+        self.assertEqual(list(merged["GenBank"]), ["GCA_000001405.29"])
+        self.assertEqual(listed, {})
+
+    def test_reconcile_replaces_snapshot_and_drops_removed(self):
+        self._load()
+        self.records = [_record("GCF_000001405.40")]
+        reconciled, listed = self._load(max_age_hours=0, reconcile_days=0)
+        self.assertNotIn("--released-after", self.cmds[1])
+        self.assertEqual(reconciled, {"RefSeq": reconciled["RefSeq"]})
+        self.assertEqual(listed, {"RefSeq": {"GCF_000001405.40"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,321 @@
+"""Unit tests for the pipelined last-modified → MD5 probe flow."""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import unittest
+from datetime import date, timedelta
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+sys.path.insert(0, "providers")
+
+from tools import helper, pipeline  # noqa: E402
+from tools.async_ops import ProbeResult  # noqa: E402
+from tools.cache import ValidatorCache  # noqa: E402
+
+LM_RESULTS = {
+    "same": ProbeResult(key="same", status="ok", value="2024-01-01"),
+    "changed": ProbeResult(key="changed", status="ok", value="2025-02-02"),
+    "new": ProbeResult(key="new", status="ok", value="2025-03-03"),
+    "gone": ProbeResult(key="gone", status="not_found"),
+    "flaky": ProbeResult(key="flaky", status="transient_error"),
+}
+
+
+def _existing() -> dict[str, dict]:
+    return {
+        k: {"assembly_accession": k, "last_modified_date": "2024-01-01", "md5_checksum": "old"}
+        for k in ("same", "changed", "gone", "flaky")
+    }
+
+
+def _parsed() -> dict[str, dict]:
+    return {k: {"assembly_accession": k, "access_url": f"https://x/{k}"} for k in LM_RESULTS}
+
+
+@asynccontextmanager
+async def _fake_session(concurrency):
+    yield object()
+
+
+async def _fake_lm(session, url, key, *, validators=None):
+    return LM_RESULTS[key]
+
+
+class TestClassifyLastModified(unittest.TestCase):
+    def test_outcomes_per_status(self):
+        existing = _existing()
+        parsed = _parsed()
+        got = {
+            k: helper.classify_last_modified(k, existing, parsed[k], r)
+            for k, r in LM_RESULTS.items()
+        }
+        self.assertEqual(
+            got,
+            {
+                "same": "reuse_existing",
+                "changed": "refresh_md5",
+                "new": "refresh_md5",
+                "gone": "gone",
+                "flaky": "transient",
+            },
+        )
+        self.assertEqual(parsed["changed"]["last_modified_date"], "2025-02-02")
+        self.assertNotIn("last_modified_date", parsed["same"])
+
+    def test_not_modified_reuses_existing_row(self):
+        result = ProbeResult(key="same", status="not_modified", detail="head_304")
+        parsed = _parsed()
+        self.assertEqual(
+            helper.classify_last_modified("same", _existing(), parsed["same"], result),
+            "reuse_existing",
+        )
+        self.assertEqual(
+            helper.classify_last_modified("new", _existing(), parsed["new"], result),
+            "refresh_md5",
+        )
+
+    def test_md5_from_probe_decides_over_date(self):
+        existing = _existing()
+        parsed = _parsed()
+        same = ProbeResult(key="same", status="ok", value="2025-05-05", md5="old")
+        changed = ProbeResult(key="changed", status="ok", value="2024-01-01", md5="new")
+        self.assertEqual(
+            helper.classify_last_modified("same", existing, parsed["same"], same), "reuse_existing"
+        )
+        self.assertEqual(
+            helper.classify_last_modified("changed", existing, parsed["changed"], changed),
+            "refresh_md5",
+        )
+
+    def test_missing_result(self):
+        self.assertEqual(helper.classify_last_modified("k", {"k": {}}, {}, None), "transient")
+        self.assertEqual(helper.classify_last_modified("k", {}, {}, None), "refresh_md5")
+
+
+@patch("tools.async_ops.make_session", _fake_session)
+@patch("tools.async_ops.probe_last_modified", _fake_lm)
+class TestProbeChanges(unittest.IsolatedAsyncioTestCase):
+    async def test_only_refresh_keys_get_md5_probe(self):
+        probed: list[str] = []
+
+        async def probe_md5(session, url, key, parsed):
+            probed.append(key)
+            return ProbeResult(key=key, status="ok", value=f"md5-{key}")
+
+        tuples = ((f"https://x/{k}", k) for k in LM_RESULTS)
+        lm_results, md5_results = await pipeline.probe_changes(
+            tuples, _existing(), _parsed(), probe_md5, concurrency=3
+        )
+        self.assertEqual(sorted(probed), ["changed", "new"])
+        self.assertEqual(sorted(r.key for r in lm_results), sorted(LM_RESULTS))
+        self.assertEqual(sorted(r.key for r in md5_results), ["changed", "new"])
+
+    async def test_md5_carried_by_last_modified_probe_skips_md5_stage(self):
+        async def probe_lm(session, url, key, *, validators=None):
+            return ProbeResult(key=key, status="ok", value="2025-01-01", md5=f"md5-{key}")
+
+        async def probe_md5(session, url, key, parsed):
+            raise AssertionError("MD5 stage should not run")
+
+        existing = _existing()
+        del existing["changed"]
+        existing["same"]["md5_checksum"] = "md5-same"
+        lm_results, md5_results = await pipeline.probe_changes(
+            [("https://x/same", "same"), ("https://x/changed", "changed")],
+            existing,
+            _parsed(),
+            probe_md5,
+            probe_last_modified=probe_lm,
+        )
+        self.assertEqual(len(lm_results), 2)
+        self.assertEqual([(r.key, r.value) for r in md5_results], [("changed", "md5-changed")])
+
+    async def test_streamed_universe_is_probed_before_it_finishes_loading(self):
+        events: list[str] = []
+
+        async def universe():
+            parsed = _parsed()
+            for key in ("same", "new"):
+                events.append(f"chunk:{key}")
+                yield {key: parsed[key]}
+                await asyncio.sleep(0.01)
+            events.append("loaded")
+
+        async def probe_md5(session, url, key, parsed):
+            events.append(f"md5:{key}")
+            return ProbeResult(key=key, status="ok", value=f"md5-{key}")
+
+        existing = _existing()
+        existing["same"]["retrieval_date"] = date.today().isoformat()
+        parsed, probed_urls, lm_results, md5_results, _ = await pipeline.load_and_probe(
+            universe(), existing, probe_md5
+        )
+        self.assertEqual(sorted(parsed), ["new", "same"])
+        self.assertEqual(probed_urls, {"new": "https://x/new"})
+        self.assertEqual([r.key for r in lm_results], ["new"])
+        self.assertLess(events.index("md5:new"), events.index("loaded"))
+
+    async def test_final_outcomes_match_two_phase_flow(self):
+        async def probe_md5(session, url, key, parsed):
+            return ProbeResult(key=key, status="ok", value=f"md5-{key}")
+
+        # Pipelined flow.
+        existing, parsed = _existing(), _parsed()
+        lm_results, md5_results = await pipeline.probe_changes(
+            ((parsed[k]["access_url"], k) for k in parsed), existing, parsed, probe_md5
+        )
+        lm = helper.decide_last_modified_outcomes(existing, parsed, lm_results, set())
+        pipelined = helper.decide_md5_outcomes(existing, parsed, md5_results, lm, set(parsed))
+
+        # Two-phase flow: all last-modified results, then MD5 for refresh keys.
+        existing2, parsed2 = _existing(), _parsed()
+        lm2 = helper.decide_last_modified_outcomes(
+            existing2, parsed2, list(LM_RESULTS.values()), set()
+        )
+        md5_2 = [
+            ProbeResult(key=k, status="ok", value=f"md5-{k}")
+            for k, o in lm2.items()
+            if o == "refresh_md5"
+        ]
+        two_phase = helper.decide_md5_outcomes(existing2, parsed2, md5_2, lm2, set(parsed2))
+
+        self.assertEqual(pipelined, two_phase)
+        self.assertEqual(parsed, parsed2)
+
+
+class TestMetadataInference(unittest.TestCase):
+    FIELDS = ("assembly_name", "release_date", "pipeline_version")
+
+    def _stored(self, retrieved: str) -> dict:
+        return {"assembly_name": "A1", "release_date": "2024-01-01", "pipeline_version": "10.2",
+                "last_modified_date": "2024-01-05", "retrieval_date": retrieved}
+
+    def test_rules(self):
+        cutoff = date(2024, 6, 1)
+        row = {"assembly_name": "A1", "release_date": "2024-01-01", "pipeline_version": 10.2}
+        self.assertEqual(
+            helper.infer_from_metadata(self._stored("2024-07-01"), row, self.FIELDS, cutoff),
+            "reuse_existing",
+        )
+        self.assertIsNone(
+            helper.infer_from_metadata(self._stored("2024-05-01"), row, self.FIELDS, cutoff)
+        )
+        self.assertIsNone(helper.infer_from_metadata(None, row, self.FIELDS, cutoff))
+        self.assertIsNone(helper.infer_from_metadata(self._stored("2024-07-01"), row, (), cutoff))
+
+        released = dict(row, release_date="2025-02-01", pipeline_version="10.3")
+        self.assertEqual(
+            helper.infer_from_metadata(self._stored("2024-07-01"), released, self.FIELDS, cutoff),
+            "refresh_md5",
+        )
+        # The release date is not a file date; the MD5 response supplies that.
+        self.assertNotIn("last_modified_date", released)
+
+        # Possibly stale metadata: trusted only when it changed.
+        self.assertIsNone(helper.infer_from_metadata(self._stored("2024-07-01"), row, self.FIELDS, None))
+        self.assertEqual(
+            helper.infer_from_metadata(self._stored("2024-07-01"), released, self.FIELDS, None),
+            "refresh_md5",
+        )
+
+
+@patch("tools.async_ops.make_session", _fake_session)
+class TestLoadAndProbeWithMetadata(unittest.IsolatedAsyncioTestCase):
+    async def test_metadata_skips_last_modified_probe(self):
+        lm_probed: list[str] = []
+        md5_probed: list[str] = []
+
+        async def probe_lm(session, url, key, *, validators=None):
+            lm_probed.append(key)
+            return LM_RESULTS[key]
+
+        async def probe_md5(session, url, key, parsed):
+            md5_probed.append(key)
+            return ProbeResult(key=key, status="ok", value=f"md5-{key}", last_modified="2025-02-03")
+
+        verified = (date.today() - timedelta(days=30)).isoformat()
+        existing = _existing()
+        for key in ("same", "changed"):
+            existing[key].update(release_date="2024-01-01", retrieval_date=verified)
+        parsed = _parsed()
+        for key in parsed:
+            parsed[key]["release_date"] = "2024-01-01"
+        parsed["changed"]["release_date"] = "2025-02-02"
+
+        got_parsed, probed_urls, lm_results, md5_results, inferred = await pipeline.load_and_probe(
+            pipeline._single_chunk(parsed),
+            existing,
+            probe_md5,
+            probe_last_modified=probe_lm,
+            metadata_fields=("release_date",),
+        )
+        self.assertEqual(inferred, {"same": "reuse_existing", "changed": "refresh_md5"})
+        self.assertEqual(sorted(lm_probed), ["flaky", "gone", "new"])
+        self.assertEqual(sorted(md5_probed), ["changed", "new"])
+        self.assertNotIn("changed", probed_urls)
+
+        lm = helper.decide_last_modified_outcomes(existing, got_parsed, lm_results, set(), inferred)
+        final = helper.decide_md5_outcomes(existing, got_parsed, md5_results, lm, set(got_parsed))
+        self.assertEqual(final["same"], "emit_existing")
+        self.assertEqual(final["changed"], "emit_new")
+        self.assertEqual(got_parsed["changed"]["last_modified_date"], "2025-02-03")
+        # A probed new key keeps the date from its last-modified probe.
+        self.assertEqual(got_parsed["new"]["last_modified_date"], "2025-03-03")
+
+    async def test_stale_metadata_is_probed_when_unchanged(self):
+        lm_probed: list[str] = []
+
+        async def probe_lm(session, url, key, *, validators=None):
+            lm_probed.append(key)
+            return LM_RESULTS[key]
+
+        async def probe_md5(session, url, key, parsed):
+            return ProbeResult(key=key, status="ok", value=f"md5-{key}")
+
+        verified = (date.today() - timedelta(days=30)).isoformat()
+        existing = _existing()
+        existing["same"].update(release_date="2024-01-01", retrieval_date=verified)
+        parsed = _parsed()
+        parsed["same"]["release_date"] = "2024-01-01"
+
+        *_, inferred = await pipeline.load_and_probe(
+            pipeline._single_chunk(parsed),
+            existing,
+            probe_md5,
+            probe_last_modified=probe_lm,
+            metadata_fields=("release_date",),
+            metadata_current={"new"}.__contains__,
+        )
+        self.assertNotIn("same", inferred)
+        self.assertIn("same", lm_probed)
+
+
+class TestRecordValidators(unittest.TestCase):
+    def test_only_confirmed_rows_keep_validators(self):
+        cache = ValidatorCache(None)
+        cache.record("https://x/changed", {"etag": '"old"'})
+        cache.record("https://x/dropped", {"etag": '"x"'})
+        tag = {"etag": '"t"'}
+        lm_results = [
+            ProbeResult(key=k, status="ok", value="d", validators=tag)
+            for k in ("same", "changed", "new", "flaky")
+        ]
+        lm = {"same": "reuse_existing", "changed": "refresh_md5", "new": "refresh_md5",
+              "flaky": "transient"}
+        final = {"same": "emit_existing", "changed": "emit_existing", "new": "emit_new",
+                 "flaky": "emit_existing"}
+        rows = [{"access_url": f"https://x/{k}"} for k in ("same", "changed", "new", "flaky")]
+        probed = {k: f"https://x/{k}" for k in lm}
+        pipeline.record_validators(cache, lm_results, lm, final, rows, probed)
+        self.assertEqual(cache.get("https://x/same"), tag)
+        self.assertEqual(cache.get("https://x/new"), tag)
+        self.assertIsNone(cache.get("https://x/changed"))
+        self.assertIsNone(cache.get("https://x/flaky"))
+        self.assertIsNone(cache.get("https://x/dropped"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Unit tests for the slotted annotation row type in providers/tools/record.py."""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "providers")
+
+from tools import cache, helper  # noqa: E402
+from tools.record import AnnotationRecord, copy_row  # noqa: E402
+
+
+def _record(**extra) -> AnnotationRecord:
+    fields = {
+        "assembly_accession": "GCA_000001405.29",
+        "organism_name": "".join(["Homo ", "sapiens"]),
+        "source_database": "RefSeq",
+        "pipeline_method": None,
+    }
+    return AnnotationRecord(**{**fields, **extra})
+
+
+class TestAnnotationRecord(unittest.TestCase):
+    def test_behaves_like_a_dict_of_set_fields(self):
+        record = _record()
+        as_dict = {
+            "assembly_accession": "GCA_000001405.29",
+            "organism_name": "Homo sapiens",
+            "source_database": "RefSeq",
+            "pipeline_method": None,
+        }
+        self.assertEqual(record, as_dict)
+        self.assertEqual(dict(record), as_dict)
+        self.assertIn("pipeline_method", record)
+        self.assertNotIn("md5_checksum", record)
+        self.assertIsNone(record.get("md5_checksum"))
+        self.assertEqual(record.get("not_a_field", "x"), "x")
+        with self.assertRaises(KeyError):
+            record["md5_checksum"]
+        with self.assertRaises(KeyError):
+            record["not_a_field"] = "x"
+        self.assertFalse(hasattr(record, "__dict__"))
+
+    def test_categorical_fields_are_interned(self):
+        self.assertIs(_record()["organism_name"], _record()["organism_name"])
+
+    def test_copy_is_independent(self):
+        record = _record()
+        copied = copy_row(record)
+        copied["retrieval_date"] = "2024-01-01"
+        self.assertNotIn("retrieval_date", record)
+        self.assertEqual(type(copy_row(dict(record))), dict)
+        self.assertIsInstance(copy_row({"extra": 1}), dict)
+
+    def test_json_cache_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rows.json")
+            cache.write_json_atomic(path, {"k": _record()})
+            self.assertEqual(cache.read_json(path, {}), {"k": dict(_record())})
+
+    def test_merge_accepts_records_and_dicts(self):
+        existing = {"GCA_000001405.29": dict(_record(md5_checksum="a", retrieval_date="2020-01-01"))}
+        parsed = {"GCA_000001405.29": _record(), "GCA_2": _record(assembly_accession="GCA_2")}
+        parsed["GCA_2"]["md5_checksum"] = "b"
+        parsed["GCA_2"]["release_date"] = "2024-01-01"
+        rows, _ = helper.build_merged_rows(
+            existing,
+            parsed,
+            {"GCA_000001405.29": "emit_existing", "GCA_2": "emit_new"},
+            run_date="2024-02-02",
+            lm_probed_keys={"GCA_000001405.29"},
+            md5_probed_keys=set(),
+        )
+        self.assertEqual(rows[0]["retrieval_date"], "2024-02-02")
+        self.assertEqual(existing["GCA_000001405.29"]["retrieval_date"], "2020-01-01")
+        self.assertIsInstance(rows[1], AnnotationRecord)
+        self.assertNotIn("retrieval_date", parsed["GCA_2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,7 @@ from unittest.mock import patch
 
 sys.path.insert(0, "providers")
 
+import registry  # noqa: E402
 from registry import (  # noqa: E402
     REQUIRED_TSV_HEADER,
     backfill_release_dates,
@@ -163,6 +164,36 @@ class TestScanRegistry(unittest.TestCase):
         self.assertEqual(row["pipeline_name"], "my_project")
         self.assertEqual(row["source_database"], "CommunityRegistry")
 
+    def _project(self, name: str, urls: list[str], version: str = "1.0") -> None:
+        proj = self.root / "registry" / name
+        proj.mkdir(parents=True, exist_ok=True)
+        (proj / "manifest.yaml").write_text(
+            f'provider_name: "Lab"\nreleased: 2024-01-01\npipeline_version: "{version}"\n',
+            encoding="utf-8",
+        )
+        (proj / "annotations.tsv").write_text(
+            REQUIRED_TSV_HEADER + "\n" + "".join(f"GCA_000001405.4\t{u}\n" for u in urls),
+            encoding="utf-8",
+        )
+
+    def test_scan_cache_reuses_unchanged_projects_and_keeps_duplicate_check(self):
+        registry_root = self.root / "registry"
+        cache_file = str(self.root / "scan.json")
+        self._project("alpha", ["https://x/a.gff.gz", "https://x/shared.gff.gz"])
+        self._project("beta", ["https://x/b.gff.gz"])
+
+        with patch("registry.fetch_assembly_metadata", return_value={}):
+            first = scan_registry(registry_root, scan_cache_path=cache_file)
+            self._project("beta", ["https://x/b.gff.gz", "https://x/shared.gff.gz"], "2.0")
+            with patch("registry._parse_project", wraps=registry._parse_project) as parse:
+                second = scan_registry(registry_root, scan_cache_path=cache_file)
+
+        self.assertEqual(sorted(first), ["https://x/a.gff.gz", "https://x/b.gff.gz", "https://x/shared.gff.gz"])
+        self.assertEqual([c.args[0].name for c in parse.call_args_list], ["beta"])
+        self.assertEqual(sorted(second), sorted(first))
+        self.assertEqual(second["https://x/shared.gff.gz"]["pipeline_name"], "alpha")
+        self.assertEqual(second["https://x/b.gff.gz"]["pipeline_version"], "2.0")
+
 
 class TestBackfillReleaseDates(unittest.TestCase):
     def test_fills_release_date_from_last_modified(self):
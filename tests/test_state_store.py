@@ -0,0 +1,64 @@
+"""Unit tests for the mirror state backends in providers/tools/state_store.py."""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "providers")
+
+from tools import file_handler  # noqa: E402
+from tools.state_store import SqliteStateStore, TsvStateStore, open_state_store  # noqa: E402
+
+
+def _row(key: str, retrieved: str = "2024-01-01") -> dict:
+    return {"assembly_accession": key, "taxon_id": 9606, "pipeline_version": None,
+            "retrieval_date": retrieved}
+
+
+class TestSqliteStateStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tsv = os.path.join(tmp.name, "annotations.tsv")
+        self.db = os.path.join(tmp.name, "state.sqlite")
+        file_handler.write_annotations([_row("B"), _row("A")], self.tsv)
+
+    def _store(self) -> SqliteStateStore:
+        store = SqliteStateStore(self.tsv, "assembly_accession", self.db)
+        self.addCleanup(store.close)
+        return store
+
+    def test_loads_like_the_tsv_and_exports_changes(self):
+        store = self._store()
+        self.assertEqual(store.load(), TsvStateStore(self.tsv, "assembly_accession").load())
+
+        store.commit([_row("B", "2024-02-02"), _row("C")], {"B": "emit_existing", "C": "emit_new"})
+        rows, order = self._store().load()
+        self.assertEqual(order, ["B", "C"])
+        self.assertEqual(rows["B"]["retrieval_date"], "2024-02-02")
+        self.assertEqual(rows["C"]["taxon_id"], "9606")
+        self.assertEqual((rows, order), file_handler.load_annotations_ordered(self.tsv, "assembly_accession"))
+
+    def test_unchanged_commit_leaves_tsv_alone(self):
+        store = self._store()
+        rows, order = store.load()
+        os.utime(self.tsv, (0, 0))
+        store.commit([rows[k] for k in order], {})
+        self.assertEqual(os.stat(self.tsv).st_mtime, 0)
+
+    def test_tsv_edited_outside_is_reloaded(self):
+        self._store().load()
+        file_handler.write_annotations([_row("Z")], self.tsv)
+        rows, order = self._store().load()
+        self.assertEqual(order, ["Z"])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            open_state_store(self.tsv, "assembly_accession", "x", backend="parquet")
+
+
+if __name__ == "__main__":
+    unittest.main()